@@ -0,0 +1,148 @@
+""" This module provides the machinery of the asynchronous loading API.
+
+BioImage.aload and the aload methods of ct.py run blocking loads in a shared,
+bounded thread pool, so an asyncio event loop stays responsive while images
+are decoded. The number of loads running at once for each event loop is
+limited, and identical loads requested while one is in flight share its
+result, so many concurrent requests for the same study trigger one decode.
+
+"""
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_concurrency_limit = int(os.environ.get('BIOIMG_ASYNC_CONCURRENCY', 4))
+# Per event loop state: a semaphore and the loads in flight by key
+_loop_states = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    """ Get the executor running asynchronous loads.
+
+    By default, a thread pool is created on first use, with as many threads
+        as the environment variable BIOIMG_ASYNC_WORKERS, or 4.
+
+    Returns:
+        A concurrent.futures.Executor.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.environ.get('BIOIMG_ASYNC_WORKERS', 4))
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix='bioimg-aload')
+        return _executor
+
+
+def set_executor(executor):
+    """ Set the executor running asynchronous loads.
+
+    The previous executor is not shut down.
+
+    Args:
+        executor: A concurrent.futures.Executor, or None for creating the
+            default thread pool on next use.
+    """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+def set_concurrency_limit(limit):
+    """ Set the maximum number of loads running at once in an event loop.
+
+    By default, the limit is the environment variable
+        BIOIMG_ASYNC_CONCURRENCY, or 4. The limit applies to event loops
+        that have not started an asynchronous load yet.
+
+    Args:
+        limit (int): A positive number of loads.
+    """
+    global _concurrency_limit
+    if limit < 1:
+        raise ValueError('The concurrency limit must be positive.')
+    _concurrency_limit = limit
+
+
+def _get_loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = {
+            'semaphore': asyncio.Semaphore(_concurrency_limit),
+            'in_flight': {},
+        }
+    return state
+
+
+async def _run_limited(semaphore, function, entry=None):
+    """ Run function in the executor, holding a slot of the semaphore.
+
+    If cancelled after function started running, the slot is held until
+        function returns, since running functions cannot be stopped.
+    """
+    async with semaphore:
+        future = get_executor().submit(function)
+        if entry is not None:
+            entry['future'] = future
+        waiter = asyncio.wrap_future(future)
+        try:
+            return await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                await asyncio.wait([waiter])
+            raise
+
+
+async def run(key, function):
+    """ Run a blocking function in the executor, sharing identical calls.
+
+    If a call with the same key is in flight in the running event loop, its
+        result is awaited instead of calling function again. Cancelling a
+        caller does not affect other callers of the same key; the call is
+        cancelled only when all its callers are cancelled before it started
+        running in the executor.
+
+    Args:
+        key: A hashable value identifying the call, or None for never
+            sharing the call.
+        function: A callable taking no arguments.
+
+    Returns:
+        The value returned by function.
+    """
+    state = _get_loop_state()
+    if key is None:
+        return await _run_limited(state['semaphore'], function)
+    in_flight = state['in_flight']
+    entry = in_flight.get(key)
+    if entry is None:
+        entry = in_flight[key] = {'future': None, 'waiters': 0}
+        task = entry['task'] = asyncio.ensure_future(
+            _run_limited(state['semaphore'], function, entry))
+
+        def remove(_, key=key, entry=entry):
+            if in_flight.get(key) is entry:
+                del in_flight[key]
+        task.add_done_callback(remove)
+    entry['waiters'] += 1
+    try:
+        return await asyncio.shield(entry['task'])
+    except asyncio.CancelledError:
+        # A call running in the executor is kept, and shared by later
+        # callers of the same key, until it returns
+        future = entry['future']
+        if entry['waiters'] == 1 and not entry['task'].done() and \
+                (future is None or future.cancel()):
+            # New callers must not join the task being cancelled
+            if in_flight.get(key) is entry:
+                del in_flight[key]
+            entry['task'].cancel()
+        raise
+    finally:
+        entry['waiters'] -= 1
@@ -0,0 +1,459 @@
+""" This module provides functionality for loading whole catalogs in parallel
+    or as streams.
+
+"""
+import collections
+import functools
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+from constants import Modality
+from ct import AutoImage
+from ct import DICOMCTDIR
+from ct import SimpleImage
+from shm import ensure_tracker_running
+from utils import iter_catalog
+
+
+MODALITY_TO_CT_CLASS = {
+    Modality.DICOM_CT_DIR: DICOMCTDIR,
+    Modality.SIMPLE_IMAGE: SimpleImage,
+    Modality.AUTO: AutoImage,
+}
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+LoadResult = collections.namedtuple(
+    'LoadResult',
+    ['index', 'sample_id', 'image_id', 'image', 'mask', 'error'])
+LoadResult.__doc__ = """ The outcome of loading one row of a catalog.
+
+    Attributes:
+        index (int): Position of the row in the catalog.
+        sample_id (str): The sample identifier of the row.
+        image_id (str): The image identifier of the row.
+        image: A SimpleITK.Image, a bioimage.ImageHeader when probing, a
+            shm.SharedVolume when loading into shared memory, or None if
+            loading failed.
+        mask: An object of the same kind as image, or None if loading
+            failed or the row has no mask.
+        error: The exception raised while loading the row, or None.
+"""
+
+Sample = collections.namedtuple(
+    'Sample', ['sample_id', 'image_id', 'image', 'mask'])
+Sample.__doc__ = """ A loaded catalog row.
+
+    Attributes:
+        sample_id (str): The sample identifier of the row.
+        image_id (str): The image identifier of the row.
+        image: A numpy array containing the image voxel values.
+        mask: A numpy array containing the mask voxel values, or None.
+"""
+
+
+def create_ct(record, modality):
+    """ Create a DICOMCTDIR, SimpleImage or AutoImage object from a row.
+
+    Args:
+        record: A catalog row as returned by utils.read_catalog, i.e.
+            (1) sample_id, (2) image_id, (3) image_src, and optionally
+            (4) mask_src. An empty mask_src means the image has no mask.
+        modality: A Modality value.
+
+    Returns:
+        A DICOMCTDIR, SimpleImage or AutoImage object.
+
+    """
+    ct_class = MODALITY_TO_CT_CLASS.get(modality)
+    if ct_class is None:
+        raise ValueError('Undefined modality: {}'.format(modality))
+    sample_id, image_id, image_path = record[:3]
+    mask_path = record[3] if len(record) > 3 and record[3] else None
+    return ct_class(sample_id, image_id, image_path, mask_path=mask_path)
+
+
+def create_failed_result(index, record, error, result_type=LoadResult):
+    """ Create a result reporting a failure for a catalog row.
+
+    Args:
+        index (int): Position of the row in the catalog.
+        record: The catalog row.
+        error: The exception raised while processing the row.
+        result_type: A namedtuple type with index, sample_id, image_id and
+            error fields. Its other fields are set to None.
+
+    Returns:
+        A result_type object.
+    """
+    fields = dict.fromkeys(result_type._fields)
+    fields.update(index=index, error=error,
+                  sample_id=record[0] if len(record) > 0 else None,
+                  image_id=record[1] if len(record) > 1 else None)
+    return result_type(**fields)
+
+
+def _process_record(index, record, modality, method):
+    """ Load or probe one catalog row, capturing any failure in the result."""
+    try:
+        ct = create_ct(record, modality)
+        image, mask = getattr(ct, method)()
+    except Exception as error:
+        return create_failed_result(index, record, error)
+    return LoadResult(index, ct.sample_id, ct.image_id, image, mask, None)
+
+
+def map_catalog(catalog, function, num_workers=4, executor='thread',
+                ordered=True, max_in_flight=None, failed_result=None,
+                initializer=None, initargs=()):
+    """ Apply a function to each catalog row using a pool of workers.
+
+    At most max_in_flight rows are being processed, or are processed but
+        not yet consumed, at any time.
+
+    Args:
+        catalog: A sequence of catalog rows as returned by
+            utils.read_catalog.
+        function: A callable taking the index of a row and the row. It must
+            be picklable for the 'process' executor.
+        num_workers (int): Number of threads or processes.
+        executor (str): Either 'thread' or 'process'.
+        ordered (bool): If True, results are yielded in catalog order.
+            Otherwise, results are yielded as soon as they are ready.
+        max_in_flight (int): Maximum number of rows being processed or
+            waiting to be consumed. Default is 2 * num_workers.
+        failed_result: A callable taking the index of a row, the row and an
+            exception, used for reporting a failure of the worker itself,
+            e.g. a crashed process. Default creates a LoadResult. If a
+            process crashes, the rows being processed by the pool are
+            reported as failed and the pool is recreated for the other
+            rows.
+        initializer: A callable run once in each worker.
+        initargs: Arguments of initializer.
+
+    Yields:
+        The value returned by function for each row.
+
+    """
+    if failed_result is None:
+        failed_result = create_failed_result
+    if executor not in EXECUTORS:
+        msg = 'executor must be one of {}, but it is {}.'
+        raise ValueError(msg.format(sorted(EXECUTORS), executor))
+    if num_workers < 1:
+        raise ValueError('num_workers must be a positive integer.')
+    if max_in_flight is None:
+        max_in_flight = 2 * num_workers
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be a positive integer.')
+    records = enumerate(catalog)
+
+    def create_pool():
+        return EXECUTORS[executor](max_workers=num_workers,
+                                   initializer=initializer,
+                                   initargs=initargs)
+
+    pool = create_pool()
+    pending = collections.OrderedDict()
+
+    def submit(index, record):
+        nonlocal pool
+        try:
+            try:
+                return pool.submit(function, index, record)
+            except BrokenProcessPool:
+                # A worker crashed; the futures of the broken pool already
+                # report the failure, so the other rows use a new pool.
+                pool.shutdown(wait=True, cancel_futures=True)
+                pool = create_pool()
+                return pool.submit(function, index, record)
+        except Exception as error:
+            future = Future()
+            future.set_exception(error)
+            return future
+
+    def submit_next():
+        for index, record in records:
+            pending[submit(index, record)] = (index, record)
+            return True
+        return False
+
+    try:
+        while len(pending) < max_in_flight and submit_next():
+            pass
+        while pending:
+            if ordered:
+                future = next(iter(pending))
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+            index, record = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as error:
+                # The worker itself failed, e.g. its process crashed.
+                result = failed_result(index, record, error)
+            submit_next()
+            yield result
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def load_catalog(catalog, modality, num_workers=4, executor='thread',
+                 ordered=True, max_in_flight=None, shared_memory=False):
+    """ Load image/mask pairs of a catalog using a pool of workers.
+
+    Rows are loaded lazily: at most max_in_flight rows are being loaded,
+    or are loaded but not yet consumed, at any time. This bounds the
+    number of volumes held in memory regardless of the catalog size.
+
+    Args:
+        catalog: A sequence of catalog rows as returned by
+            utils.read_catalog.
+        modality: A Modality value used for every row of the catalog.
+        num_workers (int): Number of threads or processes.
+        executor (str): Either 'thread' or 'process'.
+        ordered (bool): If True, results are yielded in catalog order.
+            Otherwise, results are yielded as soon as they are loaded.
+        max_in_flight (int): Maximum number of rows being loaded or
+            waiting to be consumed. Default is 2 * num_workers.
+        shared_memory (bool): If True, worker processes return images and
+            masks in shared memory, as shm.SharedVolume objects, instead of
+            pickling their voxel values. Requires the 'process' executor.
+
+    Yields:
+        A LoadResult for each row. Failures are reported through the
+            error attribute and do not stop loading the other rows.
+
+    """
+    method = 'load'
+    if shared_memory:
+        if executor != 'process':
+            msg = 'Shared memory requires the process executor, not {}.'
+            raise ValueError(msg.format(executor))
+        # Workers must share the resource tracker of this process, so that
+        # the blocks they create outlive them.
+        ensure_tracker_running()
+        method = 'load_shared'
+    function = functools.partial(_process_record, modality=modality,
+                                 method=method)
+    return map_catalog(catalog, function, num_workers=num_workers,
+                       executor=executor, ordered=ordered,
+                       max_in_flight=max_in_flight)
+
+
+def _check_series(header, expected_series=None):
+    """ Check the DICOM series of a header, see probe_catalog."""
+    if header.num_series is not None and header.num_series > 1:
+        msg = ('{} contains {} DICOM series, but no series is selected; the '
+               'first one is read.')
+        raise ValueError(msg.format(os.path.dirname(header.file_names[0]),
+                                    header.num_series))
+    if expected_series is not None and header.series_id != expected_series:
+        msg = 'Series {} is read, but series {} is expected.'
+        raise ValueError(msg.format(header.series_id, expected_series))
+
+
+def _probe_item(index, item, modality):
+    """ Probe a (record, expected series) item and check its series."""
+    record, expected_series = item
+    result = _process_record(index, record, modality, 'probe')
+    if result.error is not None:
+        return result
+    try:
+        _check_series(result.image, expected_series)
+        if result.mask is not None:
+            _check_series(result.mask)
+    except ValueError as error:
+        return result._replace(error=error)
+    return result
+
+
+def _failed_probe(index, item, error):
+    return create_failed_result(index, item[0], error)
+
+
+def probe_catalog(catalog, modality, num_workers=4, executor='thread',
+                  raise_on_error=True, expected_series=None):
+    """ Read the headers of image/mask pairs of a catalog in parallel.
+
+    No voxel values are decoded. Each image/mask pair is checked for
+        matching size, spacing, origin and direction. Rows whose image or
+        mask directory contains more than one DICOM series are reported,
+        since the series read by default is then ambiguous, as are images
+        whose series differs from the expected one.
+
+    Args:
+        catalog: A sequence of catalog rows as returned by
+            utils.read_catalog.
+        modality: A Modality value used for every row of the catalog.
+        num_workers (int): Number of threads or processes.
+        executor (str): Either 'thread' or 'process'.
+        raise_on_error (bool): If True, a ValueError listing every failed
+            row is raised after all rows are probed. Default is True.
+        expected_series (dict): Maps (sample_id, image_id) pairs to the
+            series instance UID expected for the image of the row. Default
+            is None for not checking series UIDs.
+
+    Returns:
+        A list of LoadResult objects, in catalog order, whose image and mask
+            attributes are bioimage.ImageHeader objects. Rows failing the
+            series checks keep their headers.
+
+    """
+    expected_series = expected_series or {}
+    items = [(record, expected_series.get(tuple(record[:2])))
+             for record in catalog]
+    function = functools.partial(_probe_item, modality=modality)
+    results = list(map_catalog(items, function, num_workers=num_workers,
+                               executor=executor,
+                               failed_result=_failed_probe))
+    failures = [r for r in results if r.error is not None]
+    if raise_on_error and failures:
+        lines = ['Row {} ({}, {}): {}'.format(r.index, r.sample_id,
+                                              r.image_id, r.error)
+                 for r in failures]
+        msg = '{} of {} catalog rows are invalid:\n{}'
+        raise ValueError(msg.format(len(failures), len(results),
+                                    '\n'.join(lines)))
+    return results
+
+
+def iter_cts(records, modality):
+    """ Create a DICOMCTDIR or SimpleImage object for each catalog row.
+
+    Args:
+        records: An iterable of catalog rows.
+        modality: A Modality value used for every row.
+
+    Yields:
+        A DICOMCTDIR or SimpleImage object.
+
+    """
+    for record in records:
+        yield create_ct(record, modality)
+
+
+def iter_samples(cts, transform=None):
+    """ Load DICOMCTDIR or SimpleImage objects as numpy arrays.
+
+    Args:
+        cts: An iterable of DICOMCTDIR or SimpleImage objects.
+        transform: A callable applied to the loaded image and mask. It takes
+            two SimpleITK.Image objects, the mask being possibly None, and
+            returns the transformed image and mask. Default is None.
+
+    Yields:
+        A Sample for each object.
+
+    """
+    for ct in cts:
+        image, mask = ct.load()
+        if transform is not None:
+            image, mask = transform(image, mask)
+        if mask is not None:
+            mask = ct.get_array(mask, copy=True)
+        yield Sample(ct.sample_id, ct.image_id,
+                     ct.get_array(image, copy=True), mask)
+
+
+_END_OF_STREAM = object()
+
+
+def prefetch(iterable, size=2):
+    """ Consume an iterable in a background thread.
+
+    Up to size items are produced ahead of the consumer, counting the item
+        being produced but not the item the consumer holds, so producing
+        the next items, e.g. decoding DICOM files, overlaps with the work the
+        consumer does on the current item. An exception raised while
+        producing an item is raised by the consumer when reaching that item.
+
+    Args:
+        iterable: An iterable.
+        size (int): The maximum number of items produced ahead.
+
+    Yields:
+        The items of iterable, in order.
+
+    """
+    if size < 1:
+        raise ValueError('size must be a positive integer.')
+    # The queue is bounded by slots, acquired before producing an item and
+    # released when the consumer takes it, so putting never blocks.
+    items = queue.Queue()
+    slots = threading.Semaphore(size)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            iterator = iter(iterable)
+            while True:
+                while not slots.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set():
+                    return
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    items.put((_END_OF_STREAM, None))
+                    return
+                items.put((item, None))
+        except BaseException as error:
+            # Including e.g. SystemExit, so the consumer never waits forever
+            items.put((None, error))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            slots.release()
+            if error is not None:
+                raise error
+            if item is _END_OF_STREAM:
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def stream_catalog(catalog_file_path, modality, sep=',', transform=None,
+                   prefetch_size=2):
+    """ Stream the samples of a Catalog file as numpy arrays.
+
+    The catalog is read lazily and chained through a generator pipeline:
+        parse row -> create DICOMCTDIR/SimpleImage -> load -> transform ->
+        convert to numpy arrays. The next prefetch_size samples are loaded
+        in a background thread while the consumer works on the current one.
+
+    Args:
+        catalog_file_path: Address of a catalog file.
+        modality: A Modality value used for every row of the catalog.
+        sep: A field seperator.
+        transform: A callable applied to the loaded image and mask, see
+            iter_samples. Default is None.
+        prefetch_size (int): The number of samples loaded ahead. Use 0 for
+            loading samples in the consumer thread.
+
+    Yields:
+        A Sample for each row of the catalog.
+
+    """
+    records = iter_catalog(catalog_file_path, sep=sep)
+    samples = iter_samples(iter_cts(records, modality), transform=transform)
+    if prefetch_size == 0:
+        return samples
+    return prefetch(samples, size=prefetch_size)
@@ -1,47 +1,463 @@
 """ Include the object used for reading different file formats.
 
 """
+import collections
+import functools
 import os
+import numpy as np
 import SimpleITK as sitk
 
+import aio
+import profiling
+from cache import get_disk_cache
+from cache import get_memory_cache
+from chunked import ChunkedVolume
+from chunked import read_chunked_header
 from constants import Modality
+from formats import read_nifti_gz
+from formats import read_numpy
+from formats import read_numpy_array
+from lazy import LazyDICOMVolume
+from roi import crop_image
+from series import SeriesIndex
+from utils import find_DICOM_series
+from utils import fingerprint
 from utils import read_DICOM_from_dir
 
 
+class ImageHeader(object):
+    """ The header of an image, i.e. its geometry and metadata.
+
+    An ImageHeader provides GetSize, GetSpacing, GetOrigin, and GetDirection
+        similar to SimpleITK.Image, so it can be used wherever the geometry
+        of an image is needed, e.g. ct.check_geometry.
+
+    Args:
+        size: Image size as (x, y, z).
+        spacing: Voxel spacing as (x, y, z).
+        origin: Physical coordinates of the first voxel.
+        direction: The direction cosine matrix as a flat tuple.
+        pixel_type (str): Pixel type, e.g. '16-bit signed integer'.
+        metadata (dict): Metadata of the image, or of the first slice for
+            DICOM series.
+        series_id (str): The series identifier of a DICOM series, or None.
+        file_names: The files the image is read from.
+        num_series (int): The number of DICOM series in the directory of a
+            series selected by default, i.e. as the first series, or None if
+            the series was selected explicitly or is not a DICOM series.
+    """
+    def __init__(self, size, spacing, origin, direction, pixel_type,
+                 metadata, series_id=None, file_names=(), num_series=None):
+        self.size = tuple(size)
+        self.spacing = tuple(spacing)
+        self.origin = tuple(origin)
+        self.direction = tuple(direction)
+        self.pixel_type = pixel_type
+        self.metadata = metadata
+        self.series_id = series_id
+        self.file_names = tuple(file_names)
+        self.num_series = num_series
+
+    def GetSize(self):
+        return self.size
+
+    def GetSpacing(self):
+        return self.spacing
+
+    def GetOrigin(self):
+        return self.origin
+
+    def GetDirection(self):
+        return self.direction
+
+    def __str__(self):
+        return 'Size: {}, Spacing: {}, Pixel type: {}'.format(
+            self.size, self.spacing, self.pixel_type)
+
+
 class BioImage(object):
     """ Object used for reading biomedical images of different formats.
 
+    For directories containing more than one DICOM series, a series can be
+        selected by its UID or by a predicate on series.SeriesEntry objects.
+        When a series.SeriesIndex is given, the series is looked up in the
+        index rather than by scanning the directory.
+
     Args:
         source: The source from which a biomedical image should be read.
-        modality: A BioImageModality value 
+        modality: A Modality value, or any modality registered using
+            register_modality. Modality.AUTO detects the modality from
+            source, see detect_modality.
+        series: A series instance UID, or a callable taking a
+            series.SeriesEntry and returning a bool. Default is None for the
+            first series found in the directory, with or without
+            series_index.
+        series_index: A series.SeriesIndex containing the series of source.
     """
-    def __init__(self, source, modality=None):
+    def __init__(self, source, modality=None, series=None, series_index=None):
         self.source = source
+        if modality == Modality.AUTO:
+            modality = detect_modality(source) or Modality.AUTO
         self.modality = modality
+        self.series = series
+        self.series_index = series_index
+
+    def select_series(self):
+        """ Select the DICOM series to read.
+
+        Returns:
+            The UID of the selected series, or None for the first series of
+                the directory.
+            The files of the selected series sorted by geometry, or None if
+                they are not known without scanning the directory.
+
+        """
+        loader = _LOADERS.get(self.modality)
+        if loader is None or not loader.series:
+            return None, None
+        if self.series_index is None:
+            if self.series is None or isinstance(self.series, str):
+                return self.series, None
+            series_index = SeriesIndex.build(self.source, recursive=False)
+        else:
+            series_index = self.series_index
+        if self.series is None:
+            # As when scanning, the first series of the directory is read
+            entries = series_index.find(directory=self.source)
+            if not entries:
+                msg = 'No series is indexed within directory {}.'
+                raise ValueError(msg.format(self.source))
+            entry = entries[0]
+        else:
+            entry = series_index.select(self.series, directory=self.source)
+        return entry.series_id, entry.file_names
 
     def load(self):
         """ Load voxel values for an image.
 
+        If a memory cache is set using cache.set_memory_cache, the image is
+            returned from the memory cache when it was loaded before. If a
+            disk cache is set using cache.set_disk_cache, the image is read
+            from the disk cache when its source files have not changed since
+            it was cached.
+
         Returns:
             A SimpleITK.Image.
 
         """
-        modality_to_load_function_map = {
-            Modality.DICOM_CT_DIR: BioImage.load_dicom_from_dir,
-            Modality.SIMPLE_IMAGE: BioImage.load_simple_image_from_file,
-            Modality.DICOM_CT_SLICE: BioImage.load_dicom_slice_from_file,
-        }
-        load_function = modality_to_load_function_map.get(self.modality)
-        if load_function:
+        with profiling.stage('BioImage.load') as stage:
+            image = self._load()
+            stage.add(voxels=image.GetNumberOfPixels())
+        return image
+
+    def load_key(self):
+        """ Get a key identifying the image loaded by load.
+
+        Returns:
+            A hashable value, or None if the series is selected by a
+                predicate, in which case loads are not identified.
+        """
+        if self.series is not None and not isinstance(self.series, str):
+            return None
+        if self.series_index is None:
+            return (os.path.abspath(self.source), self.modality, self.series)
+        # The files of the series identify the load, whatever the index
+        series_id, slice_paths = self.select_series()
+        return (os.path.abspath(self.source), self.modality, series_id,
+                slice_paths)
+
+    async def aload(self):
+        """ Load voxel values for an image without blocking the event loop.
+
+        The image is loaded by load in the executor of aio.get_executor. At
+            most aio.set_concurrency_limit loads run at once, and concurrent
+            calls loading the same image share one load.
+
+        Returns:
+            A SimpleITK.Image.
+
+        """
+        image = await aio.run(self.load_key(), self.load)
+        # Callers sharing a load get their own copy-on-write image
+        return sitk.Image(image)
+
+    def _memory_cache_key(self, loader):
+        # The series is looked up only on a miss, so the key holds the
+        # series as given, e.g. a predicate, rather than its UID
+        return (os.path.abspath(self.source), self.modality,
+                self.series if loader.series else None)
+
+    def _load(self):
+        loader = get_loader(self.modality, self.source)
+        memory_cache = get_memory_cache()
+        if memory_cache is not None:
+            key = self._memory_cache_key(loader)
+            image = memory_cache.get(key)
+            if image is not None:
+                return image
+        load_function = loader.load
+        series_id = None
+        if loader.series:
+            with profiling.stage('BioImage.select_series'):
+                series_id, slice_paths = self.select_series()
+            load_function = functools.partial(load_function,
+                                              series_id=series_id,
+                                              slice_paths=slice_paths)
+        image = self._load_through_disk_cache(load_function, series_id)
+        if memory_cache is not None:
+            memory_cache.put(key, image)
+        return image
+
+    def _load_through_disk_cache(self, load_function, series_id):
+        """ Load the image using the disk cache, if one is set."""
+        disk_cache = get_disk_cache()
+        if disk_cache is None or not os.path.exists(self.source):
             return load_function(self.source)
+        key = disk_cache.make_key(fingerprint(self.source), self.modality,
+                                  series_id)
+        with profiling.stage('BioImage.disk_cache_get'):
+            image = disk_cache.get(key)
+        if image is None:
+            image = load_function(self.source)
+            disk_cache.put(key, image, source=self.source)
+        return image
 
-        raise ValueError('Undefined modality.')
+    def load_region(self, start, size):
+        """ Load the voxel values of a region of an image.
+
+        For the DICOM_CT_DIR modality, only the slices of the region are
+            decoded. For the SIMPLE_IMAGE modality, only the region is read
+            from formats supporting streaming, e.g. NRRD or uncompressed
+            NIfTI. Images of other modalities, or found in the memory cache,
+            are loaded and cropped. The disk cache is not used.
+
+        Args:
+            start: The start index of the region in numpy order, i.e.
+                (z, y, x) for 3D images.
+            size: The size of the region in numpy order.
+
+        Returns:
+            A SimpleITK.Image whose geometry is that of the region.
+
+        """
+        slices = tuple(slice(int(s), int(s) + int(n))
+                       for s, n in zip(start, size))
+        with profiling.stage('BioImage.load_region') as stage:
+            image = self._load_region(slices)
+            stage.add(voxels=image.GetNumberOfPixels())
+        return image
+
+    def _load_region(self, slices):
+        loader = get_loader(self.modality, self.source)
+        memory_cache = get_memory_cache()
+        if memory_cache is not None:
+            image = memory_cache.get(self._memory_cache_key(loader))
+            if image is not None:
+                return crop_image(image, slices)
+        if self.modality == Modality.SIMPLE_IMAGE:
+            reader = sitk.ImageFileReader()
+            reader.SetFileName(self.source)
+            reader.SetExtractIndex([s.start for s in slices[::-1]])
+            reader.SetExtractSize([s.stop - s.start for s in slices[::-1]])
+            return reader.Execute()
+        if self.modality != Modality.DICOM_CT_DIR or len(slices) != 3:
+            return crop_image(self.load(), slices)
+        series_id, slice_paths = self.select_series()
+        if slice_paths is None:
+            slice_paths = find_DICOM_series(self.source, series_id=series_id)
+        first, stop = slices[0].start, slices[0].stop
+        # The slice spacing is computed from the positions of the files
+        # read, so at least two files are read if the series has them.
+        if stop - first < 2 <= len(slice_paths):
+            if stop < len(slice_paths):
+                stop += 1
+            else:
+                first -= 1
+        image = read_DICOM_from_dir(self.source, slice_tags=None,
+                                    slice_paths=slice_paths[first: stop])
+        return crop_image(image, (slice(slices[0].start - first,
+                                        slices[0].stop - first),)
+                          + slices[1:])
+
+    def probe(self):
+        """ Read the header of an image without decoding its voxel values.
+
+        Returns:
+            An ImageHeader.
+
+        """
+        loader = get_loader(self.modality, self.source)
+        if loader.probe is None:
+            msg = 'Probing is not supported for modality {}.'
+            raise ValueError(msg.format(self.modality))
+        if loader.series:
+            series_id, slice_paths = self.select_series()
+            header = loader.probe(self.source, series_id=series_id,
+                                  slice_paths=slice_paths)
+            if self.series is None and self.series_index is not None:
+                header.num_series = len(
+                    self.series_index.find(directory=self.source))
+            return header
+        return loader.probe(self.source)
 
     @classmethod
-    def load_dicom_from_dir(cls, dir_path):
+    def _read_information(cls, file_path):
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(file_path)
+        reader.ReadImageInformation()
+        return reader
+
+    @classmethod
+    def probe_file(cls, file_path):
+        """ Read the header of an image file.
+
+        Args:
+            file_path (str): Address of the image file.
+
+        Returns:
+            An ImageHeader.
+        """
+        reader = BioImage._read_information(file_path)
+        metadata = {k: reader.GetMetaData(k) for k in reader.GetMetaDataKeys()}
+        pixel_type = sitk.GetPixelIDValueAsString(reader.GetPixelIDValue())
+        return ImageHeader(reader.GetSize(), reader.GetSpacing(),
+                           reader.GetOrigin(), reader.GetDirection(),
+                           pixel_type, metadata, file_names=[file_path])
+
+    @classmethod
+    def probe_chunked_volume(cls, file_path):
+        """ Read the header of a chunked volume file.
+
+        Args:
+            file_path (str): Address of the file.
+
+        Returns:
+            An ImageHeader.
+        """
+        header = read_chunked_header(file_path)
+        pixel_type = sitk.GetImageFromArray(
+            np.zeros((1, 1, 1), dtype=np.dtype(header['dtype']))) \
+            .GetPixelIDTypeAsString()
+        return ImageHeader(header['shape'][::-1], header['spacing'],
+                           header['origin'], header['direction'], pixel_type,
+                           header['metadata'], file_names=[file_path])
+
+    @classmethod
+    def probe_numpy_file(cls, file_path):
+        """ Read the header of a .npy or .npz file, see formats.read_numpy.
+
+        Args:
+            file_path (str): Address of the file.
+
+        Returns:
+            An ImageHeader.
+        """
+        voxels, geometry = read_numpy_array(file_path)
+        dimension = voxels.ndim
+        identity = tuple(np.eye(dimension).ravel())
+        pixel_type = sitk.GetImageFromArray(
+            np.zeros((1,) * dimension, dtype=voxels.dtype)) \
+            .GetPixelIDTypeAsString()
+        return ImageHeader(voxels.shape[::-1],
+                           geometry.get('spacing', (1.0,) * dimension),
+                           geometry.get('origin', (0.0,) * dimension),
+                           geometry.get('direction', identity), pixel_type,
+                           {}, file_names=[file_path])
+
+    @classmethod
+    def probe_dicom_dir(cls, dir_path, series_id=None, slice_paths=None):
+        """ Read the header of a DICOM series from the headers of its files.
+
+        Only the first and the last file of the series are parsed. The slice
+            spacing is the average distance between consecutive slices.
+
+        Args:
+            dir_path (str): Address of the directory containing DICOM files.
+            series_id (str): The UID of the series. Default is None for the
+                first series found in the directory.
+            slice_paths: Addresses of the files of the series, sorted by
+                geometry. If given, the directory is not scanned.
+
+        Returns:
+            An ImageHeader.
+        """
+        if not os.path.isdir(dir_path):
+            msg = '{} must be a directory address, but it is not.'
+            raise ValueError(msg.format(dir_path))
+        num_series = None
+        if slice_paths is None:
+            if series_id is None:
+                with profiling.stage('find_DICOM_series.scan'):
+                    series_ids = \
+                        sitk.ImageSeriesReader.GetGDCMSeriesIDs(dir_path)
+                num_series = len(series_ids)
+                if num_series == 0:
+                    msg = 'No DICOM file in directory:\n{}'
+                    raise ValueError(msg.format(dir_path))
+                # Reuse the scan instead of letting find_DICOM_series
+                # list the series of the directory again.
+                series_id = series_ids[0]
+            slice_paths = find_DICOM_series(dir_path, series_id=series_id)
+        file_names = slice_paths
+        header = BioImage.probe_file(file_names[0])
+        size = header.size[:2] + (len(file_names),)
+        spacing = header.spacing
+        if len(file_names) > 1:
+            last = BioImage._read_information(file_names[-1])
+            distance = np.linalg.norm(np.subtract(last.GetOrigin(),
+                                                  header.origin))
+            slice_spacing = float(distance) / (len(file_names) - 1)
+            spacing = spacing[:2] + (slice_spacing,)
+        series_id = header.metadata.get('0020|000e', '').strip()
+        return ImageHeader(size, spacing, header.origin, header.direction,
+                           header.pixel_type, header.metadata,
+                           series_id=series_id,
+                           file_names=file_names, num_series=num_series)
+
+    def load_lazy(self, max_cached_slices=64):
+        """ Create a volume whose slices are decoded only when indexed.
+
+        The DICOM_CT_DIR and CHUNKED_VOLUME modalities are supported. For
+            chunked volumes, whole chunks are decoded and cached.
+
+        Args:
+            max_cached_slices (int): The maximum number of decoded slices
+                kept in memory. Use None for caching all decoded slices.
+
+        Returns:
+            A LazyDICOMVolume, or a chunked.ChunkedVolume.
+
+        """
+        if self.modality == Modality.CHUNKED_VOLUME:
+            max_cached_chunks = None
+            if max_cached_slices is not None:
+                chunk_slices = read_chunked_header(self.source)['chunk_slices']
+                max_cached_chunks = max(1, max_cached_slices // chunk_slices)
+            return ChunkedVolume(self.source,
+                                 max_cached_chunks=max_cached_chunks)
+        if self.modality != Modality.DICOM_CT_DIR:
+            msg = 'Lazy loading is not supported for modality {}.'
+            raise ValueError(msg.format(self.modality))
+        if not os.path.isdir(self.source):
+            msg = '{} must be a directory address, but it is not.'
+            raise ValueError(msg.format(self.source))
+        series_id, slice_paths = self.select_series()
+        if slice_paths is not None:
+            return LazyDICOMVolume(slice_paths,
+                                   max_cached_slices=max_cached_slices)
+        return LazyDICOMVolume.from_dir(self.source,
+                                        max_cached_slices=max_cached_slices,
+                                        series_id=series_id)
+
+    @classmethod
+    def load_dicom_from_dir(cls, dir_path, series_id=None, slice_paths=None):
         """ Load an image (or its contours) from a directory.
         Args:
             dir_path (str): Address of the directory containing the DICOM files.
+            series_id (str): The UID of the series. Default is None for the
+                first series found in the directory.
+            slice_paths: Addresses of the files of the series, sorted by
+                geometry. If given, the directory is not scanned.
 
         Returns:
             A SimpleITK image.
@@ -49,7 +465,8 @@ class BioImage(object):
         if not os.path.isdir(dir_path):
             msg = '{} must be a directory address, but it is not.'
             raise ValueError(msg.format(dir_path))
-        image = read_DICOM_from_dir(dir_path)
+        image = read_DICOM_from_dir(dir_path, series_id=series_id,
+                                    slice_paths=slice_paths)
         return image
 
     @classmethod
@@ -64,9 +481,25 @@ class BioImage(object):
         Returns:
             A SimpleITK image.
         """
-        image = sitk.ReadImage(file_path)
+        with profiling.stage('BioImage.decode') as stage:
+            image = sitk.ReadImage(file_path)
+            if profiling.is_enabled():
+                stage.add(bytes_read=os.path.getsize(file_path),
+                          voxels=image.GetNumberOfPixels())
         return image
 
+    @classmethod
+    def load_chunked_volume(cls, file_path):
+        """ Load an image (or its contours) from a chunked volume file.
+
+        Args:
+            file_path (str): Address of a '.biv' file.
+
+        Returns:
+            A SimpleITK image.
+        """
+        return ChunkedVolume(file_path).read_image()
+
     @classmethod
     def load_dicom_slice_from_file(cls, file_path):
         """ Load a slice of a CT image (or its contours) from a DICOM file.
@@ -76,7 +509,7 @@ class BioImage(object):
         Returns:
             A SimpleITK image.
         """
-        return sitk.ReadImage(file_path)
+        return BioImage.load_simple_image_from_file(file_path)
 
     def __str__(self):
         """ A string representation of a BioImage object.
@@ -86,3 +519,112 @@ class BioImage(object):
 
         """
         return 'Modality: {}, Source: {} '.format(self.modality, self.source)
+
+
+ModalityLoader = collections.namedtuple(
+    'ModalityLoader', ['load', 'probe', 'detect', 'series'])
+ModalityLoader.__doc__ = """ The functions used for reading a modality.
+
+    Attributes:
+        load: A function taking a source and returning a SimpleITK.Image.
+        probe: A function taking a source and returning an ImageHeader, or
+            None if probing is not supported.
+        detect: A function taking a source and returning True if the source
+            is of the modality, or None if the modality is never detected.
+        series (bool): If True, load and probe also take the series_id and
+            slice_paths keyword arguments, see BioImage.select_series.
+"""
+
+# Loaders of the registered modalities in the order of registration
+_LOADERS = collections.OrderedDict()
+
+# Extensions of files read by SimpleITK, detected as Modality.SIMPLE_IMAGE
+SIMPLE_IMAGE_EXTENSIONS = ('.nii', '.nrrd', '.nhdr', '.mha', '.mhd', '.hdr',
+                           '.img', '.vtk', '.tif', '.tiff', '.png')
+
+
+def register_modality(modality, load, probe=None, detect=None,
+                      series=False):
+    """ Register the functions used by BioImage for reading a modality.
+
+    Registering an already registered modality replaces its functions.
+
+    Args:
+        modality (str): A Modality value or a new modality name.
+        load: A function taking a source and returning a SimpleITK.Image.
+        probe: A function taking a source and returning an ImageHeader.
+            Default is None for modalities that cannot be probed.
+        detect: A function taking a source and returning True if the source
+            is of the modality, used by detect_modality. Modalities
+            registered later are tried first.
+        series (bool): If True, load and probe also take the series_id and
+            slice_paths keyword arguments.
+    """
+    _LOADERS.pop(modality, None)
+    _LOADERS[modality] = ModalityLoader(load, probe, detect, series)
+
+
+def get_loader(modality, source=None):
+    """ Get the functions registered for reading a modality.
+
+    Args:
+        modality (str): A registered modality.
+        source: The source being read, used in error messages.
+
+    Returns:
+        A ModalityLoader.
+    """
+    loader = _LOADERS.get(modality)
+    if loader is None:
+        if modality == Modality.AUTO:
+            msg = 'Could not detect the modality of {}.'
+            raise ValueError(msg.format(source))
+        raise ValueError('Undefined modality.')
+    return loader
+
+
+def detect_modality(source):
+    """ Detect the modality of a source from its path.
+
+    A directory is detected as Modality.DICOM_CT_DIR, a '.dcm' file as
+        Modality.DICOM_CT_SLICE, a '.nii.gz' file as Modality.NIFTI_GZ,
+        '.npy' and '.npz' files as Modality.NUMPY, '.biv' files as
+        Modality.CHUNKED_VOLUME, and other files read by
+        SimpleITK, e.g. '.nii', '.nrrd' or '.mha', as Modality.SIMPLE_IMAGE.
+
+    Args:
+        source (str): Address of a file or a directory.
+
+    Returns:
+        A registered modality, or None if no modality matches source.
+    """
+    for modality, loader in reversed(_LOADERS.items()):
+        if loader.detect is not None and loader.detect(source):
+            return modality
+    return None
+
+
+def _has_extension(*extensions):
+    return lambda source: source.lower().endswith(extensions)
+
+
+register_modality(Modality.SIMPLE_IMAGE,
+                  BioImage.load_simple_image_from_file,
+                  probe=BioImage.probe_file,
+                  detect=_has_extension(*SIMPLE_IMAGE_EXTENSIONS))
+register_modality(Modality.DICOM_CT_SLICE,
+                  BioImage.load_dicom_slice_from_file,
+                  probe=BioImage.probe_file,
+                  detect=_has_extension('.dcm'))
+register_modality(Modality.NIFTI_GZ, read_nifti_gz,
+                  probe=BioImage.probe_file,
+                  detect=_has_extension('.nii.gz'))
+register_modality(Modality.NUMPY, read_numpy,
+                  probe=BioImage.probe_numpy_file,
+                  detect=_has_extension('.npy', '.npz'))
+register_modality(Modality.CHUNKED_VOLUME, BioImage.load_chunked_volume,
+                  probe=BioImage.probe_chunked_volume,
+                  detect=_has_extension('.biv'))
+register_modality(Modality.DICOM_CT_DIR, BioImage.load_dicom_from_dir,
+                  probe=BioImage.probe_dicom_dir, detect=os.path.isdir,
+                  series=True)
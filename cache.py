@@ -0,0 +1,362 @@
+""" This module provides caches for loaded images.
+
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import uuid
+import numpy as np
+import SimpleITK as sitk
+
+
+class VolumeDiskCache(object):
+    """ A persistent cache storing images as memory-mappable files.
+
+    Each entry is stored as a raw .npy file holding the voxel values and a
+        .json file holding the geometry and metadata of the image. When the
+        total size of the entries exceeds max_bytes, the least recently used
+        entries are evicted.
+
+    Args:
+        cache_dir (str): The directory where entries are stored. It is
+            created if it does not exist.
+        max_bytes (int): The maximum total size of the entries in bytes.
+            Default is None for an unbounded cache.
+    """
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def make_key(cls, *parts):
+        """ Create a cache key from JSON serializable values.
+
+        Args:
+            *parts: Values identifying an entry, e.g. a fingerprint of the
+                source and the modality.
+
+        Returns:
+            A hexadecimal string.
+        """
+        serialized = json.dumps(parts, sort_keys=True)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.npy', base + '.json'
+
+    def get_array(self, key):
+        """ Get the voxel values of an entry without reading them to memory.
+
+        Args:
+            key (str): A cache key.
+
+        Returns:
+            A read-only numpy.memmap and a dict holding the geometry and
+                metadata of the image, or (None, None) for a missing entry.
+        """
+        array_path, info_path = self._paths(key)
+        try:
+            with open(info_path) as fin:
+                info = json.load(fin)
+            array = np.load(array_path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None, None
+        # Record the access for the least recently used eviction
+        try:
+            os.utime(info_path)
+        except FileNotFoundError:
+            pass
+        return array, info
+
+    def get(self, key):
+        """ Get an image from the cache.
+
+        Args:
+            key (str): A cache key.
+
+        Returns:
+            A SimpleITK.Image, or None for a missing entry.
+        """
+        array, info = self.get_array(key)
+        if array is None:
+            return None
+        image = sitk.GetImageFromArray(array,
+                                       isVector=info['components'] > 1)
+        image.SetSpacing(info['spacing'])
+        image.SetOrigin(info['origin'])
+        image.SetDirection(info['direction'])
+        for k, value in info['metadata'].items():
+            image.SetMetaData(k, value)
+        return image
+
+    def put(self, key, image, source=None):
+        """ Add an image to the cache, evicting old entries if required.
+
+        Args:
+            key (str): A cache key.
+            image: A SimpleITK.Image.
+            source (str): The source the image was read from. It is used by
+                invalidate_source.
+        """
+        info = {
+            'source': None if source is None else os.path.abspath(source),
+            'components': image.GetNumberOfComponentsPerPixel(),
+            'spacing': image.GetSpacing(),
+            'origin': image.GetOrigin(),
+            'direction': image.GetDirection(),
+            'metadata': {k: image.GetMetaData(k)
+                         for k in image.GetMetaDataKeys()},
+        }
+        array_path, info_path = self._paths(key)
+        # Write to temporary files first so that concurrent readers never
+        # observe a partially written entry; the .json file marks an
+        # entry as complete, hence it is moved in place last.
+        tmp = '.{}.tmp'.format(uuid.uuid4().hex)
+        with open(array_path + tmp, 'wb') as fout:
+            np.save(fout, sitk.GetArrayViewFromImage(image))
+        with open(info_path + tmp, 'w') as fout:
+            json.dump(info, fout)
+        os.replace(array_path + tmp, array_path)
+        os.replace(info_path + tmp, info_path)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def _entries(self):
+        """ List (last access time, size, key) for all complete entries."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            array_path, info_path = self._paths(key)
+            try:
+                atime = os.stat(info_path).st_mtime_ns
+                size = (os.path.getsize(array_path) +
+                        os.path.getsize(info_path))
+            except FileNotFoundError:
+                continue
+            entries.append((atime, size, key))
+        return entries
+
+    def size(self):
+        """ Get the total size of the entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes):
+        """ Remove least recently used entries until the cache fits max_bytes.
+
+        Args:
+            max_bytes (int): The maximum total size of the entries in bytes.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= max_bytes:
+                    break
+                self.invalidate(key)
+                total -= size
+
+    def invalidate(self, key):
+        """ Remove an entry from the cache.
+
+        Args:
+            key (str): A cache key.
+        """
+        # Removing the .json file first makes the entry invisible to readers
+        for path in reversed(self._paths(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def invalidate_source(self, source):
+        """ Remove all entries read from a source.
+
+        Args:
+            source (str): Address of a file or a directory.
+        """
+        source = os.path.abspath(source)
+        for _, _, key in self._entries():
+            try:
+                with open(self._paths(key)[1]) as fin:
+                    entry_source = json.load(fin).get('source')
+            except (FileNotFoundError, ValueError):
+                continue
+            if entry_source == source:
+                self.invalidate(key)
+
+    def clear(self):
+        """ Remove all entries from the cache."""
+        for _, _, key in self._entries():
+            self.invalidate(key)
+
+
+class VolumeMemoryCache(object):
+    """ A bounded in-memory cache of images.
+
+    The cache evicts the least recently used images when the total size of
+        voxel values of the cached images exceeds max_bytes. Images are
+        returned as shallow copies, so modifying a returned image does not
+        modify the cached one. Cached images are not validated against their
+        source files.
+
+    Args:
+        max_bytes (int): The maximum total size of voxel values in bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._images = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def image_nbytes(cls, image):
+        """ Get the size of voxel values of an image in bytes.
+
+        Args:
+            image: A SimpleITK.Image.
+
+        Returns:
+            An integer.
+        """
+        return (image.GetNumberOfPixels() *
+                image.GetNumberOfComponentsPerPixel() *
+                image.GetSizeOfPixelComponent())
+
+    def get(self, key):
+        """ Get an image from the cache.
+
+        Args:
+            key: A hashable value, e.g. (source, modality).
+
+        Returns:
+            A SimpleITK.Image, or None for a missing entry.
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+        return sitk.Image(image)
+
+    def put(self, key, image):
+        """ Add an image to the cache, evicting old entries if required.
+
+        Images larger than max_bytes are not cached.
+
+        Args:
+            key: A hashable value, e.g. (source, modality).
+            image: A SimpleITK.Image.
+        """
+        nbytes = VolumeMemoryCache.image_nbytes(image)
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._images[key] = sitk.Image(image)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._nbytes -= VolumeMemoryCache.image_nbytes(evicted)
+                self.evictions += 1
+
+    def _remove(self, key):
+        image = self._images.pop(key, None)
+        if image is not None:
+            self._nbytes -= VolumeMemoryCache.image_nbytes(image)
+
+    def invalidate(self, key):
+        """ Remove an entry from the cache.
+
+        Args:
+            key: A hashable value, e.g. (source, modality).
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """ Remove all entries from the cache."""
+        with self._lock:
+            self._images.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """ Get the usage statistics of the cache.
+
+        Returns:
+            A dict containing the number of hits, misses, evictions and
+                entries, and the total size of cached voxel values in bytes.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._images), 'nbytes': self._nbytes,
+                    'max_bytes': self.max_bytes}
+
+
+_disk_cache = None
+
+
+def set_disk_cache(disk_cache):
+    """ Set the disk cache used by BioImage.load.
+
+    Args:
+        disk_cache: A VolumeDiskCache, or None for disabling the disk cache.
+    """
+    global _disk_cache
+    _disk_cache = disk_cache
+
+
+def get_disk_cache():
+    """ Get the disk cache used by BioImage.load.
+
+    Returns:
+        A VolumeDiskCache, or None if the disk cache is disabled.
+    """
+    return _disk_cache
+
+
+def _memory_cache_from_environment():
+    """ Create the memory cache sized by BIOIMG_MEMORY_CACHE_BYTES, if set."""
+    max_bytes = int(os.environ.get('BIOIMG_MEMORY_CACHE_BYTES', 0))
+    if max_bytes > 0:
+        return VolumeMemoryCache(max_bytes)
+    return None
+
+
+_memory_cache = _memory_cache_from_environment()
+
+
+def set_memory_cache(memory_cache):
+    """ Set the process-wide memory cache used by BioImage.load.
+
+    By default, the memory cache is disabled unless the environment
+        variable BIOIMG_MEMORY_CACHE_BYTES is set to a positive size in
+        bytes.
+
+    Args:
+        memory_cache: A VolumeMemoryCache, or None for disabling the memory
+            cache.
+    """
+    global _memory_cache
+    _memory_cache = memory_cache
+
+
+def get_memory_cache():
+    """ Get the process-wide memory cache used by BioImage.load.
+
+    Returns:
+        A VolumeMemoryCache, or None if the memory cache is disabled.
+    """
+    return _memory_cache
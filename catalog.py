@@ -0,0 +1,213 @@
+""" This module provides a compiled, memory-mapped format for Catalog files.
+
+A compiled catalog stores each column as a table of UTF-8 strings and keeps
+a hash index on the identifier columns. Opening a compiled catalog only reads
+its header; rows are decoded on access, and the file is shared between
+processes through the operating system page cache.
+
+"""
+import json
+import mmap
+import operator
+import struct
+import zlib
+import numpy as np
+
+from utils import iter_catalog
+
+
+CATALOG_COLUMNS = ('sample_id', 'image_id', 'image_src', 'mask_src')
+INDEX_COLUMNS = ('sample_id', 'image_id')
+MAGIC = b'BIOCAT01'
+# Sections of the file are aligned for memory mapping numpy arrays
+ALIGNMENT = 8
+
+
+def _hash(key):
+    """ A hash function that is stable across processes and runs."""
+    return zlib.crc32(key.encode('utf-8'))
+
+
+def _build_index(values, num_buckets):
+    """ Build a hash index as (bucket starts, rows sorted by bucket)."""
+    buckets = np.fromiter((_hash(v) for v in values), dtype=np.int64,
+                          count=len(values)) & (num_buckets - 1)
+    rows = np.argsort(buckets, kind='stable').astype(np.int64)
+    starts = np.zeros(num_buckets + 1, dtype=np.int64)
+    np.cumsum(np.bincount(buckets, minlength=num_buckets), out=starts[1:])
+    return starts, rows
+
+
+def compile_catalog(catalog_file_path, output_path, sep=',',
+                    index_columns=INDEX_COLUMNS):
+    """ Compile a Catalog file into a memory-mappable binary file.
+
+    Args:
+        catalog_file_path: Address of a catalog file.
+        output_path: Address of the compiled catalog file.
+        sep: A field seperator.
+        index_columns: Names of the columns to build a hash index for.
+
+    Returns:
+        The number of rows of the catalog.
+
+    Raises:
+        ValueError: If a row has more fields than CATALOG_COLUMNS.
+
+    """
+    columns = {name: [] for name in CATALOG_COLUMNS}
+    for number, row in enumerate(iter_catalog(catalog_file_path, sep=sep)):
+        if len(row) > len(CATALOG_COLUMNS):
+            msg = ('Row {} of {} has {} fields, but a catalog has at most {} '
+                   'columns: {}.')
+            raise ValueError(msg.format(number, catalog_file_path, len(row),
+                                        len(CATALOG_COLUMNS),
+                                        ', '.join(CATALOG_COLUMNS)))
+        row = row + [''] * (len(CATALOG_COLUMNS) - len(row))
+        for name, value in zip(CATALOG_COLUMNS, row):
+            columns[name].append(value)
+    num_rows = len(columns[CATALOG_COLUMNS[0]])
+    num_buckets = 1 << max(1, (2 * num_rows - 1).bit_length())
+    arrays = []
+    for name in CATALOG_COLUMNS:
+        encoded = [value.encode('utf-8') for value in columns[name]]
+        offsets = np.zeros(num_rows + 1, dtype=np.uint64)
+        np.cumsum([len(v) for v in encoded], out=offsets[1:])
+        arrays.append((name + '.offsets', offsets))
+        arrays.append((name + '.data',
+                       np.frombuffer(b''.join(encoded), dtype=np.uint8)))
+        if name in index_columns:
+            starts, rows = _build_index(columns[name], num_buckets)
+            arrays.append((name + '.buckets', starts))
+            arrays.append((name + '.rows', rows))
+    # Compute the layout: the header is followed by the aligned sections
+    sections = {}
+    position = 0
+    for name, array in arrays:
+        sections[name] = [position, array.dtype.str, len(array)]
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({'num_rows': num_rows, 'columns': CATALOG_COLUMNS,
+                         'index_columns': list(index_columns),
+                         'sections': sections}).encode('utf-8')
+    data_start = len(MAGIC) + 8 + len(header)
+    data_start = -(-data_start // ALIGNMENT) * ALIGNMENT
+    with open(output_path, 'wb') as fout:
+        fout.write(MAGIC)
+        fout.write(struct.pack('<Q', len(header)))
+        fout.write(header)
+        for name, array in arrays:
+            fout.seek(data_start + sections[name][0])
+            fout.write(array.tobytes())
+        fout.truncate(data_start + position)
+    return num_rows
+
+
+class CompiledCatalog(object):
+    """ A compiled catalog opened as a memory-mapped file.
+
+    A CompiledCatalog behaves like the list of lists returned by
+        utils.read_catalog, e.g. it can be passed to batch.load_catalog or
+        utils.partition. It can be pickled cheaply, as only its address is
+        serialized; worker processes map the same file.
+
+    Args:
+        file_path (str): Address of a file created by compile_catalog.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._open()
+
+    def _open(self):
+        with open(self.file_path, 'rb') as fin:
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            msg = '{} is not a compiled catalog file.'
+            raise ValueError(msg.format(self.file_path))
+        header_length, = struct.unpack_from('<Q', self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(
+            self._mmap[header_start: header_start + header_length])
+        data_start = header_start + header_length
+        data_start = -(-data_start // ALIGNMENT) * ALIGNMENT
+        self.num_rows = header['num_rows']
+        self.columns = tuple(header['columns'])
+        self.index_columns = tuple(header['index_columns'])
+        self._sections = {}
+        for name, (offset, dtype, length) in header['sections'].items():
+            self._sections[name] = np.frombuffer(
+                self._mmap, dtype=np.dtype(dtype), count=length,
+                offset=data_start + offset)
+
+    def __getstate__(self):
+        return {'file_path': self.file_path}
+
+    def __setstate__(self, state):
+        self.file_path = state['file_path']
+        self._open()
+
+    def close(self):
+        """ Release the memory-mapped file."""
+        self._sections = {}
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.num_rows
+
+    def get(self, column, row):
+        """ Get a value of the catalog.
+
+        Args:
+            column (str): A column name, e.g. 'image_src'.
+            row (int): A row index.
+
+        Returns:
+            A string.
+        """
+        offsets = self._sections[column + '.offsets']
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        return self._sections[column + '.data'][start:end].tobytes() \
+            .decode('utf-8')
+
+    def __getitem__(self, row):
+        """ Get a row as a list, as returned by utils.read_catalog.
+
+        A slice returns a list of rows, as for the list returned by
+            utils.read_catalog.
+        """
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(self.num_rows))]
+        row = operator.index(row)
+        if row < 0:
+            row += self.num_rows
+        if not 0 <= row < self.num_rows:
+            raise IndexError('Row index {} is out of range.'.format(row))
+        return [self.get(column, row) for column in self.columns]
+
+    def __iter__(self):
+        for row in range(self.num_rows):
+            yield self[row]
+
+    def lookup(self, column, key):
+        """ Find the rows whose value in an indexed column equals key.
+
+        Args:
+            column (str): An indexed column, e.g. 'sample_id'.
+            key (str): The value to look up.
+
+        Returns:
+            A list of row indices in catalog order.
+        """
+        if column not in self.index_columns:
+            raise ValueError('Column {} is not indexed.'.format(column))
+        starts = self._sections[column + '.buckets']
+        bucket = _hash(key) & (len(starts) - 2)
+        candidates = self._sections[column + '.rows'][
+            starts[bucket]: starts[bucket + 1]]
+        return [int(row) for row in candidates
+                if self.get(column, row) == key]
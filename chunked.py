@@ -0,0 +1,233 @@
+""" This module provides a chunked, compressed file format for volumes.
+
+A chunked volume (.biv) file stores a 3D image as a sequence of chunks of
+consecutive slices, each compressed independently with zlib, followed by a
+JSON header holding the shape, pixel type, geometry and metadata of the
+image. Reading a volume opens a single file, so it avoids the per-file
+overhead of DICOM series, and a range of slices can be read by decompressing
+only the chunks containing them.
+
+"""
+import collections
+import json
+import os
+import struct
+import threading
+import uuid
+import zlib
+import numpy as np
+import SimpleITK as sitk
+
+# Chunks are decompressed with the faster isal implementation, if installed
+try:
+    from isal import isal_zlib as _zlib
+except ImportError:
+    _zlib = zlib
+
+
+MAGIC = b'BIOVOL01'
+# The magic is followed by the offset and the length of the JSON header
+PREAMBLE = struct.Struct('<QQ')
+CHUNK_SLICES = 8
+
+
+def write_chunked_volume(image, file_path, chunk_slices=CHUNK_SLICES,
+                         level=1, source_fingerprint=None):
+    """ Write a 3D image as a chunked volume file.
+
+    The file is written to a temporary file first and moved in place, so an
+        interrupted conversion never leaves a partial file.
+
+    Args:
+        image: A 3D SimpleITK.Image with one component per pixel.
+        file_path (str): Address of the output file, e.g. 'brain1.biv'.
+        chunk_slices (int): Number of slices of each chunk.
+        level (int): The zlib compression level from 0 to 9.
+        source_fingerprint (str): A fingerprint of the source files, see
+            utils.fingerprint, stored for detecting outdated files.
+    """
+    if image.GetDimension() != 3 or image.GetNumberOfComponentsPerPixel() != 1:
+        raise ValueError('Only 3D images with scalar pixels are supported.')
+    voxels = sitk.GetArrayViewFromImage(image)
+    header = {
+        'shape': list(voxels.shape),
+        'dtype': voxels.dtype.str,
+        'chunk_slices': chunk_slices,
+        'spacing': image.GetSpacing(),
+        'origin': image.GetOrigin(),
+        'direction': image.GetDirection(),
+        'metadata': {k: image.GetMetaData(k)
+                     for k in image.GetMetaDataKeys()},
+        'source_fingerprint': source_fingerprint,
+        'chunks': [],
+    }
+    tmp_path = '{}.{}.tmp'.format(file_path, uuid.uuid4().hex)
+    try:
+        with open(tmp_path, 'wb') as fout:
+            fout.write(MAGIC)
+            fout.write(PREAMBLE.pack(0, 0))
+            for start in range(0, voxels.shape[0], chunk_slices):
+                chunk = np.ascontiguousarray(
+                    voxels[start: start + chunk_slices])
+                data = zlib.compress(chunk, level)
+                header['chunks'].append([fout.tell(), len(data)])
+                fout.write(data)
+            header_offset = fout.tell()
+            encoded = json.dumps(header).encode('utf-8')
+            fout.write(encoded)
+            fout.seek(len(MAGIC))
+            fout.write(PREAMBLE.pack(header_offset, len(encoded)))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_chunked_header(file_path):
+    """ Read the header of a chunked volume file.
+
+    Args:
+        file_path (str): Address of a chunked volume file.
+
+    Returns:
+        A dict.
+    """
+    with open(file_path, 'rb') as fin:
+        if fin.read(len(MAGIC)) != MAGIC:
+            msg = '{} is not a chunked volume file.'
+            raise ValueError(msg.format(file_path))
+        offset, length = PREAMBLE.unpack(fin.read(PREAMBLE.size))
+        fin.seek(offset)
+        return json.loads(fin.read(length))
+
+
+class ChunkedVolume(object):
+    """ A chunked volume file whose chunks are decompressed on demand.
+
+    A ChunkedVolume can be indexed like a (slices, rows, columns) array,
+        e.g. volume[11] or volume[40:45], in which case only the chunks
+        containing the requested slices are read. Decompressed chunks are
+        cached.
+
+    Args:
+        file_path (str): Address of a chunked volume file.
+        max_cached_chunks (int): The maximum number of decompressed chunks
+            kept in memory. Default is 8. Use None for caching all chunks.
+    """
+    def __init__(self, file_path, max_cached_chunks=8):
+        self.file_path = file_path
+        self.max_cached_chunks = max_cached_chunks
+        self.header = read_chunked_header(file_path)
+        self.shape = tuple(self.header['shape'])
+        self.dtype = np.dtype(self.header['dtype'])
+        self.chunk_slices = self.header['chunk_slices']
+        self._chunks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def num_chunks(self):
+        """ The number of chunks of the volume."""
+        return len(self.header['chunks'])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read_chunk_into(self, fin, index, out):
+        offset, length = self.header['chunks'][index]
+        fin.seek(offset)
+        data = _zlib.decompress(fin.read(length))
+        out[...] = np.frombuffer(data, dtype=self.dtype).reshape(out.shape)
+
+    def _chunk_shape(self, index):
+        start = index * self.chunk_slices
+        stop = min(start + self.chunk_slices, self.shape[0])
+        return (stop - start,) + self.shape[1:]
+
+    def read_chunk(self, index):
+        """ Read the voxel values of a chunk.
+
+        Args:
+            index (int): The index of the chunk.
+
+        Returns:
+            A read-only numpy array of shape (slices, rows, columns), holding
+                the slices index * chunk_slices onwards.
+        """
+        if not 0 <= index < self.num_chunks:
+            raise IndexError('Chunk index {} is out of range.'.format(index))
+        with self._lock:
+            if index in self._chunks:
+                self._chunks.move_to_end(index)
+                return self._chunks[index]
+        chunk = np.empty(self._chunk_shape(index), dtype=self.dtype)
+        with open(self.file_path, 'rb') as fin:
+            self._read_chunk_into(fin, index, chunk)
+        chunk.flags.writeable = False
+        with self._lock:
+            self._chunks[index] = chunk
+            if self.max_cached_chunks is not None:
+                while len(self._chunks) > self.max_cached_chunks:
+                    self._chunks.popitem(last=False)
+        return chunk
+
+    def read(self):
+        """ Read all voxel values, decompressing chunks into one array.
+
+        Returns:
+            A numpy array of shape (slices, rows, columns).
+        """
+        voxels = np.empty(self.shape, dtype=self.dtype)
+        with open(self.file_path, 'rb') as fin:
+            for index in range(self.num_chunks):
+                start = index * self.chunk_slices
+                self._read_chunk_into(
+                    fin, index, voxels[start: start + self.chunk_slices])
+        return voxels
+
+    def read_image(self):
+        """ Read the volume as an image with its geometry and metadata.
+
+        Returns:
+            A SimpleITK.Image.
+        """
+        image = sitk.GetImageFromArray(self.read())
+        image.SetSpacing(self.header['spacing'])
+        image.SetOrigin(self.header['origin'])
+        image.SetDirection(self.header['direction'])
+        for k, value in self.header['metadata'].items():
+            image.SetMetaData(k, value)
+        return image
+
+    def __getitem__(self, key):
+        """ Get voxel values, indexed as a (slices, rows, columns) array.
+
+        Args:
+            key: An index, a slice or a tuple whose first element is an
+                index or a slice along the slice axis.
+
+        Returns:
+            A read-only 2D numpy array for an index, or a 3D numpy array for a
+                slice.
+        """
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            voxels = np.empty((len(indices),) + self.shape[1:],
+                              dtype=self.dtype)
+            for i, idx in enumerate(indices):
+                voxels[i] = self._get_slice(idx)
+            return voxels[(slice(None),) + rest] if rest else voxels
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Slice index {} is out of range.'.format(key))
+        voxels = self._get_slice(idx)
+        return voxels[rest] if rest else voxels
+
+    def _get_slice(self, idx):
+        chunk = self.read_chunk(idx // self.chunk_slices)
+        return chunk[idx % self.chunk_slices]
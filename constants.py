@@ -6,7 +6,17 @@ class Modality(object):
         https://simpleitk.readthedocs.io/en/master/IO.html
     DICOM_CT_SLICE: Used for a single slice from a DICOM
         file. File extension must be '.dcm' or '.DCM'.
+    NIFTI_GZ: Used for a compressed NIfTI file with extension '.nii.gz'.
+    NUMPY: Used for voxel values stored in a '.npy' or '.npz' file.
+    CHUNKED_VOLUME: Used for a chunked, compressed volume file with
+        extension '.biv', see chunked.write_chunked_volume.
+    AUTO: Used for detecting the modality from the source, see
+        bioimage.detect_modality.
     """
     DICOM_CT_DIR = 'DICOM_CT_DIR'
     SIMPLE_IMAGE = 'SIMPLE_IMAGE'
     DICOM_CT_SLICE = 'DICOM_CT_SLICE'
+    NIFTI_GZ = 'NIFTI_GZ'
+    NUMPY = 'NUMPY'
+    CHUNKED_VOLUME = 'CHUNKED_VOLUME'
+    AUTO = 'AUTO'
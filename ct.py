@@ -1,116 +1,367 @@
 """ This module provide functionality for working masked or unmasked images.
 
 """
+import json
+import numpy as np
 import SimpleITK as sitk
+
+import aio
+import profiling
 from bioimage import BioImage
 from constants import Modality
+from mask import CompactMask
+from roi import RegionOfInterest
+from roi import crop_image
+from roi import get_bounding_box
+from roi import pad_region
+from shm import SharedVolume
 
 
-class DICOMCTDIR(object):
-    """ Create an object from a directory containing DICOM files.
+# Absolute tolerance, in physical units, for comparing image geometries.
+GEOMETRY_TOLERANCE = 1e-4
+
+
+def check_geometry(image, mask):
+    """ Check that an image and its mask share the same geometry.
+
+    Only image headers are used, i.e. voxel values are not accessed.
+
+    Args:
+        image: A SimpleITK.Image, or any object providing GetSize,
+            GetSpacing, GetOrigin, and GetDirection, e.g. a
+            SimpleITK.ImageFileReader after ReadImageInformation.
+        mask: An object of the same kind as image.
+
+    Raises:
+        ValueError: If size, spacing, origin or direction do not match.
+    """
+    if tuple(image.GetSize()) != tuple(mask.GetSize()):
+        msg = 'Image and its mask must be of the same shape: {} != {}'
+        raise ValueError(msg.format(image.GetSize(), mask.GetSize()))
+    for name in ['Spacing', 'Origin', 'Direction']:
+        image_value = getattr(image, 'Get' + name)()
+        mask_value = getattr(mask, 'Get' + name)()
+        if not np.allclose(image_value, mask_value, rtol=0,
+                           atol=GEOMETRY_TOLERANCE):
+            msg = 'Image and its mask must have the same {}: {} != {}'
+            raise ValueError(msg.format(name.lower(), image_value,
+                                        mask_value))
 
-        For masked images, the address of a second directory containg masks
-            must be provided.
+
+class BaseCT(object):
+    """ Base class for masked or unmasked images of a given modality.
 
     Args:
         sample_id (str): An identifier assigned to each sample,
             i.e. each patient.
-        image_id (str): An identifier assigned to each image,
-        image_path (str): The address of the directory containing DICOM
-            files.
-        mask_path (str): The address of the directory containing DICOM
-            files for the image mask. Default is None for images with no mask.
+        image_id (str): An identifier assigned to each image.
+        image_path (str): The address of the image.
+        mask_path (str): The address of the image mask. Default is None for
+            images with no mask.
+        preprocessing (preprocess.Preprocessing): Resampling and intensity
+            normalization applied by load. Default is None for returning
+            images as read.
     """
-    MODALITY = Modality.DICOM_CT_DIR
+    MODALITY = None
 
-    def __init__(self, sample_id, image_id, image_path, mask_path=None):
+    def __init__(self, sample_id, image_id, image_path, mask_path=None,
+                 preprocessing=None):
         self.sample_id = sample_id
         self.image_id = image_id
-        self.image = BioImage(image_path, modality=DICOMCTDIR.MODALITY)
+        self.image = BioImage(image_path, modality=self.MODALITY)
         self.mask = None
         if mask_path is not None:
-            self.mask = BioImage(mask_path, modality=DICOMCTDIR.MODALITY)
+            self.mask = BioImage(mask_path, modality=self.MODALITY)
+        self.preprocessing = preprocessing
+        self._bounding_boxes = {}
 
     @classmethod
-    def get_array(cls, image):
+    def get_array(cls, image, copy=False):
         """ Get the voxel values.
 
+        By default, no voxel values are copied and the returned array is a
+            read-only view, which is valid only as long as image is alive.
+
         Args:
-            image (DICOMCTDIR): The object for which the voxel values
+            image (SimpleITK.Image): The image for which the voxel values
                 are extracted.
+            copy (bool): If True, a writable copy of the voxel values is
+                returned. Default is False.
 
         Returns:
             A numpy array containing the voxel values.
         """
-        return sitk.GetArrayViewFromImage(image)
+        with profiling.stage('ct.get_array') as stage:
+            stage.add(voxels=image.GetNumberOfPixels())
+            if copy:
+                return sitk.GetArrayFromImage(image)
+            return sitk.GetArrayViewFromImage(image)
 
     def load(self):
         """ Loads the data for an image and its mask, if applicable.
 
+        If preprocessing is set, the preprocessed image and mask are
+            returned, and they are cached on disk when a disk cache is
+            available.
+
         Returns:
-            image vexel values as a numpy array.
-            contour voxel values as a numpy array.
+            image as a SimpleITK.Image.
+            contour as a SimpleITK.Image, or None for unmasked images.
+
+        Raises:
+            ValueError: If the image and its mask differ in geometry.
         """
-        image = self.image.load()
+        with profiling.stage('ct.load'):
+            return self._load()
+
+    def _load(self):
+        if self.preprocessing is not None:
+            image = self.preprocessing.load(self.image)
+        else:
+            image = self.image.load()
         mask = None
         if self.mask is not None:
-            mask = self.mask.load()
-            image_shape = (DICOMCTDIR.get_array(image)).shape
-            mask_shape = (DICOMCTDIR.get_array(mask)).shape
-            if image_shape != mask_shape:
-                ValueError('Image and its mask must be of the same shape')
+            if self.preprocessing is not None:
+                mask = self.preprocessing.load(self.mask, is_mask=True)
+            else:
+                mask = self.mask.load()
+            with profiling.stage('ct.check_geometry'):
+                check_geometry(image, mask)
         return image, mask
 
+    def load_compact(self, encoding='auto'):
+        """ Load an image and its mask, storing the mask compactly.
 
-class SimpleImage(object):
-    """ Create a SimpleImage object.
+        The dense mask is released once encoded, so only the bounding box of
+            its labeled voxels is kept in memory afterwards. The peak memory
+            use is unchanged, since the dense mask is loaded before being
+            encoded.
 
-    For unmasked images, a single file is required. For masked images two
-        files, one for the image and another for the mask, are required.
+        Args:
+            encoding (str): The encoding of the mask, see
+                mask.CompactMask.from_array.
 
-    Args:
-        sample_id (str): An identifier assigned to each sample,
-            i.e. each patient.
-        image_id (str): An identifier assigned to each image.
-        image_path (str): The address of the image file.
-        mask_path (str): The address of the mask file.
+        Returns:
+            image as a SimpleITK.Image.
+            contour as a mask.CompactMask, or None for unmasked images.
         """
-    MODALITY = Modality.SIMPLE_IMAGE
+        image, mask = self.load()
+        if mask is not None:
+            mask = CompactMask.from_image(mask, encoding=encoding)
+        return image, mask
 
-    def __init__(self, sample_id, image_id, image_path, mask_path=None):
-        self.sample_id = sample_id
-        self.image_id = image_id
-        self.image = BioImage(image_path, modality=SimpleImage.MODALITY)
-        self.mask = None
-        if mask_path is not None:
-            self.mask = BioImage(mask_path, modality=SimpleImage.MODALITY)
+    def load_shared(self):
+        """ Load an image and its mask into shared memory blocks.
 
-    @classmethod
-    def get_array(cls, image):
-        """ Get the voxel values.
+        This is meant to be called in a worker process, whose results are
+            sent back as small handles instead of pickled voxel values.
+
+        Returns:
+            image as a shm.SharedVolume.
+            contour as a shm.SharedVolume, or None for unmasked images.
+        """
+        image, mask = self.load()
+        image = SharedVolume.from_image(image)
+        if mask is not None:
+            try:
+                mask = SharedVolume.from_image(mask)
+            except BaseException:
+                image.release()
+                raise
+        return image, mask
+
+    async def aload(self):
+        """ Load an image and its mask without blocking the event loop.
+
+        See load and bioimage.BioImage.aload. Concurrent calls loading the
+            same image and mask share one load.
+
+        Returns:
+            image as a SimpleITK.Image.
+            contour as a SimpleITK.Image, or None for unmasked images.
+        """
+        key = None
+        image_key = self.image.load_key()
+        mask_key = None if self.mask is None else self.mask.load_key()
+        if image_key is not None and (self.mask is None or
+                                      mask_key is not None):
+            params = None if self.preprocessing is None \
+                else json.dumps(self.preprocessing.params(), sort_keys=True)
+            key = ('ct', image_key, mask_key, params)
+        image, mask = await aio.run(key, self.load)
+        # Callers sharing a load get their own copy-on-write images
+        return sitk.Image(image), None if mask is None else sitk.Image(mask)
+
+    def load_roi(self, padding=0, label=None, images=None):
+        """ Load the region around the labeled structure of the mask.
+
+        The bounding box of the structure is computed once per label and
+            cached by this object. When images are not given, the first call
+            loads the image and its mask, and later calls read only the
+            padded region, e.g. only its slices for DICOM series, unless
+            preprocessing is set. Voxel values are not kept by this object;
+            callers extracting several regions from images they loaded pass
+            them instead, in which case boxes are cached per mask geometry,
+            since those masks may be resampled or cropped.
 
         Args:
-            image (DICOMCTDIR): The object for which the voxel values
-                are extracted.
+            padding: Number of voxels added around the bounding box, as an
+                integer or one integer per axis in (z, y, x) order.
+            label: The label of the structure. Default is None for all
+                non-zero mask voxels.
+            images: The image and its mask as returned by load, or None for
+                loading them.
 
         Returns:
-            A numpy array containing the voxel values.
+            A roi.RegionOfInterest. If images is None, its image and mask
+                are cropped to the padded region.
         """
-        return sitk.GetArrayFromImage(image)
+        if self.mask is None:
+            raise ValueError('A mask is required for extracting a region.')
+        if images is not None:
+            image, mask = images
+            key = ((mask.GetSize(), mask.GetSpacing(), mask.GetOrigin(),
+                    mask.GetDirection()), label)
+            if key not in self._bounding_boxes:
+                self._bounding_boxes[key] = get_bounding_box(mask,
+                                                             label=label)
+            start, size = self._bounding_boxes[key]
+            return RegionOfInterest(image, mask, start, size,
+                                    padding=padding)
+        # The box of the mask loaded by this object, with its shape
+        key = (None, label)
+        if key in self._bounding_boxes and self.preprocessing is None:
+            start, size, shape = self._bounding_boxes[key]
+            slices = pad_region(start, size, padding, shape)
+            region = ([s.start for s in slices],
+                      [s.stop - s.start for s in slices])
+            image = self.image.load_region(*region)
+            mask = self.mask.load_region(*region)
+            check_geometry(image, mask)
+        else:
+            image, mask = self.load()
+            if key not in self._bounding_boxes:
+                start, size = get_bounding_box(mask, label=label)
+                self._bounding_boxes[key] = (start, size,
+                                             mask.GetSize()[::-1])
+            start, size, shape = self._bounding_boxes[key]
+            slices = pad_region(start, size, padding, shape)
+            image, mask = crop_image(image, slices), crop_image(mask, slices)
+        start = [b - s.start for b, s in zip(start, slices)]
+        return RegionOfInterest(image, mask, start, size, padding=padding)
 
-    def load(self):
-        """ Loads voxel values for the image and its mask, if applicable.
+    def probe(self):
+        """ Read the headers of the image and its mask, if applicable.
+
+        Voxel values are not decoded.
 
         Returns:
-            image vexel values as a numpy array.
-            contour voxel values as a numpy array.
+            image header as a bioimage.ImageHeader.
+            contour header as a bioimage.ImageHeader, or None for unmasked
+                images.
+
+        Raises:
+            ValueError: If the image and its mask differ in geometry.
         """
-        image = self.image.load()
+        image = self.image.probe()
         mask = None
         if self.mask is not None:
-            mask = self.mask.load()
-            image_shape = (SimpleImage.get_array(image)).shape
-            mask_shape = (SimpleImage.get_array(mask)).shape
-            if image_shape != mask_shape:
-                ValueError('Image and its mask must be of the same shape')
+            mask = self.mask.probe()
+            check_geometry(image, mask)
         return image, mask
+
+
+class DICOMCTDIR(BaseCT):
+    """ Create an object from a directory containing DICOM files.
+
+        For masked images, the address of a second directory containg masks
+            must be provided.
+
+    Args:
+        sample_id (str): An identifier assigned to each sample,
+            i.e. each patient.
+        image_id (str): An identifier assigned to each image,
+        image_path (str): The address of the directory containing DICOM
+            files.
+        mask_path (str): The address of the directory containing DICOM
+            files for the image mask. Default is None for images with no mask.
+        series: The series of the image, as a series instance UID or a
+            predicate on series.SeriesEntry objects. Default is None for the
+            first series found in image_path, with or without series_index.
+        mask_series: The series of the mask, see series.
+        series_index (series.SeriesIndex): An index containing the series
+            of the image and its mask, used instead of scanning directories.
+        preprocessing (preprocess.Preprocessing): Resampling and intensity
+            normalization applied by load.
+    """
+    MODALITY = Modality.DICOM_CT_DIR
+
+    def __init__(self, sample_id, image_id, image_path, mask_path=None,
+                 series=None, mask_series=None, series_index=None,
+                 preprocessing=None):
+        super(DICOMCTDIR, self).__init__(sample_id, image_id, image_path,
+                                         mask_path=mask_path,
+                                         preprocessing=preprocessing)
+        self.image.series = series
+        self.image.series_index = series_index
+        if self.mask is not None:
+            self.mask.series = mask_series
+            self.mask.series_index = series_index
+
+    def load_lazy(self, max_cached_slices=64):
+        """ Create lazy volumes for the image and its mask, if applicable.
+
+        Args:
+            max_cached_slices (int): The maximum number of decoded slices
+                kept in memory for each volume.
+
+        Returns:
+            image as a LazyDICOMVolume.
+            contour as a LazyDICOMVolume.
+        """
+        image = self.image.load_lazy(max_cached_slices=max_cached_slices)
+        mask = None
+        if self.mask is not None:
+            mask = self.mask.load_lazy(max_cached_slices=max_cached_slices)
+            if image.shape != mask.shape:
+                raise ValueError(
+                    'Image and its mask must be of the same shape')
+        return image, mask
+
+
+class SimpleImage(BaseCT):
+    """ Create a SimpleImage object.
+
+    For unmasked images, a single file is required. For masked images two
+        files, one for the image and another for the mask, are required.
+
+    Args:
+        sample_id (str): An identifier assigned to each sample,
+            i.e. each patient.
+        image_id (str): An identifier assigned to each image.
+        image_path (str): The address of the image file.
+        mask_path (str): The address of the mask file.
+        preprocessing (preprocess.Preprocessing): Resampling and intensity
+            normalization applied by load.
+        """
+    MODALITY = Modality.SIMPLE_IMAGE
+
+
+class AutoImage(BaseCT):
+    """ Create an object whose image and mask formats are detected.
+
+    The modalities of the image and its mask are detected independently from
+        their addresses, see bioimage.detect_modality, so a catalog can mix
+        DICOM directories, NIfTI, NRRD and numpy files.
+
+    Args:
+        sample_id (str): An identifier assigned to each sample,
+            i.e. each patient.
+        image_id (str): An identifier assigned to each image.
+        image_path (str): The address of the image.
+        mask_path (str): The address of the mask. Default is None for images
+            with no mask.
+        preprocessing (preprocess.Preprocessing): Resampling and intensity
+            normalization applied by load.
+    """
+    MODALITY = Modality.AUTO
@@ -0,0 +1,218 @@
+""" This module provides parallel radiomics feature extraction over catalogs.
+
+Features are computed with PyRadiomics using a parameters file such as
+test/data/params.yaml. Results are streamed to a CSV file, one row per
+catalog row, which also serves as the checkpoint of a run: rerunning an
+interrupted extraction skips the rows already written.
+
+"""
+import collections
+import csv
+import functools
+import os
+import threading
+import numpy as np
+
+from batch import create_ct
+from batch import create_failed_result
+from batch import map_catalog
+
+FeatureResult = collections.namedtuple(
+    'FeatureResult', ['index', 'sample_id', 'image_id', 'features', 'error'])
+FeatureResult.__doc__ = """ The features extracted from one row of a catalog.
+
+    Attributes:
+        index (int): Position of the row in the catalog.
+        sample_id (str): The sample identifier of the row.
+        image_id (str): The image identifier of the row.
+        features (dict): Feature names mapped to values, or None if the
+            extraction failed.
+        error: The exception raised while extracting features, or None.
+"""
+
+ID_COLUMNS = ['sample_id', 'image_id']
+# Size of the blocks read backwards when looking for a partial last line.
+TAIL_BLOCK_BYTES = 1 << 16
+
+# The feature extractor of each worker thread or process, created once by
+# _init_extractor; PyRadiomics extractors are not known to be thread-safe.
+_worker = threading.local()
+
+
+def create_extractor(params_path):
+    """ Create a PyRadiomics feature extractor from a parameters file.
+
+    Args:
+        params_path (str): Address of a PyRadiomics parameters file.
+
+    Returns:
+        A radiomics.featureextractor.RadiomicsFeatureExtractor.
+    """
+    try:
+        from radiomics import featureextractor
+    except ImportError:
+        raise ImportError('PyRadiomics is required for feature extraction; '
+                          'install it using "pip install pyradiomics".')
+    return featureextractor.RadiomicsFeatureExtractor(params_path)
+
+
+def _init_extractor(params_path):
+    _worker.extractor = create_extractor(params_path)
+
+
+def _to_scalar(value):
+    """ Convert a PyRadiomics output value to a float or a string."""
+    if isinstance(value, np.ndarray) and value.size == 1:
+        return float(value.item())
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return str(value)
+
+
+def _extract_record(index, record, modality):
+    """ Extract the features of one catalog row, capturing any failure."""
+    try:
+        ct = create_ct(record, modality)
+        if ct.mask is None:
+            raise ValueError('A mask is required for feature extraction.')
+        image, mask = ct.load()
+        features = _worker.extractor.execute(image, mask)
+    except Exception as error:
+        return create_failed_result(index, record, error,
+                                    result_type=FeatureResult)
+    features = collections.OrderedDict(
+        (name, _to_scalar(value)) for name, value in features.items())
+    return FeatureResult(index, ct.sample_id, ct.image_id, features, None)
+
+
+def _extract_pending(position, item, modality):
+    """ Extract features of an (index, record) item of the pending rows."""
+    index, record = item
+    return _extract_record(index, record, modality)
+
+
+def _failed_pending(position, item, error):
+    index, record = item
+    return create_failed_result(index, record, error,
+                                result_type=FeatureResult)
+
+
+def _read_completed(output_path):
+    """ Read the header and the completed rows of a previous run.
+
+    A partially written last line, left by an interrupted run, is removed.
+    """
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return None, set()
+    with open(output_path, 'rb+') as fout:
+        # Only the end of the file is read, however large it is
+        position = fout.seek(-1, os.SEEK_END)
+        if fout.read(1) != b'\n':
+            while position > 0:
+                start = max(0, position - TAIL_BLOCK_BYTES)
+                fout.seek(start)
+                newline = fout.read(position - start).rfind(b'\n')
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            fout.truncate(position)
+    if os.path.getsize(output_path) == 0:
+        return None, set()
+    with open(output_path, newline='') as fin:
+        reader = csv.DictReader(fin)
+        completed = {tuple(row[c] for c in ID_COLUMNS) for row in reader}
+        return reader.fieldnames, completed
+
+
+def _write_results(results, fout, fieldnames, summary, checkpoint_every):
+    """ Append successful results to a CSV file and record failures.
+
+    Results with features missing from fieldnames are recorded as failed,
+        rather than losing those features.
+    """
+    writer = None
+    if fieldnames is not None:
+        writer = csv.DictWriter(fout, fieldnames=fieldnames, restval='')
+    for result in results:
+        if result.error is None and writer is not None:
+            unexpected = [name for name in result.features
+                          if name not in writer.fieldnames]
+            if unexpected:
+                msg = 'Features {} are not columns of the output file.'
+                result = result._replace(error=ValueError(
+                    msg.format(', '.join(unexpected))))
+        if result.error is not None:
+            summary['failed'].append(result)
+            continue
+        if writer is None:
+            writer = csv.DictWriter(fout, restval='', fieldnames=(
+                ID_COLUMNS + list(result.features)))
+            writer.writeheader()
+        row = dict(result.features)
+        row.update(sample_id=result.sample_id, image_id=result.image_id)
+        writer.writerow(row)
+        fout.flush()
+        summary['extracted'] += 1
+        if summary['extracted'] % checkpoint_every == 0:
+            os.fsync(fout.fileno())
+    os.fsync(fout.fileno())
+
+
+def extract_features(catalog, modality, params_path, output_path,
+                     num_workers=4, executor='process', resume=True,
+                     checkpoint_every=100):
+    """ Extract radiomics features for each image/mask pair of a catalog.
+
+    Rows are processed by a pool of workers, each holding one feature
+        extractor. Each result is appended to output_path as soon as it is
+        ready, so memory does not grow with the catalog size. Rows already
+        present in output_path are skipped when resume is True; failed rows
+        are not written and are retried by the next run. The columns of
+        output_path are those of the first written row; a later row with
+        other features is reported as failed.
+
+    Args:
+        catalog: A sequence of catalog rows as returned by
+            utils.read_catalog. Each row must have a mask, and pairs of
+            sample_id and image_id must be unique, since they identify the
+            rows written to output_path.
+        modality: A Modality value used for every row of the catalog.
+        params_path (str): Address of a PyRadiomics parameters file.
+        output_path (str): Address of the output CSV file.
+        num_workers (int): Number of threads or processes.
+        executor (str): Either 'thread' or 'process'.
+        resume (bool): If True, rows found in output_path are skipped.
+            Otherwise, output_path is overwritten.
+        checkpoint_every (int): Number of written rows after which
+            output_path is synced to disk. Rows are flushed to the operating
+            system as they are written.
+
+    Returns:
+        A dict containing the number of 'extracted' and 'skipped' rows, and
+            'failed', a list of FeatureResult objects for failed rows.
+
+    """
+    counts = collections.Counter(tuple(record[:2]) for record in catalog)
+    duplicates = [ids for ids, count in counts.items() if count > 1]
+    if duplicates:
+        msg = 'Pairs of sample_id and image_id must be unique, but {} repeat.'
+        raise ValueError(msg.format(', '.join(map(str, duplicates))))
+    fieldnames, completed = None, set()
+    if resume:
+        fieldnames, completed = _read_completed(output_path)
+    elif os.path.exists(output_path):
+        os.remove(output_path)
+    pending = [(index, record) for index, record in enumerate(catalog)
+               if tuple(record[:2]) not in completed]
+    function = functools.partial(_extract_pending, modality=modality)
+    results = map_catalog(pending, function, num_workers=num_workers,
+                          executor=executor, ordered=False,
+                          failed_result=_failed_pending,
+                          initializer=_init_extractor,
+                          initargs=(params_path,))
+    summary = {'extracted': 0, 'skipped': len(catalog) - len(pending),
+               'failed': []}
+    with open(output_path, 'a', newline='') as fout:
+        _write_results(results, fout, fieldnames, summary, checkpoint_every)
+    return summary
@@ -0,0 +1,297 @@
+""" This module provides fast readers for compressed NIfTI and numpy files.
+
+"""
+import struct
+import zipfile
+import numpy as np
+import SimpleITK as sitk
+
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+
+# NIfTI-1 datatype codes supported by read_nifti_gz.
+NIFTI_DTYPES = {
+    2: np.uint8,
+    4: np.int16,
+    8: np.int32,
+    16: np.float32,
+    64: np.float64,
+    256: np.int8,
+    512: np.uint16,
+    768: np.uint32,
+    1024: np.int64,
+    1280: np.uint64,
+}
+NIFTI_HEADER_SIZE = 348
+# NIfTI-1 spatial unit codes of millimeters and of unknown units, the
+# latter being read as millimeters.
+NIFTI_MM_UNITS = (0, 2)
+# Size of decompressed blocks read from a compressed NIfTI file.
+CHUNK_BYTES = 1 << 24
+# Absolute tolerance for comparing the qform and the sform of a header.
+XFORM_TOLERANCE = 1e-4
+# Metadata keys SimpleITK adds when reading voxel values, whose values are
+# not strings and cannot be read or copied from Python.
+ITK_UNREADABLE_KEYS = ('ITK_original_direction', 'ITK_original_spacing')
+
+
+def _parse_nifti_header(header):
+    """ Parse the fields of a NIfTI-1 header used for building an image.
+
+    Returns:
+        A dict, or None if the header is not a NIfTI-1 header.
+    """
+    for endian in '<>':
+        if struct.unpack_from(endian + 'i', header, 0)[0] == \
+                NIFTI_HEADER_SIZE:
+            break
+    else:
+        return None
+    # Only single-file NIfTI-1; 'ni1' headers refer to a separate .img file
+    if header[344:348] != b'n+1\x00':
+        return None
+    fields = {'endian': endian}
+    fields['dim'] = struct.unpack_from(endian + '8h', header, 40)
+    fields['datatype'] = struct.unpack_from(endian + 'h', header, 70)[0]
+    fields['pixdim'] = struct.unpack_from(endian + '8f', header, 76)
+    fields['vox_offset'] = int(struct.unpack_from(endian + 'f', header,
+                                                  108)[0])
+    fields['scl_slope'], fields['scl_inter'] = struct.unpack_from(
+        endian + '2f', header, 112)
+    fields['xyzt_units'] = header[123]
+    fields['qform_code'], fields['sform_code'] = struct.unpack_from(
+        endian + '2h', header, 252)
+    fields['quatern'] = struct.unpack_from(endian + '6f', header, 256)
+    fields['srow'] = np.array(struct.unpack_from(endian + '12f', header, 280),
+                              dtype=np.float64).reshape(3, 4)
+    return fields
+
+
+def _qform_affine(fields):
+    """ Compute the (3, 4) affine of the qform of a header in RAS."""
+    b, c, d, x, y, z = fields['quatern']
+    a = np.sqrt(max(0.0, 1.0 - (b * b + c * c + d * d)))
+    rotation = np.array([
+        [a * a + b * b - c * c - d * d, 2 * (b * c - a * d),
+         2 * (b * d + a * c)],
+        [2 * (b * c + a * d), a * a + c * c - b * b - d * d,
+         2 * (c * d - a * b)],
+        [2 * (b * d - a * c), 2 * (c * d + a * b),
+         a * a + d * d - c * c - b * b]])
+    qfac = -1.0 if fields['pixdim'][0] < 0 else 1.0
+    spacing = np.abs(fields['pixdim'][1:4])
+    spacing = np.where(spacing > 0, spacing, 1.0) * (1.0, 1.0, qfac)
+    return np.column_stack([rotation * spacing, (x, y, z)])
+
+
+def _geometry(fields):
+    """ Compute spacing, origin and direction in LPS, as SimpleITK does.
+
+    Returns:
+        The geometry, or None if the qform and the sform disagree.
+    """
+    affine = None
+    if fields['qform_code'] > 0:
+        affine = _qform_affine(fields)
+    if fields['sform_code'] > 0:
+        if affine is not None and not np.allclose(
+                affine, fields['srow'], rtol=0, atol=XFORM_TOLERANCE):
+            return None
+        affine = fields['srow']
+    if affine is None:
+        spacing = np.abs(fields['pixdim'][1:4])
+        affine = np.column_stack([np.diag(np.where(spacing > 0, spacing, 1)),
+                                  np.zeros(3)])
+    spacing = np.linalg.norm(affine[:, :3], axis=0)
+    # NIfTI coordinates are RAS, SimpleITK coordinates are LPS
+    ras_to_lps = np.array([-1.0, -1.0, 1.0])[:, np.newaxis]
+    direction = ras_to_lps * affine[:, :3] / spacing
+    origin = ras_to_lps[:, 0] * affine[:, 3]
+    return spacing, origin, direction
+
+
+def _read_nifti_stream(file_path, open_function):
+    """ Read a compressed NIfTI file, decompressing it in a single stream.
+
+    Voxel values are decompressed in blocks directly into their final
+        array, so the decompressed file is never held in memory twice. The
+        metadata of the image are read by SimpleITK from the header only,
+        so they are the same as for images read by SimpleITK.
+
+    Args:
+        file_path (str): Address of a .nii.gz file.
+        open_function: A function opening gzip files, e.g. gzip.open.
+
+    Returns:
+        A SimpleITK.Image, or None if the file is not supported, e.g.
+            NIfTI-2, .hdr/.img pairs, 4D images, scaled voxel values, spatial
+            units other than millimeters or disagreeing qform and sform.
+    """
+    with open_function(file_path, 'rb') as fin:
+        fields = _parse_nifti_header(fin.read(NIFTI_HEADER_SIZE))
+        if fields is None or fields['dim'][0] not in (2, 3) or \
+                fields['datatype'] not in NIFTI_DTYPES or \
+                fields['scl_slope'] not in (0, 1) or \
+                fields['scl_inter'] != 0 or \
+                fields['vox_offset'] < NIFTI_HEADER_SIZE or \
+                fields['xyzt_units'] & 0x07 not in NIFTI_MM_UNITS:
+            return None
+        geometry = _geometry(fields)
+        if geometry is None:
+            return None
+        dimension = fields['dim'][0]
+        shape = tuple(fields['dim'][1: 1 + dimension])[::-1]
+        dtype = np.dtype(NIFTI_DTYPES[fields['datatype']]).newbyteorder(
+            fields['endian'])
+        fin.read(fields['vox_offset'] - NIFTI_HEADER_SIZE)
+        voxels = np.empty(shape, dtype=dtype)
+        buffer = memoryview(voxels.reshape(-1).view(np.uint8))
+        position = 0
+        while position < len(buffer):
+            count = fin.readinto(buffer[position: position + CHUNK_BYTES])
+            if count == 0:
+                msg = 'Unexpected end of file {} after {} bytes of voxels.'
+                raise ValueError(msg.format(file_path, position))
+            position += count
+    if not dtype.isnative:
+        voxels = voxels.astype(dtype.newbyteorder('='))
+    image = sitk.GetImageFromArray(voxels)
+    spacing, origin, direction = geometry
+    image.SetSpacing(tuple(spacing[:dimension]))
+    image.SetOrigin(tuple(origin[:dimension]))
+    image.SetDirection(tuple(direction[:dimension, :dimension].ravel()))
+    reader = _nifti_reader(file_path)
+    reader.ReadImageInformation()
+    for key in reader.GetMetaDataKeys():
+        image.SetMetaData(key, reader.GetMetaData(key))
+    return image
+
+
+def _nifti_reader(file_path):
+    """ Create a SimpleITK reader using the NIfTI reader directly."""
+    reader = sitk.ImageFileReader()
+    reader.SetImageIO('NiftiImageIO')
+    reader.SetFileName(file_path)
+    return reader
+
+
+def read_nifti_gz(file_path):
+    """ Read a compressed NIfTI file.
+
+    If the optional isal package is installed, e.g. using
+        pip install BioImage[fast], the file is decompressed with its
+        accelerated gzip implementation, which is considerably faster than
+        zlib. Otherwise, or for files not supported by the streaming reader,
+        the file is read by SimpleITK using the NIfTI reader directly, i.e.
+        without probing other file formats. Either way, NIfTI header fields
+        are copied to the metadata of the image.
+
+    Args:
+        file_path (str): Address of a .nii.gz file.
+
+    Returns:
+        A SimpleITK.Image.
+    """
+    if igzip is not None:
+        image = _read_nifti_stream(file_path, igzip.open)
+        if image is not None:
+            return image
+    image = _nifti_reader(file_path).Execute()
+    # Keep the metadata the same as for images read in a stream
+    for key in ITK_UNREADABLE_KEYS:
+        image.EraseMetaData(key)
+    return image
+
+
+def read_numpy_array(file_path):
+    """ Read the voxel values and geometry stored in a .npy or .npz file.
+
+    A .npy file is memory-mapped, and has unit spacing, zero origin and
+        identity direction. A .npz file must contain the voxel values as
+        'image' and may contain 'spacing', 'origin' and 'direction' in
+        (x, y, z) order; uncompressed archives are memory-mapped as well.
+
+    Args:
+        file_path (str): Address of a .npy or .npz file.
+
+    Returns:
+        A numpy array in (z, y, x) order, which may be a read-only
+            numpy.memmap.
+        A dict containing the geometry found in the file.
+    """
+    if not file_path.lower().endswith('.npz'):
+        return np.load(file_path, mmap_mode='r'), {}
+    with np.load(file_path) as archive:
+        if 'image' not in archive.files:
+            msg = '{} must contain the voxel values as "image".'
+            raise ValueError(msg.format(file_path))
+        geometry = {k: tuple(archive[k].ravel().tolist())
+                    for k in ('spacing', 'origin', 'direction')
+                    if k in archive.files}
+        voxels = _map_npz_member(file_path, 'image.npy')
+        if voxels is None:
+            voxels = archive['image']
+    return voxels, geometry
+
+
+def _map_npz_member(file_path, name):
+    """ Memory-map an uncompressed member of a .npz file, if possible."""
+    with zipfile.ZipFile(file_path) as archive:
+        info = archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+    with open(file_path, 'rb') as fin:
+        # The local file header has a fixed size of 30 bytes followed by
+        # the file name and an extra field of variable lengths.
+        fin.seek(info.header_offset)
+        local_header = fin.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        fin.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(fin)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(fin)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(fin)
+        offset = fin.tell()
+    if dtype.hasobject:
+        return None
+    return np.memmap(file_path, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran_order else 'C')
+
+
+def read_numpy(file_path):
+    """ Read an image from a .npy or .npz file, see read_numpy_array.
+
+    Args:
+        file_path (str): Address of a .npy or .npz file.
+
+    Returns:
+        A SimpleITK.Image.
+    """
+    voxels, geometry = read_numpy_array(file_path)
+    image = sitk.GetImageFromArray(voxels)
+    if 'spacing' in geometry:
+        image.SetSpacing(geometry['spacing'])
+    if 'origin' in geometry:
+        image.SetOrigin(geometry['origin'])
+    if 'direction' in geometry:
+        image.SetDirection(geometry['direction'])
+    return image
+
+
+def write_numpy(image, file_path):
+    """ Write an image and its geometry as an uncompressed .npz file.
+
+    Args:
+        image: A SimpleITK.Image.
+        file_path (str): Address of the .npz file.
+    """
+    np.savez(file_path, image=sitk.GetArrayViewFromImage(image),
+             spacing=np.array(image.GetSpacing()),
+             origin=np.array(image.GetOrigin()),
+             direction=np.array(image.GetDirection()))
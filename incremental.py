@@ -0,0 +1,292 @@
+""" This module provides incremental processing of catalogs.
+
+A manifest records, for each catalog row, the fingerprints of its image and
+mask sources, a hash of the processing parameters, and the outputs derived
+from the row. Rerunning a pipeline with the same manifest processes only the
+rows that are new or whose sources, parameters or outputs have changed, and
+reports why each row was processed or skipped.
+
+Example:
+    report = process_catalog(catalog, extract, 'manifest.json',
+                             params={'spacing': 1.0})
+    print(report.summary())
+
+"""
+import collections
+import functools
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import create_failed_result
+from batch import map_catalog
+from utils import fingerprint
+
+
+# Reasons for processing or skipping a row
+NEW = 'new'
+IMAGE_CHANGED = 'image changed'
+MASK_CHANGED = 'mask changed'
+PARAMS_CHANGED = 'params changed'
+OUTPUTS_MISSING = 'outputs missing'
+UNCHANGED = 'unchanged'
+FORCED = 'forced'
+SOURCE_MISSING = 'source missing'
+
+RowResult = collections.namedtuple(
+    'RowResult', ['index', 'sample_id', 'image_id', 'outputs', 'error'])
+RowResult.__doc__ = """ The outcome of processing one row of a catalog.
+
+    Attributes:
+        index (int): Position of the row in the catalog.
+        sample_id (str): The sample identifier of the row.
+        image_id (str): The image identifier of the row.
+        outputs: The value returned by the processing function, or None.
+        error: The exception raised while processing the row, or None.
+"""
+
+
+class IncrementalReport(object):
+    """ What an incremental run processed, skipped and why.
+
+    Attributes:
+        processed (list): (index, reason) pairs of the rows processed
+            successfully.
+        skipped (list): (index, reason) pairs of the skipped rows.
+        failed (list): RowResult objects of the rows that failed.
+        removed (list): Keys of manifest entries whose rows are no longer
+            in the catalog.
+    """
+    def __init__(self):
+        self.processed = []
+        self.skipped = []
+        self.failed = []
+        self.removed = []
+
+    def summary(self):
+        """ Count rows by outcome and reason.
+
+        Returns:
+            A dict mapping 'processed', 'skipped', 'failed' and 'removed' to
+                counts; processed and skipped counts are dicts by reason.
+        """
+        return {
+            'processed': dict(collections.Counter(r for _, r in
+                                                  self.processed)),
+            'skipped': dict(collections.Counter(r for _, r in self.skipped)),
+            'failed': len(self.failed),
+            'removed': len(self.removed),
+        }
+
+
+def hash_params(params):
+    """ Hash JSON serializable processing parameters.
+
+    Args:
+        params: A JSON serializable value, e.g. a dict.
+
+    Returns:
+        A hexadecimal string.
+    """
+    serialized = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def row_key(record):
+    """ The manifest key of a catalog row: its sample and image ids as a JSON
+        list, which is unambiguous whatever characters the ids contain.
+    """
+    return json.dumps([record[0], record[1]])
+
+
+class Manifest(object):
+    """ The fingerprints and outputs of processed catalog rows.
+
+    Args:
+        file_path (str): Address of the JSON manifest file. It is read if it
+            exists.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.entries = {}
+        if os.path.exists(file_path):
+            with open(file_path) as fin:
+                self.entries = json.load(fin)['entries']
+
+    def save(self):
+        """ Write the manifest atomically."""
+        tmp_path = '{}.{}.tmp'.format(self.file_path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'w') as fout:
+                json.dump({'entries': self.entries}, fout)
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def check(self, key, fingerprints, params_hash):
+        """ Find why a row must be processed.
+
+        Args:
+            key (str): The key of the row, see row_key.
+            fingerprints: The fingerprints of the image and the mask
+                sources, the latter being None for rows with no mask.
+            params_hash (str): The hash of the processing parameters.
+
+        Returns:
+            A reason, which is UNCHANGED if the row can be skipped.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return NEW
+        if entry['image_fingerprint'] != fingerprints[0]:
+            return IMAGE_CHANGED
+        if entry['mask_fingerprint'] != fingerprints[1]:
+            return MASK_CHANGED
+        if entry['params_hash'] != params_hash:
+            return PARAMS_CHANGED
+        if not all(os.path.exists(p) for p in entry['output_files']):
+            return OUTPUTS_MISSING
+        return UNCHANGED
+
+    def update(self, key, fingerprints, params_hash, outputs):
+        """ Record a processed row.
+
+        Args:
+            key (str): The key of the row, see row_key.
+            fingerprints: The fingerprints of the image and the mask sources.
+            params_hash (str): The hash of the processing parameters.
+            outputs: A JSON serializable value returned by the processing
+                function. If it is a dict, its string values that are
+                addresses of existing files are checked on the next run.
+        """
+        output_files = []
+        if isinstance(outputs, dict):
+            output_files = [v for v in outputs.values()
+                            if isinstance(v, str) and os.path.isfile(v)]
+        self.entries[key] = {
+            'image_fingerprint': fingerprints[0],
+            'mask_fingerprint': fingerprints[1],
+            'params_hash': params_hash,
+            'outputs': outputs,
+            'output_files': output_files,
+        }
+
+
+def _fingerprint_record(record):
+    """ Fingerprint the sources of a row, or None if a source is missing."""
+    mask_src = record[3] if len(record) > 3 and record[3] else None
+    try:
+        return (fingerprint(record[2]),
+                None if mask_src is None else fingerprint(mask_src))
+    except OSError:
+        return None
+
+
+def _process_pending(position, item, function):
+    """ Process an (index, record) item of the pending rows."""
+    index, record = item
+    try:
+        outputs = function(index, record)
+    except Exception as error:
+        return create_failed_result(index, record, error,
+                                    result_type=RowResult)
+    return RowResult(index, record[0], record[1], outputs, None)
+
+
+def _failed_pending(position, item, error):
+    index, record = item
+    return create_failed_result(index, record, error, result_type=RowResult)
+
+
+def process_catalog(catalog, function, manifest_path, params=None,
+                    num_workers=4, executor='thread', force=False,
+                    checkpoint_every=100):
+    """ Process the rows of a catalog that changed since the last run.
+
+    A row is processed if it is not in the manifest, if the files of its
+        image or mask source were added, removed, resized or modified, if
+        params changed, or if output files recorded for it were removed.
+        Sources are fingerprinted with utils.fingerprint, i.e. from file
+        sizes and modification times. Failed rows are not recorded, so they
+        are processed again by the next run. Manifest entries of rows no
+        longer in the catalog are removed.
+
+    Args:
+        catalog: A sequence of catalog rows as returned by
+            utils.read_catalog. Pairs of sample_id and image_id must be
+            unique.
+        function: A callable taking the index and the row of the catalog
+            and returning a JSON serializable value describing the outputs,
+            e.g. {'features': 'out/brain1_CT1.csv'}. It must be picklable
+            for the 'process' executor.
+        manifest_path (str): Address of the manifest file.
+        params: JSON serializable processing parameters. Rows processed
+            with other parameters are processed again.
+        num_workers (int): Number of threads or processes.
+        executor (str): Either 'thread' or 'process'.
+        force (bool): If True, all rows are processed; unchanged rows are
+            reported with the FORCED reason.
+        checkpoint_every (int): Number of successfully processed rows after
+            which the manifest is saved, so an interrupted run keeps its
+            progress.
+
+    Returns:
+        An IncrementalReport.
+    """
+    keys = [row_key(record) for record in catalog]
+    duplicates = [k for k, n in collections.Counter(keys).items() if n > 1]
+    if duplicates:
+        msg = 'Pairs of sample_id and image_id must be unique, but {} repeat.'
+        raise ValueError(msg.format(', '.join(duplicates)))
+    manifest = Manifest(manifest_path)
+    params_hash = hash_params(params)
+    report = IncrementalReport()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        fingerprints = list(pool.map(_fingerprint_record, catalog))
+    reasons = {}
+    for index, (key, row_fingerprints) in enumerate(zip(keys,
+                                                        fingerprints)):
+        if row_fingerprints is None:
+            report.skipped.append((index, SOURCE_MISSING))
+            continue
+        reason = manifest.check(key, row_fingerprints, params_hash)
+        if reason != UNCHANGED:
+            reasons[index] = reason
+        elif force:
+            reasons[index] = FORCED
+        else:
+            report.skipped.append((index, reason))
+    catalog_keys = set(keys)
+    for key in list(manifest.entries):
+        if key not in catalog_keys:
+            del manifest.entries[key]
+            report.removed.append(key)
+    results = map_catalog([(i, catalog[i]) for i in reasons],
+                          functools.partial(_process_pending,
+                                            function=function),
+                          num_workers=num_workers, executor=executor,
+                          ordered=False, failed_result=_failed_pending)
+    try:
+        for result in results:
+            index = result.index
+            if result.error is None:
+                try:
+                    json.dumps(result.outputs)
+                except (TypeError, ValueError) as error:
+                    result = result._replace(outputs=None, error=error)
+            if result.error is not None:
+                report.failed.append(result)
+                continue
+            manifest.update(keys[index], fingerprints[index], params_hash,
+                            result.outputs)
+            report.processed.append((index, reasons[index]))
+            if len(report.processed) % checkpoint_every == 0:
+                manifest.save()
+    finally:
+        manifest.save()
+    report.processed.sort()
+    return report
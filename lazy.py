@@ -0,0 +1,119 @@
+""" This module provides lazy, slice-level access to DICOM series.
+
+"""
+import collections
+import threading
+import numpy as np
+import SimpleITK as sitk
+from utils import find_DICOM_series
+
+
+class LazyDICOMVolume(object):
+    """ A DICOM series whose slices are decoded on demand.
+
+    Slices are sorted by their geometry when the object is created, but the
+        pixel data of a slice is decoded only when it is indexed, e.g.
+        volume[11] or volume[40:45]. Decoded slices are cached.
+
+    Args:
+        slice_paths: A list of addresses of DICOM files, sorted by geometry,
+            as returned by SimpleITK.ImageSeriesReader.GetGDCMSeriesFileNames.
+        max_cached_slices (int): The maximum number of decoded slices kept in
+            memory. Default is 64. Use None for caching all decoded slices.
+    """
+    def __init__(self, slice_paths, max_cached_slices=64):
+        if len(slice_paths) == 0:
+            raise ValueError('A DICOM series must contain at least one file.')
+        self.slice_paths = list(slice_paths)
+        self.max_cached_slices = max_cached_slices
+        self._slices = collections.OrderedDict()
+        self._lock = threading.Lock()
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(self.slice_paths[0])
+        reader.ReadImageInformation()
+        self._header = reader
+
+    @classmethod
+    def from_dir(cls, dir_path, max_cached_slices=64, series_id=None):
+        """ Create a LazyDICOMVolume from a directory.
+
+        Args:
+            dir_path (str): Address of the directory containing DICOM files.
+            max_cached_slices (int): See LazyDICOMVolume.
+            series_id (str): The UID of the series. Default is None for the
+                first series found in the directory.
+
+        Returns:
+            A LazyDICOMVolume.
+        """
+        slice_paths = find_DICOM_series(dir_path, series_id=series_id)
+        return cls(slice_paths, max_cached_slices=max_cached_slices)
+
+    @property
+    def shape(self):
+        """ The shape of the volume as (slices, rows, columns)."""
+        width, height = self._header.GetSize()[:2]
+        return len(self.slice_paths), height, width
+
+    @property
+    def spacing(self):
+        """ The in-plane spacing of the volume as (x, y)."""
+        return self._header.GetSpacing()[:2]
+
+    @property
+    def origin(self):
+        """ The origin of the first slice as (x, y, z)."""
+        return self._header.GetOrigin()
+
+    def get_metadata(self, key):
+        """ Get a metadata value of the first slice, e.g. '0020|000e'."""
+        return self._header.GetMetaData(key)
+
+    def __len__(self):
+        return len(self.slice_paths)
+
+    def _get_slice(self, idx):
+        """ Get the voxel values of a slice, decoding it if required."""
+        with self._lock:
+            if idx in self._slices:
+                self._slices.move_to_end(idx)
+                return self._slices[idx]
+        voxels = sitk.GetArrayFromImage(sitk.ReadImage(self.slice_paths[idx]))
+        voxels = voxels.reshape(voxels.shape[-2:])
+        voxels.flags.writeable = False
+        with self._lock:
+            self._slices[idx] = voxels
+            if self.max_cached_slices is not None:
+                while len(self._slices) > self.max_cached_slices:
+                    self._slices.popitem(last=False)
+        return voxels
+
+    def __getitem__(self, key):
+        """ Get voxel values, indexed as a (slices, rows, columns) array.
+
+        Args:
+            key: An index, a slice or a tuple whose first element is an
+                index or a slice along the slice axis.
+
+        Returns:
+            A read-only 2D numpy array for an index, or a 3D numpy array for a
+                slice.
+        """
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            slices = [self._get_slice(i) for i in indices]
+            if len(slices) == 0:
+                dtype = self._get_slice(0).dtype
+                return np.empty((0,) + self.shape[1:], dtype=dtype)
+            voxels = np.stack(slices)
+            return voxels[(slice(None),) + rest] if rest else voxels
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Slice index {} is out of range.'.format(key))
+        voxels = self._get_slice(idx)
+        return voxels[rest] if rest else voxels
@@ -0,0 +1,248 @@
+""" This module provides a compact representation of masks.
+
+Masks are mostly binary or hold a few labels, and the labeled structures
+usually fill a small part of the volume. A CompactMask stores only the
+bounding box of the labeled voxels, using the smallest sufficient integer
+type, bits for binary masks, or runs of equal labels. Dense voxel values are
+decoded on demand, for a slice or for the whole mask.
+
+"""
+import numpy as np
+import SimpleITK as sitk
+
+
+ENCODINGS = ('auto', 'dense', 'bits', 'rle')
+
+
+def _label_dtype(voxels):
+    """ The smallest integer type holding the values of voxels, or bool for
+        boolean voxels.
+    """
+    if voxels.dtype == np.bool_:
+        return voxels.dtype
+    if voxels.size == 0:
+        return np.dtype(np.uint8)
+    low, high = int(voxels.min()), int(voxels.max())
+    return np.result_type(np.min_scalar_type(low), np.min_scalar_type(high))
+
+
+class CompactMask(object):
+    """ A mask stored as its bounding box in a compact encoding.
+
+    A CompactMask can be indexed like a numpy array along its first axis,
+        e.g. mask[11] for a slice, in which case only that slice is decoded.
+
+    Args:
+        shape: The shape of the mask in numpy order.
+        box: A tuple of slices, one per axis, holding all non-zero voxels.
+        encoding (str): 'dense', 'bits' or 'rle'.
+        data: The encoded voxel values of the box.
+        dtype: The data type of the decoded voxel values.
+        label: The label of binary masks encoded as bits.
+        geometry (dict): Spacing, origin and direction of the mask, used by
+            to_image, or None.
+
+    Use from_image or from_array for creating a CompactMask.
+    """
+    def __init__(self, shape, box, encoding, data, dtype, label=1,
+                 geometry=None):
+        self.shape = tuple(shape)
+        self.box = tuple(box)
+        self.encoding = encoding
+        self.data = data
+        self.dtype = np.dtype(dtype)
+        self.label = label
+        self.geometry = geometry
+
+    @classmethod
+    def from_array(cls, voxels, encoding='auto', crop=True, geometry=None):
+        """ Create a CompactMask from voxel values.
+
+        Args:
+            voxels: A numpy array of integer labels, or of booleans, in
+                which case decoded voxel values are booleans as well.
+            encoding (str): 'dense' for the smallest integer type holding the
+                labels, 'bits' for one bit per voxel, 'rle' for runs of
+                equal labels along the flattened box, or 'auto' for 'bits'
+                for binary masks and the smaller of 'dense' and 'rle'
+                otherwise.
+            crop (bool): If True, only the bounding box of non-zero voxels is
+                stored. Otherwise, the whole mask is stored.
+            geometry (dict): Spacing, origin and direction of the mask.
+
+        Returns:
+            A CompactMask.
+        """
+        if encoding not in ENCODINGS:
+            msg = 'Unknown encoding {}; it must be one of {}.'
+            raise ValueError(msg.format(encoding, ENCODINGS))
+        voxels = np.asarray(voxels)
+        if not np.issubdtype(voxels.dtype, np.integer) and \
+                voxels.dtype != np.bool_:
+            raise ValueError('Mask voxel values must be integer labels.')
+        box = tuple(slice(0, n) for n in voxels.shape)
+        if crop:
+            box = cls._bounding_box(voxels)
+        cropped = voxels[box]
+        dtype = _label_dtype(cropped)
+        labels = np.unique(cropped) if encoding in ('auto', 'bits') else None
+        if encoding == 'bits' and len(labels[labels != 0]) > 1:
+            raise ValueError('Only binary masks can be encoded as bits.')
+        label = 1
+        if labels is not None and len(labels[labels != 0]) == 1:
+            label = labels[labels != 0][0].item()
+        if encoding == 'auto':
+            if len(labels[labels != 0]) <= 1:
+                encoding = 'bits'
+            else:
+                values, lengths = cls._run_lengths(cropped)
+                rle_nbytes = values.astype(dtype).nbytes + lengths.nbytes
+                encoding = 'rle' if rle_nbytes < cropped.size * \
+                    dtype.itemsize else 'dense'
+        if encoding == 'dense':
+            data = cropped.astype(dtype)
+        elif encoding == 'bits':
+            data = np.packbits(cropped != 0, axis=-1)
+        else:
+            values, lengths = cls._run_lengths(cropped)
+            data = (values.astype(dtype), np.cumsum(lengths))
+        return cls(voxels.shape, box, encoding, data, dtype, label=label,
+                   geometry=geometry)
+
+    @classmethod
+    def from_image(cls, image, encoding='auto', crop=True):
+        """ Create a CompactMask from a SimpleITK.Image, see from_array.
+
+        Args:
+            image: A SimpleITK.Image of integer labels.
+            encoding (str): See from_array.
+            crop (bool): See from_array.
+
+        Returns:
+            A CompactMask keeping the geometry of image.
+        """
+        geometry = {'spacing': image.GetSpacing(),
+                    'origin': image.GetOrigin(),
+                    'direction': image.GetDirection()}
+        return cls.from_array(sitk.GetArrayViewFromImage(image),
+                              encoding=encoding, crop=crop, geometry=geometry)
+
+    @classmethod
+    def _bounding_box(cls, voxels):
+        box = []
+        for axis in range(voxels.ndim):
+            other_axes = tuple(a for a in range(voxels.ndim) if a != axis)
+            indices = np.flatnonzero(np.any(voxels, axis=other_axes))
+            if len(indices) == 0:
+                return tuple(slice(0, 0) for _ in range(voxels.ndim))
+            box.append(slice(int(indices[0]), int(indices[-1]) + 1))
+        return tuple(box)
+
+    @classmethod
+    def _run_lengths(cls, voxels):
+        """ Get the values and lengths of runs of the flattened voxels."""
+        flat = voxels.reshape(-1)
+        if flat.size == 0:
+            return flat[:0], np.zeros(0, dtype=np.int64)
+        starts = np.flatnonzero(np.concatenate(([True],
+                                                flat[1:] != flat[:-1])))
+        lengths = np.diff(np.append(starts, flat.size))
+        return flat[starts], lengths
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def box_shape(self):
+        """ The shape of the bounding box."""
+        return tuple(s.stop - s.start for s in self.box)
+
+    @property
+    def nbytes(self):
+        """ The size of the encoded voxel values in bytes."""
+        if self.encoding == 'rle':
+            return sum(a.nbytes for a in self.data)
+        return self.data.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _decode_box(self, rows=None):
+        """ Decode rows of the box along its first axis, all by default."""
+        box_shape = self.box_shape
+        if rows is None:
+            rows = slice(0, box_shape[0])
+        if self.encoding == 'dense':
+            return self.data[rows]
+        if self.encoding == 'bits':
+            bits = np.unpackbits(self.data[rows], axis=-1,
+                                 count=box_shape[-1])
+            return (bits * self.dtype.type(self.label)).astype(self.dtype)
+        values, ends = self.data
+        row_size = int(np.prod(box_shape[1:]))
+        start, stop = rows.start * row_size, rows.stop * row_size
+        first = np.searchsorted(ends, start, side='right')
+        last = np.searchsorted(ends, stop, side='left')
+        run_ends = np.minimum(ends[first: last + 1], stop)
+        lengths = np.diff(np.concatenate(([start], run_ends)))
+        flat = np.repeat(values[first: last + 1], lengths)
+        return flat.reshape((rows.stop - rows.start,) + box_shape[1:])
+
+    def to_array(self):
+        """ Decode the voxel values of the whole mask.
+
+        Returns:
+            A numpy array of shape shape.
+        """
+        voxels = np.zeros(self.shape, dtype=self.dtype)
+        if all(n > 0 for n in self.box_shape):
+            voxels[self.box] = self._decode_box()
+        return voxels
+
+    def __array__(self, dtype=None, copy=None):
+        if copy is False:
+            raise ValueError('A CompactMask is decoded into a new array, '
+                             'so it cannot be converted without a copy.')
+        voxels = self.to_array()
+        return voxels if dtype is None else voxels.astype(dtype)
+
+    def to_image(self):
+        """ Decode the mask as a SimpleITK.Image with its geometry.
+
+        Returns:
+            A SimpleITK.Image.
+        """
+        image = sitk.GetImageFromArray(self.to_array())
+        if self.geometry is not None:
+            image.SetSpacing(self.geometry['spacing'])
+            image.SetOrigin(self.geometry['origin'])
+            image.SetDirection(self.geometry['direction'])
+        return image
+
+    def __getitem__(self, key):
+        """ Decode voxel values, indexed as a numpy array.
+
+        An index along the first axis decodes only the corresponding slice.
+            Other keys decode the whole mask.
+
+        Args:
+            key: An index or any numpy index.
+
+        Returns:
+            A numpy array.
+        """
+        if not isinstance(key, (int, np.integer)):
+            return self.to_array()[key]
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Slice index {} is out of range.'.format(key))
+        voxels = np.zeros(self.shape[1:], dtype=self.dtype)
+        first = self.box[0]
+        if first.start <= idx < first.stop and \
+                all(n > 0 for n in self.box_shape):
+            row = idx - first.start
+            voxels[self.box[1:]] = self._decode_box(slice(row, row + 1))[0]
+        return voxels
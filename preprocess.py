@@ -0,0 +1,193 @@
+""" This module provides a resampling and intensity normalization stage.
+
+A Preprocessing object declares the target spacing, the interpolator and the
+intensity settings applied to images after loading. Masks are resampled with
+nearest neighbor interpolation and their labels are kept. Preprocessed
+images are stored in a disk cache under a key built from the fingerprint of
+the source files and the preprocessing parameters, so they are computed once.
+
+"""
+import os
+import SimpleITK as sitk
+
+from cache import get_disk_cache
+from utils import fingerprint
+
+
+INTERPOLATORS = {
+    'nearest': sitk.sitkNearestNeighbor,
+    'linear': sitk.sitkLinear,
+    'bspline': sitk.sitkBSpline,
+    'lanczos': sitk.sitkLanczosWindowedSinc,
+}
+NORMALIZATIONS = (None, 'zscore', 'minmax')
+
+
+class Preprocessing(object):
+    """ Resampling and intensity normalization settings for images.
+
+    Image voxel values are processed in the following order: resampling to
+        spacing, clipping to clip, then normalization. Processed images have
+        the float32 pixel type, unless neither clip nor normalize is set.
+        All steps use multithreaded SimpleITK filters.
+
+    Args:
+        spacing: The target voxel spacing in (x, y, z) order, or a number
+            for isotropic spacing. Default is None for keeping the spacing.
+        interpolator (str): A key of INTERPOLATORS used for images. Masks
+            are always resampled with nearest neighbor interpolation.
+        clip: A (minimum, maximum) pair of voxel values, e.g. an observation
+            window in Hounsfield unit. Default is None for no clipping.
+        normalize (str): None, 'zscore' for zero mean and unit variance, or
+            'minmax' for scaling voxel values to [0, 1].
+        default_value (float): Value of voxels resampled from outside the
+            image, e.g. -1000 for air in CT images.
+        num_threads (int): Number of threads used by each filter. Default is
+            None for the SimpleITK global default.
+        cache: A cache.VolumeDiskCache for preprocessed images. Default is
+            None for the disk cache set using cache.set_disk_cache, if any.
+    """
+    def __init__(self, spacing=None, interpolator='linear', clip=None,
+                 normalize=None, default_value=0.0, num_threads=None,
+                 cache=None):
+        if interpolator not in INTERPOLATORS:
+            msg = 'Unknown interpolator {}; available interpolators are {}.'
+            raise ValueError(msg.format(interpolator, sorted(INTERPOLATORS)))
+        if normalize not in NORMALIZATIONS:
+            msg = 'Unknown normalization {}; it must be one of {}.'
+            raise ValueError(msg.format(normalize, NORMALIZATIONS))
+        if clip is not None and clip[0] > clip[1]:
+            raise ValueError('Clip minimum must not exceed its maximum.')
+        self.spacing = spacing
+        self.interpolator = interpolator
+        self.clip = None if clip is None else tuple(clip)
+        self.normalize = normalize
+        self.default_value = default_value
+        self.num_threads = num_threads
+        self.cache = cache
+
+    def params(self):
+        """ Get the parameters that determine the preprocessed voxel values.
+
+        Returns:
+            A JSON serializable dict.
+        """
+        spacing = self.spacing
+        if spacing is not None and not isinstance(spacing, (int, float)):
+            spacing = list(spacing)
+        return {'spacing': spacing, 'interpolator': self.interpolator,
+                'clip': None if self.clip is None else list(self.clip),
+                'normalize': self.normalize,
+                'default_value': self.default_value}
+
+    def _configure(self, image_filter):
+        if self.num_threads is not None:
+            image_filter.SetNumberOfThreads(self.num_threads)
+        return image_filter
+
+    def resample(self, image, interpolator, default_value):
+        """ Resample an image to the target spacing.
+
+        The origin and direction of the image are kept, and its size is
+            chosen to cover the same physical extent.
+
+        Args:
+            image: A SimpleITK.Image.
+            interpolator: A SimpleITK interpolator, e.g. sitk.sitkLinear.
+            default_value (float): Value of voxels outside the image.
+
+        Returns:
+            A SimpleITK.Image.
+        """
+        if self.spacing is None:
+            return image
+        dimension = image.GetDimension()
+        spacing = self.spacing
+        if isinstance(spacing, (int, float)):
+            spacing = (spacing,) * dimension
+        if len(spacing) != dimension:
+            msg = 'Spacing {} does not match the image dimension {}.'
+            raise ValueError(msg.format(spacing, dimension))
+        spacing = tuple(float(s) for s in spacing)
+        if spacing == tuple(image.GetSpacing()):
+            return image
+        size = [max(1, int(round(n * s / t)))
+                for n, s, t in zip(image.GetSize(), image.GetSpacing(),
+                                   spacing)]
+        resampler = self._configure(sitk.ResampleImageFilter())
+        resampler.SetOutputSpacing(spacing)
+        resampler.SetSize(size)
+        resampler.SetOutputOrigin(image.GetOrigin())
+        resampler.SetOutputDirection(image.GetDirection())
+        resampler.SetOutputPixelType(image.GetPixelID())
+        resampler.SetInterpolator(interpolator)
+        resampler.SetDefaultPixelValue(default_value)
+        return resampler.Execute(image)
+
+    def process_image(self, image):
+        """ Resample, clip and normalize an image.
+
+        Args:
+            image: A SimpleITK.Image.
+
+        Returns:
+            A SimpleITK.Image.
+        """
+        image = self.resample(image, INTERPOLATORS[self.interpolator],
+                              self.default_value)
+        if self.clip is None and self.normalize is None:
+            return image
+        caster = self._configure(sitk.CastImageFilter())
+        caster.SetOutputPixelType(sitk.sitkFloat32)
+        image = caster.Execute(image)
+        if self.clip is not None:
+            clamp = self._configure(sitk.ClampImageFilter())
+            clamp.SetLowerBound(float(self.clip[0]))
+            clamp.SetUpperBound(float(self.clip[1]))
+            image = clamp.Execute(image)
+        if self.normalize == 'zscore':
+            image = self._configure(sitk.NormalizeImageFilter()).Execute(image)
+            image = caster.Execute(image)
+        elif self.normalize == 'minmax':
+            rescale = self._configure(sitk.RescaleIntensityImageFilter())
+            rescale.SetOutputMinimum(0.0)
+            rescale.SetOutputMaximum(1.0)
+            image = rescale.Execute(image)
+        return image
+
+    def process_mask(self, mask):
+        """ Resample a mask using nearest neighbor interpolation.
+
+        Args:
+            mask: A SimpleITK.Image.
+
+        Returns:
+            A SimpleITK.Image of the same pixel type as mask.
+        """
+        return self.resample(mask, sitk.sitkNearestNeighbor, 0)
+
+    def load(self, bio_image, is_mask=False):
+        """ Load and preprocess an image, using the disk cache if available.
+
+        Args:
+            bio_image: A bioimage.BioImage.
+            is_mask (bool): If True, the image is processed as a mask.
+
+        Returns:
+            A SimpleITK.Image.
+        """
+        process = self.process_mask if is_mask else self.process_image
+        disk_cache = self.cache if self.cache is not None \
+            else get_disk_cache()
+        if disk_cache is None or not os.path.exists(bio_image.source):
+            return process(bio_image.load())
+        series_id, _ = bio_image.select_series()
+        key = disk_cache.make_key(fingerprint(bio_image.source),
+                                  bio_image.modality, series_id,
+                                  'mask' if is_mask else 'image',
+                                  self.params())
+        image = disk_cache.get(key)
+        if image is None:
+            image = process(bio_image.load())
+            disk_cache.put(key, image, source=bio_image.source)
+        return image
@@ -0,0 +1,238 @@
+""" This module provides timing instrumentation for the load path.
+
+Loading functions record named stages, e.g. 'read_DICOM_from_dir.decode',
+with their durations and, where known, the number of bytes read and voxels
+decoded. Recording is disabled by default and costs a single function call
+per stage. It is enabled for a block of code using the profile context
+manager, or for a whole process by setting the environment variable
+BIOIMG_PROFILE to 1. If BIOIMG_PROFILE_TRACE is set to a file address, a
+trace of every stage is written to it when the process exits.
+
+Traces use the Chrome trace event format, which can be opened with
+chrome://tracing, Perfetto (https://ui.perfetto.dev) or speedscope.
+
+Example:
+    with profile(trace_path='load_trace.json') as profiler:
+        image, mask = ct.load()
+    print(profiler.report())
+
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+
+class _NullStage(object):
+    """ The stage returned when profiling is disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, bytes_read=0, voxels=0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    """ A stage being timed by a Profiler."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.bytes_read = 0
+        self.voxels = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.start, time.perf_counter(),
+                             bytes_read=self.bytes_read, voxels=self.voxels,
+                             failed=exc_type is not None)
+        return False
+
+    def add(self, bytes_read=0, voxels=0):
+        """ Add to the number of bytes read and voxels decoded by the stage.
+
+        Args:
+            bytes_read (int): Number of bytes read from files.
+            voxels (int): Number of voxels decoded or converted.
+        """
+        self.bytes_read += bytes_read
+        self.voxels += voxels
+
+
+class Profiler(object):
+    """ Collects aggregate statistics and, optionally, a trace of stages.
+
+    Args:
+        trace (bool): If True, every stage is kept for writing a trace.
+    """
+    def __init__(self, trace=False):
+        self.trace = trace
+        self._stats = {}
+        self._events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """ Create a context manager timing a stage.
+
+        Args:
+            name (str): The name of the stage.
+
+        Returns:
+            A context manager whose add method records bytes and voxels.
+        """
+        return _Stage(self, name)
+
+    def record(self, name, start, end, bytes_read=0, voxels=0, failed=False):
+        """ Record a stage that started and ended at perf_counter times."""
+        duration = end - start
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {
+                    'calls': 0, 'failures': 0, 'total_seconds': 0.0,
+                    'max_seconds': 0.0, 'bytes_read': 0, 'voxels': 0}
+            stats['calls'] += 1
+            stats['failures'] += int(failed)
+            stats['total_seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['bytes_read'] += bytes_read
+            stats['voxels'] += voxels
+            if self.trace:
+                self._events.append({
+                    'name': name, 'ph': 'X', 'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'ts': (start - self._origin) * 1e6,
+                    'dur': duration * 1e6,
+                    'args': {'bytes_read': bytes_read, 'voxels': voxels,
+                             'failed': failed}})
+
+    def stats(self):
+        """ Get aggregate statistics of the recorded stages.
+
+        Returns:
+            A dict mapping each stage name to a dict containing the number
+                of calls and failures, total, mean and maximum durations in
+                seconds, and the total bytes read and voxels.
+        """
+        with self._lock:
+            stats = {name: dict(s) for name, s in self._stats.items()}
+        for s in stats.values():
+            s['mean_seconds'] = s['total_seconds'] / s['calls']
+        return stats
+
+    def report(self):
+        """ Format aggregate statistics as a table, slowest stages first.
+
+        Returns:
+            A string.
+        """
+        stats = sorted(self.stats().items(),
+                       key=lambda item: -item[1]['total_seconds'])
+        lines = ['{:<36} {:>7} {:>10} {:>10} {:>10} {:>12}'.format(
+            'stage', 'calls', 'total s', 'mean s', 'MB read', 'voxels')]
+        for name, s in stats:
+            lines.append('{:<36} {:>7} {:>10.4f} {:>10.4f} {:>10.1f} '
+                         '{:>12}'.format(name, s['calls'], s['total_seconds'],
+                                         s['mean_seconds'],
+                                         s['bytes_read'] / 2 ** 20,
+                                         s['voxels']))
+        return '\n'.join(lines)
+
+    def write_trace(self, trace_path):
+        """ Write recorded stages as a Chrome trace event file.
+
+        Args:
+            trace_path (str): Address of the JSON output file.
+        """
+        with self._lock:
+            events = list(self._events)
+        with open(trace_path, 'w') as fout:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fout)
+
+    def reset(self):
+        """ Remove all recorded stages."""
+        with self._lock:
+            self._stats.clear()
+            self._events = []
+
+
+def stage(name):
+    """ Time a stage with the active profiler, if any.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        A context manager whose add method records the bytes read and the
+            voxels decoded by the stage.
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
+
+
+def is_enabled():
+    """ Check whether stages are recorded, e.g. before computing counters."""
+    return _profiler is not None
+
+
+def get_profiler():
+    """ Get the active Profiler, or None if profiling is disabled."""
+    return _profiler
+
+
+def set_profiler(profiler):
+    """ Set the process-wide Profiler.
+
+    Args:
+        profiler: A Profiler, or None for disabling profiling.
+    """
+    global _profiler
+    _profiler = profiler
+
+
+class profile(object):
+    """ Record stages of the load path within a block of code.
+
+    Args:
+        trace_path (str): Address of a trace file written when the block
+            exits. Default is None for collecting aggregate statistics only.
+    """
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.profiler = Profiler(trace=trace_path is not None)
+
+    def __enter__(self):
+        self._previous = get_profiler()
+        set_profiler(self.profiler)
+        return self.profiler
+
+    def __exit__(self, *args):
+        set_profiler(self._previous)
+        if self.trace_path is not None:
+            self.profiler.write_trace(self.trace_path)
+        return False
+
+
+def _profiler_from_environment():
+    """ Create the profiler requested by BIOIMG_PROFILE, if set."""
+    if os.environ.get('BIOIMG_PROFILE', '0') in ('', '0'):
+        return None
+    trace_path = os.environ.get('BIOIMG_PROFILE_TRACE')
+    profiler = Profiler(trace=bool(trace_path))
+    if trace_path:
+        atexit.register(profiler.write_trace, trace_path)
+    return profiler
+
+
+_profiler = _profiler_from_environment()
@@ -0,0 +1,236 @@
+""" This module provides batch rendering of slices for quality assurance.
+
+Rendering is headless: slices are windowed and composited into RGB arrays
+with numpy and encoded as PNG without creating matplotlib figures.
+
+"""
+import io
+import os
+import matplotlib.image
+import numpy as np
+from matplotlib import cm
+
+from utils import get_window_bounds
+
+
+# Observation windows as (location, width) in Hounsfield unit.
+WINDOW_PRESETS = {
+    'brain': (40, 80),
+    'soft_tissue': (40, 400),
+    'lung': (-600, 1500),
+    'bone': (400, 1800),
+}
+# Labels mapped to the first and the last colour of the overlay colormap.
+DEFAULT_LABEL_RANGE = (1, 8)
+
+
+def get_window(window):
+    """ Get the (location, width) of an observation window.
+
+    Args:
+        window: A key of WINDOW_PRESETS or a (location, width) pair.
+
+    Returns:
+        A (location, width) pair.
+    """
+    if isinstance(window, str):
+        if window not in WINDOW_PRESETS:
+            msg = 'Unknown window preset {}; available presets are {}.'
+            raise ValueError(msg.format(window, sorted(WINDOW_PRESETS)))
+        return WINDOW_PRESETS[window]
+    location, width = window
+    return location, width
+
+
+def _get_buffer(buffers, name, shape, dtype):
+    """ Get a working array of buffers, allocating it only when too small.
+
+    Arrays are reused for any number of leading rows up to the number they
+        were allocated for.
+    """
+    shape = tuple(shape)
+    dtype = np.dtype(dtype)
+    array = buffers.get(name)
+    if array is None or array.dtype != dtype or \
+            array.shape[1:] != shape[1:] or array.shape[0] < shape[0]:
+        array = buffers[name] = np.empty(shape, dtype=dtype)
+    return array[:shape[0]]
+
+
+def window_to_uint8(voxels, location, width, buffer=None, out=None):
+    """ Clip voxel values to a window and scale them to 0-255.
+
+    Args:
+        voxels: A numpy array.
+        location: Center point in Hounsfield unit for the observation window.
+        width: Width of the observation window in Hounsfield unit.
+        buffer: A float32 array of the shape of voxels, reused as working
+            memory. Default is None for allocating one.
+        out: A uint8 array of the shape of voxels receiving the result.
+            Default is None for allocating one.
+
+    Returns:
+        A uint8 numpy array.
+    """
+    min_voxel, max_voxel = get_window_bounds(location, width)
+    if buffer is None:
+        buffer = np.empty(voxels.shape, dtype=np.float32)
+    if out is None:
+        out = np.empty(voxels.shape, dtype=np.uint8)
+    np.clip(voxels, min_voxel, max_voxel, out=buffer)
+    buffer -= min_voxel
+    buffer *= 255.0 / max(max_voxel - min_voxel, 1)
+    np.copyto(out, buffer, casting='unsafe')
+    return out
+
+
+def render_montage(volume, mask, windows, slices=None, alpha=0.7,
+                   cmap='autumn', buffers=None,
+                   label_range=DEFAULT_LABEL_RANGE):
+    """ Render slices of a volume as a montage.
+
+    Each row of the montage shows a slice and each column shows a window.
+        All slices are windowed in one vectorized pass per window, reusing
+        the same buffers.
+
+    Args:
+        volume: A 3D numpy array, or any object returning 2D arrays when
+            indexed by slice, e.g. lazy.LazyDICOMVolume.
+        mask: An object of the same kind as volume, or None.
+        windows: A list of keys of WINDOW_PRESETS or (location, width) pairs.
+        slices: A list of slice indices. Default is None for all slices.
+        alpha: Opacity of the mask overlay.
+        cmap: Name of the matplotlib colormap used for the mask overlay.
+        buffers (dict): Working arrays kept across calls, which are reused
+            by calls rendering as many slices or fewer. Default is None for
+            allocating new arrays. The returned montage is then a view of a
+            buffer, overwritten by the next call using the same buffers.
+        label_range: The (low, high) labels mapped to the first and the last
+            colour of cmap. Labels outside the range are clipped. The colour
+            of a label does not depend on the other labels rendered, so it
+            is the same in every montage.
+
+    Returns:
+        A uint8 numpy array of shape (len(slices) * rows,
+            len(windows) * columns, 3).
+
+    Raises:
+        ValueError: If slices is empty.
+    """
+    if buffers is None:
+        buffers = {}
+    if slices is None:
+        slices = range(len(volume))
+    slices = list(slices)
+    if not slices:
+        raise ValueError('At least one slice must be rendered.')
+    windows = [get_window(w) for w in windows]
+    first = np.asarray(volume[slices[0]])
+    voxels = _get_buffer(buffers, 'voxels', (len(slices),) + first.shape,
+                         first.dtype)
+    voxels[0] = first
+    for i, idx in enumerate(slices[1:], 1):
+        voxels[i] = volume[idx]
+    num_slices, height, width = voxels.shape
+    buffer = _get_buffer(buffers, 'float32', voxels.shape, np.float32)
+    gray = _get_buffer(buffers, 'gray', voxels.shape, np.uint8)
+    montage = _get_buffer(buffers, 'montage',
+                          (num_slices, height, len(windows), width, 3),
+                          np.uint8)
+    for j, (location, window_width) in enumerate(windows):
+        window_to_uint8(voxels, location, window_width, buffer=buffer,
+                        out=gray)
+        montage[:, :, j, :, :] = gray[..., np.newaxis]
+    if mask is not None:
+        first = np.asarray(mask[slices[0]])
+        labels = _get_buffer(buffers, 'labels', (num_slices,) + first.shape,
+                             first.dtype)
+        labels[0] = first
+        for i, idx in enumerate(slices[1:], 1):
+            labels[i] = mask[idx]
+        overlay = labels != 0
+        if overlay.any():
+            values = labels[overlay].astype(np.float32)
+            low, high = label_range
+            values = np.clip((values - low) / max(high - low, 1), 0, 1)
+            colors = getattr(cm, cmap)(values)[:, :3] * (255 * alpha)
+            for j in range(len(windows)):
+                column = montage[:, :, j]
+                blended = column[overlay] * (1 - alpha) + colors
+                column[overlay] = blended.astype(np.uint8)
+    return montage.reshape(num_slices * height, len(windows) * width, 3)
+
+
+def encode_png(rgb):
+    """ Encode an RGB uint8 array as PNG bytes without a matplotlib figure.
+
+    Args:
+        rgb: A uint8 numpy array of shape (rows, columns, 3).
+
+    Returns:
+        PNG encoded bytes.
+    """
+    stream = io.BytesIO()
+    matplotlib.image.imsave(stream, rgb, format='png')
+    return stream.getvalue()
+
+
+def render_slice_png(image, mask, location, width, alpha=0.7):
+    """ Render a slice as PNG bytes, a headless variant of visualize_slice.
+
+    Args:
+        image: A 2D numpy array.
+        mask: A 2D numpy array, or None.
+        location: Center point in Hounsfield unit for the observation window.
+        width: Width of the observation window in Hounsfield unit.
+        alpha: Opacity of the mask overlay.
+
+    Returns:
+        PNG encoded bytes.
+    """
+    image = image[np.newaxis]
+    mask = None if mask is None else mask[np.newaxis]
+    montage = render_montage(image, mask, [(location, width)], alpha=alpha)
+    return encode_png(montage)
+
+
+def write_montages(volume, mask, windows, output_pattern, slices=None,
+                   slices_per_montage=16, alpha=0.7,
+                   label_range=DEFAULT_LABEL_RANGE):
+    """ Write montages of many slices of a volume as PNG files.
+
+    Args:
+        volume: A 3D numpy array, or any object returning 2D arrays when
+            indexed by slice, e.g. lazy.LazyDICOMVolume.
+        mask: An object of the same kind as volume, or None.
+        windows: A list of keys of WINDOW_PRESETS or (location, width) pairs.
+        output_pattern (str): Address of output files containing '{}', which
+            is replaced by the montage number, e.g. 'qa/brain1_{:03d}.png'.
+        slices: A list of slice indices. Default is None for all slices.
+        slices_per_montage (int): Maximum number of slices in each montage.
+        alpha: Opacity of the mask overlay.
+        label_range: The (low, high) labels mapped to the ends of the overlay
+            colormap, see render_montage.
+
+    Returns:
+        A list of addresses of the written files.
+    """
+    if slices is None:
+        slices = range(len(volume))
+    slices = list(slices)
+    file_paths = []
+    # Working arrays are allocated for the first montage and reused
+    buffers = {}
+    for number, start in enumerate(range(0, len(slices), slices_per_montage)):
+        montage = render_montage(volume, mask, windows,
+                                 slices[start: start + slices_per_montage],
+                                 alpha=alpha, buffers=buffers,
+                                 label_range=label_range)
+        file_path = output_pattern.format(number)
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'wb') as fout:
+            fout.write(encode_png(montage))
+        file_paths.append(file_path)
+    return file_paths
@@ -0,0 +1,152 @@
+""" This module provides extraction of regions of interest defined by masks.
+
+"""
+import numpy as np
+import SimpleITK as sitk
+
+
+def get_bounding_box(mask, label=None):
+    """ Compute the bounding box of the labeled voxels of a mask.
+
+    Args:
+        mask: A SimpleITK.Image.
+        label: The label of the structure. Default is None for all non-zero
+            voxels.
+
+    Returns:
+        The start index and the size of the bounding box, both in numpy
+            order, i.e. (z, y, x) for 3D images.
+    """
+    binary = mask != 0 if label is None else mask == label
+    statistics = sitk.LabelShapeStatisticsImageFilter()
+    statistics.Execute(binary)
+    if not statistics.HasLabel(1):
+        raise ValueError('The mask contains no voxel with label {}.'.format(
+            'other than 0' if label is None else label))
+    bounding_box = statistics.GetBoundingBox(1)
+    dimension = mask.GetDimension()
+    start = tuple(bounding_box[:dimension][::-1])
+    size = tuple(bounding_box[dimension:][::-1])
+    return start, size
+
+
+def pad_region(start, size, padding, shape):
+    """ Pad a region and clip it to an image.
+
+    Args:
+        start: The start index of the region in numpy order.
+        size: The size of the region in numpy order.
+        padding: Number of voxels added around the region, as an integer or
+            one integer per axis in numpy order.
+        shape: The shape of the image in numpy order.
+
+    Returns:
+        A tuple of slices, one per axis in numpy order.
+    """
+    padding = np.broadcast_to(padding, len(shape))
+    return tuple(slice(int(max(0, s - p)), int(min(d, s + n + p)))
+                 for s, n, p, d in zip(start, size, padding, shape))
+
+
+def crop_image(image, slices):
+    """ Crop an image to a region, keeping its geometry.
+
+    Args:
+        image: A SimpleITK.Image.
+        slices: A tuple of slices, one per axis in numpy order, as returned
+            by pad_region.
+
+    Returns:
+        A SimpleITK.Image.
+    """
+    return sitk.RegionOfInterest(image,
+                                 [s.stop - s.start for s in slices[::-1]],
+                                 [s.start for s in slices[::-1]])
+
+
+class RegionOfInterest(object):
+    """ The region around a labeled structure of an image and its mask.
+
+    Arrays are read-only views of the voxel values of image and mask, which
+        are kept alive by this object.
+
+    Args:
+        image: A SimpleITK.Image.
+        mask: A SimpleITK.Image of the same geometry as image.
+        start: The start index of the bounding box in numpy order.
+        size: The size of the bounding box in numpy order.
+        padding: Number of voxels added around the bounding box, as an
+            integer or one integer per axis in numpy order. The padded region
+            is clipped to the image.
+    """
+    def __init__(self, image, mask, start, size, padding=0):
+        self.image = image
+        self.mask = mask
+        self.start = tuple(start)
+        self.size = tuple(size)
+        self.slices = pad_region(start, size, padding,
+                                 image.GetSize()[::-1])
+
+    @property
+    def image_array(self):
+        """ Voxel values of the image within the region, as a view."""
+        return sitk.GetArrayViewFromImage(self.image)[self.slices]
+
+    @property
+    def mask_array(self):
+        """ Voxel values of the mask within the region, as a view."""
+        return sitk.GetArrayViewFromImage(self.mask)[self.slices]
+
+    def crop_images(self):
+        """ Crop the image and its mask to the region, keeping geometry.
+
+        Returns:
+            The cropped image as a SimpleITK.Image.
+            The cropped mask as a SimpleITK.Image.
+        """
+        index = tuple(slice(s.start, s.stop) for s in self.slices[::-1])
+        return self.image[index], self.mask[index]
+
+    def extract_patches(self, patch_size, stride=None):
+        """ Extract fixed-size patches covering the region.
+
+        Patches are laid on a regular grid over the region. Patches crossing
+            the image border are shifted to lie within the image, so regions
+            smaller than a patch yield a patch centered on the region.
+
+        Args:
+            patch_size: The size of patches in numpy order.
+            stride: The distance between patches in numpy order. Default is
+                None for non-overlapping patches, i.e. stride = patch_size.
+
+        Returns:
+            image patches as a contiguous array of shape (N,) + patch_size.
+            mask patches as a contiguous array of shape (N,) + patch_size.
+        """
+        patch_size = tuple(patch_size)
+        stride = patch_size if stride is None else tuple(stride)
+        shape = self.image.GetSize()[::-1]
+        if any(p > d for p, d in zip(patch_size, shape)):
+            msg = 'Patch size {} exceeds image shape {}.'
+            raise ValueError(msg.format(patch_size, shape))
+        axes = []
+        for s, p, step, d in zip(self.slices, patch_size, stride, shape):
+            length = s.stop - s.start
+            if length <= p:
+                starts = [s.start + (length - p) // 2]
+            else:
+                starts = list(range(s.start, s.stop - p, step)) + [s.stop - p]
+            axes.append(sorted(set(min(max(0, x), d - p) for x in starts)))
+        grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+        grid = grid.reshape(-1, len(shape))
+        image_voxels = sitk.GetArrayViewFromImage(self.image)
+        mask_voxels = sitk.GetArrayViewFromImage(self.mask)
+        image_patches = np.empty((len(grid),) + patch_size,
+                                 dtype=image_voxels.dtype)
+        mask_patches = np.empty((len(grid),) + patch_size,
+                                dtype=mask_voxels.dtype)
+        for i, corner in enumerate(grid):
+            index = tuple(slice(c, c + p) for c, p in zip(corner, patch_size))
+            image_patches[i] = image_voxels[index]
+            mask_patches[i] = mask_voxels[index]
+        return image_patches, mask_patches
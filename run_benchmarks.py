@@ -0,0 +1,371 @@
+""" Benchmarks for loading, conversion and visualization hot paths.
+
+Synthetic DICOM series, NIfTI and NRRD volumes are generated in a temporary
+directory, so the benchmarks run offline. Each benchmark runs in its own
+process, started with the 'spawn' method by default, so that its peak
+resident set size (RSS) is measured in isolation.
+
+Example:
+    python run_benchmarks.py --size 256 --slices 64 --output bench.json
+    python run_benchmarks.py --compare bench.json
+
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import SimpleITK as sitk
+
+
+def write_dicom_series(image, dir_path):
+    """ Write a 3D SimpleITK.Image as a DICOM series, one file per slice.
+
+    Args:
+        image: A 3D SimpleITK.Image with an integer pixel type.
+        dir_path (str): Address of the output directory.
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    writer = sitk.ImageFileWriter()
+    writer.KeepOriginalImageUIDOn()
+    uid_suffix = time.strftime('%Y%m%d.%H%M%S')
+    direction = image.GetDirection()
+    series_tags = [
+        ('0008|0060', 'CT'),
+        ('0008|103e', 'Synthetic benchmark series'),
+        ('0010|0020', 'BENCHMARK'),
+        ('0020|000d', '1.2.826.0.1.3680043.2.1125.1.' + uid_suffix),
+        ('0020|000e', '1.2.826.0.1.3680043.2.1125.2.' + uid_suffix),
+        ('0020|0037', '\\'.join(map(str, direction[0:3] + direction[3:6]))),
+        ('0028|1052', '0'),
+        ('0028|1053', '1'),
+    ]
+    for i in range(image.GetDepth()):
+        image_slice = image[:, :, i]
+        for tag, value in series_tags:
+            image_slice.SetMetaData(tag, value)
+        position = image.TransformIndexToPhysicalPoint((0, 0, i))
+        image_slice.SetMetaData('0020|0032', '\\'.join(map(str, position)))
+        image_slice.SetMetaData('0020|0013', str(i + 1))
+        writer.SetFileName(os.path.join(dir_path,
+                                        'IMG{:04d}.dcm'.format(i + 1)))
+        writer.Execute(image_slice)
+
+
+def generate_data(data_dir, size, slices, catalog_rows):
+    """ Generate the synthetic data used by the benchmarks.
+
+    Args:
+        data_dir (str): Address of the output directory.
+        size (int): Number of rows and columns of each slice.
+        slices (int): Number of slices of each volume.
+        catalog_rows (int): Number of rows of the synthetic catalog.
+
+    Returns:
+        A dict mapping data names to their addresses.
+    """
+    rng = np.random.default_rng(0)
+    voxels = rng.integers(-1000, 2000, size=(slices, size, size),
+                          dtype=np.int16)
+    image = sitk.GetImageFromArray(voxels)
+    image.SetSpacing((0.8, 0.8, 2.5))
+    image.SetOrigin((-100.0, -100.0, 0.0))
+    mask_voxels = np.zeros_like(voxels)
+    mask_voxels[:, size // 4: size // 2, size // 4: size // 2] = 1
+    mask = sitk.GetImageFromArray(mask_voxels)
+    mask.CopyInformation(image)
+    paths = {
+        'dicom_dir': os.path.join(data_dir, 'image'),
+        'nifti': os.path.join(data_dir, 'image.nii'),
+        'nrrd': os.path.join(data_dir, 'image.nrrd'),
+        'mask_nrrd': os.path.join(data_dir, 'mask.nrrd'),
+        'catalog': os.path.join(data_dir, 'catalog.csv'),
+    }
+    write_dicom_series(image, paths['dicom_dir'])
+    sitk.WriteImage(image, paths['nifti'])
+    sitk.WriteImage(image, paths['nrrd'])
+    sitk.WriteImage(mask, paths['mask_nrrd'])
+    with open(paths['catalog'], 'w') as fout:
+        for i in range(catalog_rows):
+            fout.write('sample{0},CT1,{1},{2}\n'.format(
+                i, paths['nrrd'], paths['mask_nrrd']))
+    return paths
+
+
+def _load(source, modality):
+    from bioimage import BioImage
+    return BioImage(source, modality=modality).load()
+
+
+def _file_bytes(path):
+    """ Get the number of bytes of a file, or of the files of a directory."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name))
+                   for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+# Each setup function returns the benchmarked callable and the number of
+# bytes it processes, or None if its throughput is not measured in bytes.
+
+
+def bench_load_dicom_dir(paths):
+    from constants import Modality
+    return (lambda: _load(paths['dicom_dir'], Modality.DICOM_CT_DIR),
+            _file_bytes(paths['dicom_dir']))
+
+
+def bench_load_nifti(paths):
+    from constants import Modality
+    return (lambda: _load(paths['nifti'], Modality.SIMPLE_IMAGE),
+            _file_bytes(paths['nifti']))
+
+
+def bench_load_nrrd(paths):
+    from constants import Modality
+    return (lambda: _load(paths['nrrd'], Modality.SIMPLE_IMAGE),
+            _file_bytes(paths['nrrd']))
+
+
+def bench_read_DICOM_from_dir(paths):
+    from utils import read_DICOM_from_dir
+    return (lambda: read_DICOM_from_dir(paths['dicom_dir']),
+            _file_bytes(paths['dicom_dir']))
+
+
+def bench_get_array_view(paths):
+    from ct import SimpleImage
+    image = sitk.ReadImage(paths['nrrd'])
+    num_bytes = sitk.GetArrayViewFromImage(image).nbytes
+    return lambda: SimpleImage.get_array(image), num_bytes
+
+
+def bench_get_array_copy(paths):
+    from ct import SimpleImage
+    image = sitk.ReadImage(paths['nrrd'])
+    num_bytes = sitk.GetArrayViewFromImage(image).nbytes
+    return lambda: SimpleImage.get_array(image, copy=True), num_bytes
+
+
+def bench_read_catalog(paths):
+    from utils import read_catalog
+    return (lambda: read_catalog(paths['catalog']),
+            _file_bytes(paths['catalog']))
+
+
+def bench_partition(paths):
+    from utils import read_catalog
+    from utils import partition
+    catalog = read_catalog(paths['catalog'])
+    return lambda: partition(catalog, [0.7, 0.15, 0.15]), None
+
+
+def bench_visualize_slice(paths):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from utils import visualize_slice
+    voxels = sitk.GetArrayFromImage(sitk.ReadImage(paths['nrrd']))
+    mask = sitk.GetArrayFromImage(sitk.ReadImage(paths['mask_nrrd']))
+    fig, ax = plt.subplots()
+
+    def run():
+        for idx in range(voxels.shape[0]):
+            ax.clear()
+            visualize_slice(voxels[idx], mask[idx], ax, 40, 400, cmap='gray')
+            fig.canvas.draw()
+    return run, voxels.nbytes + mask.nbytes
+
+
+# Each benchmark maps to its setup function and its unit of work, used for
+# computing throughput: 'slices' for volumes, 'rows' for catalogs.
+BENCHMARKS = {
+    'load_dicom_dir': (bench_load_dicom_dir, 'slices'),
+    'load_nifti': (bench_load_nifti, 'slices'),
+    'load_nrrd': (bench_load_nrrd, 'slices'),
+    'read_DICOM_from_dir': (bench_read_DICOM_from_dir, 'slices'),
+    'get_array_view': (bench_get_array_view, 'slices'),
+    'get_array_copy': (bench_get_array_copy, 'slices'),
+    'read_catalog': (bench_read_catalog, 'rows'),
+    'partition': (bench_partition, 'rows'),
+    'visualize_slice': (bench_visualize_slice, 'slices'),
+}
+
+
+def _run_benchmark(name, paths, config, results):
+    """ Run a benchmark and put its measurements in the results queue."""
+    setup, unit = BENCHMARKS[name]
+    run, num_bytes = setup(paths)
+    run()  # Warm up caches, lazy imports and allocators
+    durations = []
+    for _ in range(config['repeat']):
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+    median = statistics.median(durations)
+    units = config['slices'] if unit == 'slices' else config['catalog_rows']
+    result = {
+        'seconds_min': min(durations),
+        'seconds_median': median,
+        '{}_per_second'.format(unit): units / median,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if num_bytes is not None:
+        result['mb_per_second'] = num_bytes / 2 ** 20 / median
+    results.put((name, result))
+
+
+def _get_result(process, results, name, timeout):
+    """ Wait for the result of a benchmark process.
+
+    The result is read before joining the process, which cannot exit until
+        the queue is drained.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return results.get(timeout=min(1.0, timeout))[1]
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may have arrived just before the process exited
+            try:
+                return results.get(timeout=1.0)[1]
+            except queue.Empty:
+                msg = 'Benchmark {} failed with exit code {}.'
+                raise RuntimeError(msg.format(name, process.exitcode))
+        if time.monotonic() > deadline:
+            process.terminate()
+            process.join()
+            msg = 'Benchmark {} did not finish within {} seconds.'
+            raise RuntimeError(msg.format(name, timeout))
+
+
+def run_benchmarks(names, config, data_dir, timeout=3600,
+                   start_method='spawn'):
+    """ Run benchmarks, each in a separate process.
+
+    Args:
+        names: Names of benchmarks, i.e. keys of BENCHMARKS.
+        config (dict): Contains size, slices, catalog_rows and repeat.
+        data_dir (str): Address of the directory for synthetic data.
+        timeout (float): Maximum number of seconds for each benchmark.
+        start_method (str): The multiprocessing start method of benchmark
+            processes. Forked processes start with the resident memory of
+            this process, which inflates their peak RSS. Default is 'spawn'.
+
+    Returns:
+        A dict mapping each benchmark name to its measurements.
+    """
+    paths = generate_data(data_dir, config['size'], config['slices'],
+                          config['catalog_rows'])
+    context = multiprocessing.get_context(start_method)
+    measurements = {}
+    for name in names:
+        results = context.Queue()
+        process = context.Process(target=_run_benchmark,
+                                  args=(name, paths, config, results))
+        process.start()
+        measurements[name] = _get_result(process, results, name, timeout)
+        process.join(timeout)
+    return measurements
+
+
+def compare(current, baseline, tolerance):
+    """ Find benchmarks whose median duration regressed.
+
+    Args:
+        current (dict): Measurements as returned by run_benchmarks.
+        baseline (dict): Measurements of a previous run.
+        tolerance (float): Allowed relative slowdown, e.g. 0.1 for 10%.
+
+    Returns:
+        A dict mapping each regressed benchmark to its slowdown ratio.
+    """
+    regressions = {}
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds_median'] / baseline[name]['seconds_median']
+        if ratio > 1 + tolerance:
+            regressions[name] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=256,
+                        help='Rows and columns of each slice.')
+    parser.add_argument('--slices', type=int, default=64,
+                        help='Number of slices of each volume.')
+    parser.add_argument('--catalog-rows', type=int, default=100000,
+                        help='Number of rows of the synthetic catalog.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs of each benchmark.')
+    parser.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS),
+                        default=list(BENCHMARKS),
+                        help='Benchmarks to run. Default is all.')
+    parser.add_argument('--timeout', type=float, default=3600,
+                        help='Maximum number of seconds for each benchmark.')
+    parser.add_argument('--start-method', default='spawn',
+                        choices=multiprocessing.get_all_start_methods(),
+                        help='Start method of benchmark processes.')
+    parser.add_argument('--output', help='Address of the JSON output file.')
+    parser.add_argument('--compare',
+                        help='Address of a JSON output file of a previous '
+                             'run.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative slowdown when comparing.')
+    args = parser.parse_args(argv)
+    config = {'size': args.size, 'slices': args.slices,
+              'catalog_rows': args.catalog_rows, 'repeat': args.repeat}
+    data_dir = tempfile.mkdtemp()
+    try:
+        measurements = run_benchmarks(args.benchmarks, config, data_dir,
+                                      timeout=args.timeout,
+                                      start_method=args.start_method)
+    finally:
+        shutil.rmtree(data_dir)
+    report = {
+        'config': config,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'SimpleITK': sitk.Version.VersionString(),
+            'start_method': args.start_method,
+        },
+        'results': measurements,
+    }
+    for name, result in measurements.items():
+        throughput = ', '.join('{}={:.1f}'.format(k, v)
+                               for k, v in result.items()
+                               if k.endswith('_per_second'))
+        print('{:<22} median {:9.4f}s  {}  peak RSS {:.0f} MB'.format(
+            name, result['seconds_median'], throughput,
+            result['peak_rss_mb']))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2)
+    if args.compare:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)['results']
+        regressions = compare(measurements, baseline, args.tolerance)
+        for name, ratio in regressions.items():
+            print('REGRESSION {}: {:.2f}x slower'.format(name, ratio))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
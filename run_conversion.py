@@ -0,0 +1,234 @@
+""" Convert the images of a catalog into chunked volume files.
+
+Each image and mask of the catalog, e.g. a directory of DICOM files, is
+transcoded into one chunked volume (.biv) file, see chunked.py. Rows are
+converted by a pool of processes. Conversion is resumable: files are written
+atomically and a file is converted again only if it is missing or its source
+files have changed since it was written. A catalog referring to the
+converted files is written; its rows are loaded with Modality.AUTO, which
+detects the chunked volume files, e.g. batch.load_catalog(rows, Modality.AUTO).
+
+Example:
+    python run_conversion.py catalog.csv converted/ --num-workers 8
+
+"""
+import argparse
+import collections
+import functools
+import os
+import sys
+
+from batch import map_catalog
+from bioimage import BioImage
+from chunked import CHUNK_SLICES
+from chunked import read_chunked_header
+from chunked import write_chunked_volume
+from constants import Modality
+from utils import fingerprint
+from utils import read_catalog
+
+ConversionResult = collections.namedtuple(
+    'ConversionResult', ['index', 'record', 'converted', 'error'])
+ConversionResult.__doc__ = """ The outcome of converting one catalog row.
+
+    Attributes:
+        index (int): Position of the row in the catalog.
+        record: The catalog row referring to the converted files.
+        converted (int): Number of files written, excluding up to date files.
+        error: The exception raised while converting the row, or None.
+"""
+
+
+def convert_source(source, modality, output_path, chunk_slices=CHUNK_SLICES,
+                   level=1):
+    """ Convert an image to a chunked volume file, unless it is up to date.
+
+    Args:
+        source (str): Address of the image.
+        modality: A Modality value of the image.
+        output_path (str): Address of the chunked volume file.
+        chunk_slices (int): Number of slices of each chunk.
+        level (int): The zlib compression level from 0 to 9.
+
+    Returns:
+        True if the file was written, or False if it was up to date.
+    """
+    source_fingerprint = fingerprint(source)
+    if os.path.exists(output_path):
+        try:
+            header = read_chunked_header(output_path)
+        except ValueError:
+            header = {}
+        if header.get('source_fingerprint') == source_fingerprint:
+            return False
+    image = BioImage(source, modality=modality).load()
+    write_chunked_volume(image, output_path, chunk_slices=chunk_slices,
+                         level=level, source_fingerprint=source_fingerprint)
+    return True
+
+
+def output_name(sample_id, image_id):
+    """ Get the base name of the files converted from a catalog row.
+
+    Args:
+        sample_id (str): The sample identifier of the row.
+        image_id (str): The image identifier of the row.
+
+    Returns:
+        The base name, to which '_image.biv' or '_mask.biv' is appended.
+
+    Raises:
+        ValueError: If an identifier is empty, contains a path separator or
+            refers to a directory, e.g. '..'.
+    """
+    separators = [sep for sep in (os.sep, os.altsep, '/') if sep]
+    for identifier in (sample_id, image_id):
+        if identifier in ('', '.', '..') or \
+                any(sep in identifier for sep in separators):
+            msg = 'Identifiers must be file names, but {!r} is not.'
+            raise ValueError(msg.format(identifier))
+    return '{}_{}'.format(sample_id, image_id)
+
+
+def _convert_record(index, record, modality, output_dir, chunk_slices,
+                    level):
+    """ Convert the image and the mask of a catalog row."""
+    try:
+        sample_id, image_id, image_src = record[:3]
+        mask_src = record[3] if len(record) > 3 and record[3] else None
+        base = os.path.join(output_dir, output_name(sample_id, image_id))
+        converted_record = [sample_id, image_id, base + '_image.biv', '']
+        converted = int(convert_source(image_src, modality,
+                                       converted_record[2],
+                                       chunk_slices=chunk_slices,
+                                       level=level))
+        if mask_src is not None:
+            converted_record[3] = base + '_mask.biv'
+            converted += int(convert_source(mask_src, modality,
+                                            converted_record[3],
+                                            chunk_slices=chunk_slices,
+                                            level=level))
+    except Exception as error:
+        return ConversionResult(index, record, 0, error)
+    return ConversionResult(index, converted_record, converted, None)
+
+
+def _convert_pending(position, item, **kwargs):
+    """ Convert an (index, record) item of the rows to convert."""
+    index, record = item
+    return _convert_record(index, record, **kwargs)
+
+
+def _failed_pending(position, item, error):
+    index, record = item
+    return ConversionResult(index, record, 0, error)
+
+
+def _check_names(catalog):
+    """ Find the rows whose output names are invalid or not unique.
+
+    Returns:
+        A dict mapping the index of each such row to a ValueError.
+    """
+    errors = {}
+    names = collections.defaultdict(list)
+    for index, record in enumerate(catalog):
+        if len(record) < 2:
+            continue  # Reported when converting the row
+        try:
+            names[output_name(record[0], record[1])].append(index)
+        except ValueError as error:
+            errors[index] = error
+    for name, indices in names.items():
+        if len(indices) > 1:
+            msg = 'Output name {} is shared by rows {}.'
+            error = ValueError(msg.format(name, ', '.join(map(str, indices))))
+            errors.update(dict.fromkeys(indices, error))
+    return errors
+
+
+def convert_catalog(catalog, modality, output_dir, num_workers=4,
+                    executor='process', chunk_slices=CHUNK_SLICES, level=1):
+    """ Convert the images and masks of a catalog into chunked volumes.
+
+    Files are named after the sample_id and image_id of each row, see
+        output_name. Rows whose identifiers are not file names, or whose
+        output names are not unique, e.g. ('a_b', 'c') and ('a', 'b_c'),
+        are reported as failed and not converted, so that no two rows write
+        the same files. Other rows are converted.
+
+    Args:
+        catalog: A sequence of catalog rows as returned by
+            utils.read_catalog.
+        modality: A Modality value of the images, e.g. Modality.DICOM_CT_DIR,
+            or Modality.AUTO.
+        output_dir (str): Address of the directory for converted files. It is
+            created if it does not exist.
+        num_workers (int): Number of threads or processes.
+        executor (str): Either 'thread' or 'process'.
+        chunk_slices (int): Number of slices of each chunk.
+        level (int): The zlib compression level from 0 to 9.
+
+    Returns:
+        A list of ConversionResult objects in catalog order.
+    """
+    errors = _check_names(catalog)
+    results = {index: ConversionResult(index, catalog[index], 0, error)
+               for index, error in errors.items()}
+    pending = [(index, record) for index, record in enumerate(catalog)
+               if index not in errors]
+    os.makedirs(output_dir, exist_ok=True)
+    function = functools.partial(_convert_pending, modality=modality,
+                                 output_dir=output_dir,
+                                 chunk_slices=chunk_slices, level=level)
+    for result in map_catalog(pending, function, num_workers=num_workers,
+                              executor=executor,
+                              failed_result=_failed_pending):
+        results[result.index] = result
+    return [results[index] for index in range(len(catalog))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('catalog', help='Address of the catalog file.')
+    parser.add_argument('output_dir',
+                        help='Address of the directory of converted files.')
+    parser.add_argument('--modality', default=Modality.DICOM_CT_DIR,
+                        help='Modality of the images. Default is '
+                             'DICOM_CT_DIR.')
+    parser.add_argument('--sep', default=',',
+                        help='Field separator of the input and output '
+                             'catalogs.')
+    parser.add_argument('--output-catalog',
+                        help='Address of the catalog of converted files. '
+                             'Default is catalog.csv in output_dir.')
+    parser.add_argument('--num-workers', type=int, default=4,
+                        help='Number of worker processes.')
+    parser.add_argument('--chunk-slices', type=int, default=CHUNK_SLICES,
+                        help='Number of slices of each chunk.')
+    parser.add_argument('--level', type=int, default=1,
+                        help='The zlib compression level from 0 to 9.')
+    args = parser.parse_args(argv)
+    catalog = read_catalog(args.catalog, sep=args.sep)
+    results = convert_catalog(catalog, args.modality, args.output_dir,
+                              num_workers=args.num_workers,
+                              chunk_slices=args.chunk_slices,
+                              level=args.level)
+    output_catalog = args.output_catalog or os.path.join(args.output_dir,
+                                                         'catalog.csv')
+    with open(output_catalog, 'w') as fout:
+        for result in results:
+            if result.error is None:
+                fout.write(args.sep.join(result.record) + '\n')
+    failed = [r for r in results if r.error is not None]
+    print('Converted {} files; {} rows up to date; {} rows failed.'.format(
+        sum(r.converted for r in results),
+        sum(1 for r in results if r.error is None and r.converted == 0),
+        len(failed)))
+    for result in failed:
+        print('FAILED row {}: {}'.format(result.index, result.error))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+""" This module provides an index of the DICOM series within a directory tree.
+
+"""
+import collections
+import json
+import os
+import warnings
+import SimpleITK as sitk
+
+
+# DICOM tags stored for every series of a SeriesIndex.
+SERIES_TAGS = {
+    'PatientID': '0010|0020',
+    'StudyInstanceUID': '0020|000d',
+    'SeriesNumber': '0020|0011',
+    'SeriesDescription': '0008|103e',
+    'Modality': '0008|0060',
+}
+
+SeriesEntry = collections.namedtuple(
+    'SeriesEntry', ['series_id', 'directory', 'file_names', 'tags'])
+SeriesEntry.__doc__ = """ A DICOM series of a SeriesIndex.
+
+    Attributes:
+        series_id (str): The series instance UID.
+        directory (str): Address of the directory containing the series.
+        file_names: Addresses of the files of the series, sorted by
+            geometry.
+        tags (dict): Values of SERIES_TAGS for the first file of the series.
+"""
+
+
+class SeriesIndex(object):
+    """ An index mapping DICOM series UIDs to their sorted files.
+
+    A directory tree is scanned once using SeriesIndex.build, and the index
+        can be saved and loaded, so that selecting a series does not require
+        rescanning directories.
+
+    Args:
+        entries: An iterable of SeriesEntry objects.
+    """
+    def __init__(self, entries=()):
+        self.entries = collections.OrderedDict()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        """ Add a series to the index.
+
+        A series found in more than one directory is indexed only once; the
+            first directory is kept.
+
+        Args:
+            entry (SeriesEntry): The series to add.
+        """
+        if entry.series_id in self.entries:
+            msg = ('Series {} is found in both {} and {}; the latter is '
+                   'ignored.')
+            warnings.warn(msg.format(entry.series_id,
+                                     self.entries[entry.series_id].directory,
+                                     entry.directory))
+            return
+        self.entries[entry.series_id] = entry
+
+    @classmethod
+    def scan_dir(cls, dir_path):
+        """ Find the DICOM series directly within a directory.
+
+        Addresses are stored as absolute paths, so a saved index can be used
+            from any working directory.
+
+        Args:
+            dir_path (str): Address of a directory.
+
+        Returns:
+            A list of SeriesEntry objects.
+        """
+        dir_path = os.path.abspath(dir_path)
+        entries = []
+        for series_id in sitk.ImageSeriesReader.GetGDCMSeriesIDs(dir_path):
+            file_names = sitk.ImageSeriesReader.GetGDCMSeriesFileNames(
+                dir_path, series_id)
+            reader = sitk.ImageFileReader()
+            reader.SetFileName(file_names[0])
+            reader.ReadImageInformation()
+            tags = {name: reader.GetMetaData(tag).strip()
+                    for name, tag in SERIES_TAGS.items()
+                    if reader.HasMetaDataKey(tag)}
+            entries.append(SeriesEntry(
+                series_id, dir_path,
+                tuple(os.path.abspath(f) for f in file_names), tags))
+        return entries
+
+    @classmethod
+    def build(cls, root, recursive=True):
+        """ Create an index of the DICOM series within a directory tree.
+
+        Args:
+            root (str): Address of a directory.
+            recursive (bool): If True, subdirectories of root are scanned as
+                well. Default is True.
+
+        Returns:
+            A SeriesIndex.
+        """
+        if not os.path.isdir(root):
+            msg = '{} must be a directory address, but it is not.'
+            raise ValueError(msg.format(root))
+        if recursive:
+            directories = sorted(dir_path for dir_path, _, _ in os.walk(root))
+        else:
+            directories = [root]
+        index = cls()
+        for dir_path in directories:
+            for entry in SeriesIndex.scan_dir(dir_path):
+                index.add(entry)
+        return index
+
+    def save(self, file_path):
+        """ Save the index as a JSON file.
+
+        Args:
+            file_path (str): Address of the index file.
+        """
+        entries = [entry._asdict() for entry in self.entries.values()]
+        with open(file_path, 'w') as fout:
+            json.dump(entries, fout)
+
+    @classmethod
+    def load(cls, file_path):
+        """ Load an index saved using SeriesIndex.save.
+
+        Args:
+            file_path (str): Address of the index file.
+
+        Returns:
+            A SeriesIndex.
+        """
+        with open(file_path) as fin:
+            entries = json.load(fin)
+        return cls(SeriesEntry(e['series_id'], e['directory'],
+                               tuple(e['file_names']), e['tags'])
+                   for e in entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, series_id):
+        return series_id in self.entries
+
+    def get(self, series_id):
+        """ Get a series by its UID.
+
+        Args:
+            series_id (str): A series instance UID.
+
+        Returns:
+            A SeriesEntry.
+        """
+        if series_id not in self.entries:
+            raise ValueError('Series {} is not indexed.'.format(series_id))
+        return self.entries[series_id]
+
+    def find(self, predicate=None, directory=None):
+        """ Find the series satisfying a predicate.
+
+        Args:
+            predicate: A callable taking a SeriesEntry and returning a bool.
+                Default is None for selecting every series.
+            directory (str): If given, only series within this directory are
+                considered.
+
+        Returns:
+            A list of SeriesEntry objects.
+        """
+        if directory is not None:
+            directory = os.path.abspath(directory)
+        return [entry for entry in self.entries.values()
+                if (directory is None or
+                    os.path.abspath(entry.directory) == directory) and
+                (predicate is None or predicate(entry))]
+
+    def select(self, series=None, directory=None):
+        """ Select exactly one series by UID or by predicate.
+
+        Args:
+            series: A series instance UID, a callable taking a SeriesEntry
+                and returning a bool, or None for selecting any series.
+            directory (str): If given, only series within this directory are
+                considered.
+
+        Returns:
+            A SeriesEntry.
+
+        Raises:
+            ValueError: If no series or more than one series is selected.
+        """
+        if isinstance(series, str):
+            entry = self.get(series)
+            if directory is not None and \
+                    os.path.abspath(entry.directory) != \
+                    os.path.abspath(directory):
+                msg = 'Series {} is not within directory {}.'
+                raise ValueError(msg.format(series, directory))
+            return entry
+        entries = self.find(series, directory=directory)
+        if len(entries) != 1:
+            msg = 'Exactly one series must be selected, but {} are selected.'
+            raise ValueError(msg.format(len(entries)))
+        return entries[0]
@@ -12,6 +12,10 @@ setuptools.setup(
      long_description=long_description,
      url="https://github.com/FarhadMaleki/bioimg",
      packages=setuptools.find_packages(),
+     extras_require={
+         # Accelerated decompression of .nii.gz files, see formats.py
+         'fast': ['isal'],
+     },
      classifiers=[
          "Programming Language :: Python :: 3",
          "License :: OSI Approved :: MIT License",
@@ -0,0 +1,192 @@
+""" This module provides shared-memory transport of images between processes.
+
+A worker process copies a loaded image into a shared memory block and sends
+back a SharedVolume, a small handle holding the name of the block and the
+geometry of the image. The receiving process maps the block as a numpy array
+without copying voxel values.
+
+Blocks are reference counted within the receiving process: a block is
+unlinked when the last SharedVolume referring to it is released or garbage
+collected. Blocks are also registered with the multiprocessing resource
+tracker, which unlinks the blocks left behind when the processes using them
+exit, e.g. after a crash of the receiving process.
+
+"""
+import threading
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+import SimpleITK as sitk
+
+
+# Blocks mapped in this process as {name: [SharedMemory, references]}
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def ensure_tracker_running():
+    """ Start the resource tracker before worker processes are created.
+
+    Worker processes then share the tracker of the current process, so the
+        blocks they create outlive them until released by this process.
+    """
+    resource_tracker.ensure_running()
+
+
+def _acquire(name):
+    with _blocks_lock:
+        block = _blocks.get(name)
+        if block is None:
+            block = _blocks[name] = [shared_memory.SharedMemory(name=name), 0]
+        block[1] += 1
+        return block[0]
+
+
+def _release(name):
+    with _blocks_lock:
+        block = _blocks.get(name)
+        if block is None:
+            return
+        block[1] -= 1
+        if block[1] > 0:
+            return
+        del _blocks[name]
+    memory = block[0]
+    try:
+        memory.close()
+    except BufferError:
+        # Arrays still refer to the mapping; it is closed when they are
+        # garbage collected, while the block is unlinked now.
+        pass
+    try:
+        memory.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedVolume(object):
+    """ A handle to an image stored in a shared memory block.
+
+    Handles are created by from_image in the process loading the image and
+        pickled to the receiving process. A handle unpickled in the
+        receiving process owns a reference to the block, which is released
+        by release or by garbage collection of the handle.
+
+    Args:
+        name (str): The name of the shared memory block.
+        shape: The shape of the voxel values in numpy order.
+        dtype: The numpy data type of the voxel values.
+        spacing: Voxel spacing as (x, y, z).
+        origin: Physical coordinates of the first voxel.
+        direction: The direction cosine matrix as a flat tuple.
+        metadata (dict): Metadata of the image.
+    """
+    def __init__(self, name, shape, dtype, spacing, origin, direction,
+                 metadata):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.spacing = tuple(spacing)
+        self.origin = tuple(origin)
+        self.direction = tuple(direction)
+        self.metadata = metadata
+        self._memory = None
+        self._finalizer = None
+
+    @classmethod
+    def from_image(cls, image):
+        """ Copy an image into a new shared memory block.
+
+        The block stays alive after this process exits until the handle is
+            released by the receiving process.
+
+        Args:
+            image: A SimpleITK.Image with one component per pixel.
+
+        Returns:
+            A SharedVolume.
+        """
+        if image.GetNumberOfComponentsPerPixel() != 1:
+            raise ValueError('Only images with scalar pixels are supported.')
+        voxels = sitk.GetArrayViewFromImage(image)
+        memory = shared_memory.SharedMemory(create=True,
+                                            size=max(1, voxels.nbytes))
+        try:
+            array = np.ndarray(voxels.shape, dtype=voxels.dtype,
+                               buffer=memory.buf)
+            array[...] = voxels
+            del array
+        except BaseException:
+            memory.close()
+            memory.unlink()
+            raise
+        memory.close()
+        metadata = {k: image.GetMetaData(k) for k in image.GetMetaDataKeys()}
+        return cls(memory.name, voxels.shape, voxels.dtype,
+                   image.GetSpacing(), image.GetOrigin(),
+                   image.GetDirection(), metadata)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_memory'] = None
+        state['_finalizer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._acquire()
+
+    def _acquire(self):
+        if self._finalizer is None:
+            self._memory = _acquire(self.name)
+            self._finalizer = weakref.finalize(self, _release, self.name)
+
+    @property
+    def nbytes(self):
+        """ The size of the voxel values in bytes."""
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def array(self):
+        """ Map the voxel values without copying them.
+
+        The returned array is valid as long as the handle is not released.
+
+        Returns:
+            A numpy array in numpy order, i.e. (z, y, x).
+        """
+        if self._memory is None:
+            if self._finalizer is not None:
+                raise ValueError('The shared volume has been released.')
+            self._acquire()
+        return np.ndarray(self.shape, dtype=self.dtype,
+                          buffer=self._memory.buf)
+
+    def to_image(self):
+        """ Create a SimpleITK.Image holding a copy of the voxel values.
+
+        Returns:
+            A SimpleITK.Image.
+        """
+        image = sitk.GetImageFromArray(self.array())
+        image.SetSpacing(self.spacing)
+        image.SetOrigin(self.origin)
+        image.SetDirection(self.direction)
+        for k, value in self.metadata.items():
+            image.SetMetaData(k, value)
+        return image
+
+    def release(self):
+        """ Release the reference of this handle to the shared memory block.
+
+        The block is unlinked when no handle of this process refers to it.
+        """
+        self._acquire()
+        self._memory = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self.array()
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+import unittest
+import SimpleITK as sitk
+import aio
+import bioimage
+from bioimage import BioImage
+from bioimage import register_modality
+from constants import Modality
+from ct import DICOMCTDIR
+
+
+class CountingLoader(object):
+    """ A slow loader counting its calls and concurrent calls."""
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, source):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        return sitk.Image(4, 4, 4, sitk.sitkUInt8)
+
+
+class TestAsyncLoad(unittest.TestCase):
+    def setUp(self):
+        self.loader = CountingLoader()
+        register_modality('TEST_SLOW', self.loader)
+
+    def tearDown(self):
+        bioimage._LOADERS.pop('TEST_SLOW')
+        aio.set_concurrency_limit(4)
+
+    def test_identical_loads_are_shared(self):
+        async def main():
+            images = [BioImage('study1', 'TEST_SLOW') for _ in range(10)]
+            return await asyncio.gather(*[i.aload() for i in images])
+
+        images = asyncio.run(main())
+        self.assertEqual(self.loader.calls, 1)
+        self.assertEqual(len(images), 10)
+        self.assertEqual(images[0].GetSize(), (4, 4, 4))
+        # Each caller gets its own image
+        images[0].SetSpacing((2.0, 2.0, 2.0))
+        self.assertEqual(images[1].GetSpacing(), (1.0, 1.0, 1.0))
+
+    def test_load_after_cancelled_load_is_not_cancelled(self):
+        aio.set_concurrency_limit(1)
+
+        async def main():
+            first = asyncio.ensure_future(
+                BioImage('study1', 'TEST_SLOW').aload())
+            second = asyncio.ensure_future(
+                BioImage('study2', 'TEST_SLOW').aload())
+            await asyncio.sleep(0.01)
+            second.cancel()
+            # The cancelled load is not shared by a new caller, even before
+            # its task finishes
+            await asyncio.sleep(0)
+            third = asyncio.ensure_future(
+                BioImage('study2', 'TEST_SLOW').aload())
+            await first
+            return await third
+
+        self.assertEqual(asyncio.run(main()).GetSize(), (4, 4, 4))
+
+    def test_concurrency_limit(self):
+        aio.set_concurrency_limit(2)
+
+        async def main():
+            images = [BioImage('study{}'.format(i), 'TEST_SLOW')
+                      for i in range(6)]
+            return await asyncio.gather(*[i.aload() for i in images])
+
+        asyncio.run(main())
+        self.assertEqual(self.loader.calls, 6)
+        self.assertLessEqual(self.loader.max_running, 2)
+
+    def test_cancelled_waiting_load_does_not_run(self):
+        aio.set_concurrency_limit(1)
+
+        async def main():
+            first = asyncio.ensure_future(
+                BioImage('study1', 'TEST_SLOW').aload())
+            second = asyncio.ensure_future(
+                BioImage('study2', 'TEST_SLOW').aload())
+            await asyncio.sleep(0.01)
+            second.cancel()
+            await first
+            with self.assertRaises(asyncio.CancelledError):
+                await second
+
+        asyncio.run(main())
+        self.assertEqual(self.loader.calls, 1)
+
+    def test_cancelling_one_caller_keeps_shared_load(self):
+        async def main():
+            first = asyncio.ensure_future(
+                BioImage('study1', 'TEST_SLOW').aload())
+            second = asyncio.ensure_future(
+                BioImage('study1', 'TEST_SLOW').aload())
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second
+
+        image = asyncio.run(main())
+        self.assertEqual(image.GetSize(), (4, 4, 4))
+        self.assertEqual(self.loader.calls, 1)
+
+    def test_cancelled_running_load_keeps_its_slot_and_is_shared(self):
+        aio.set_concurrency_limit(1)
+        self.loader.delay = 0.1
+
+        async def main():
+            first = asyncio.ensure_future(
+                BioImage('study1', 'TEST_SLOW').aload())
+            await asyncio.sleep(0.02)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            # The running load is shared, and holds the only slot
+            return await asyncio.gather(
+                BioImage('study1', 'TEST_SLOW').aload(),
+                BioImage('study2', 'TEST_SLOW').aload())
+
+        images = asyncio.run(main())
+        self.assertEqual(len(images), 2)
+        self.assertEqual(self.loader.calls, 2)
+        self.assertEqual(self.loader.max_running, 1)
+
+    def test_ct_aload(self):
+        ct = DICOMCTDIR('brain1', 'CT1', 'test/data/brain1_image',
+                        'test/data/brain1_label')
+
+        async def main():
+            return await asyncio.gather(ct.aload(), ct.aload())
+
+        (image, mask), _ = asyncio.run(main())
+        self.assertEqual(image.GetSize(), (256, 256, 25))
+        self.assertEqual(mask.GetSize(), (256, 256, 25))
+
+    def test_errors_are_raised(self):
+        async def main():
+            return await BioImage('test/data/missing',
+                                  Modality.DICOM_CT_DIR).aload()
+
+        with self.assertRaises(ValueError):
+            asyncio.run(main())
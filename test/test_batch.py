@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from batch import load_catalog
+from batch import map_catalog
+from batch import prefetch
+from batch import probe_catalog
+from batch import stream_catalog
+from constants import Modality
+from utils import read_catalog
+
+
+def _crash_on_second_row(index, record):
+    if index == 1:
+        os._exit(1)
+    return record[0]
+
+
+def _failed_row(index, record, error):
+    return (record[0], type(error).__name__)
+
+
+class TestLoadCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = read_catalog('test/data/catalog.csv', sep=',')
+        self.brain1_size = (256, 256, 25)
+
+    def test_load_catalog_preserves_order(self):
+        for executor in ['thread', 'process']:
+            results = list(load_catalog(self.catalog, Modality.DICOM_CT_DIR,
+                                        num_workers=2, executor=executor))
+            self.assertEqual([r.index for r in results], [0, 1])
+            self.assertEqual([r.sample_id for r in results],
+                             ['brain1', 'brain2'])
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertIsInstance(result.image, sitk.Image)
+                self.assertIsInstance(result.mask, sitk.Image)
+                self.assertEqual(result.image.GetSize(), self.brain1_size)
+
+    def test_load_catalog_reports_failures(self):
+        catalog = [['brain1', 'CT1', 'test/data/missing_image', ''],
+                   ['brain2', 'CT1', 'test/data/brain1_image.nrrd', '']]
+        results = list(load_catalog(catalog, Modality.SIMPLE_IMAGE,
+                                    num_workers=2, ordered=False,
+                                    max_in_flight=1))
+        self.assertEqual(sorted(r.index for r in results), [0, 1])
+        results = {r.sample_id: r for r in results}
+        self.assertIsNotNone(results['brain1'].error)
+        self.assertIsNone(results['brain1'].image)
+        self.assertIsNone(results['brain2'].error)
+        self.assertIsNone(results['brain2'].mask)
+        self.assertEqual(results['brain2'].image.GetSize(), self.brain1_size)
+
+    def test_load_catalog_detects_modality_of_each_row(self):
+        catalog = [['brain1', 'CT1', 'test/data/brain1_image',
+                    'test/data/brain1_label'],
+                   ['brain1', 'CT2', 'test/data/brain1_image.nrrd',
+                    'test/data/brain1_label.nii']]
+        results = list(load_catalog(catalog, Modality.AUTO, num_workers=2))
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(result.image.GetSize(), self.brain1_size)
+            self.assertEqual(result.mask.GetSize(), self.brain1_size)
+
+    def test_map_catalog_survives_crashed_process(self):
+        catalog = [['a'], ['b'], ['c'], ['d']]
+        results = list(map_catalog(catalog, _crash_on_second_row,
+                                   num_workers=1, executor='process',
+                                   max_in_flight=1,
+                                   failed_result=_failed_row))
+        self.assertEqual(results,
+                         ['a', ('b', 'BrokenProcessPool'), 'c', 'd'])
+
+    def test_load_catalog_rejects_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            next(load_catalog(self.catalog, Modality.DICOM_CT_DIR,
+                              executor='fiber'))
+
+
+class TestStreamCatalog(unittest.TestCase):
+    def test_stream_catalog_yields_numpy_arrays(self):
+        def transform(image, mask):
+            return sitk.Cast(image, sitk.sitkFloat32), mask
+
+        for prefetch_size in [0, 1]:
+            samples = list(stream_catalog('test/data/catalog.csv',
+                                          Modality.DICOM_CT_DIR,
+                                          transform=transform,
+                                          prefetch_size=prefetch_size))
+            self.assertEqual([s.sample_id for s in samples],
+                             ['brain1', 'brain2'])
+            for sample in samples:
+                self.assertIsInstance(sample.image, np.ndarray)
+                self.assertEqual(sample.image.dtype, np.float32)
+                self.assertEqual(sample.image.shape, (25, 256, 256))
+                self.assertEqual(sample.mask.shape, (25, 256, 256))
+
+    def test_prefetch_raises_errors_in_order(self):
+        def produce():
+            yield 1
+            yield 2
+            raise ValueError('Failed to produce')
+
+        items = prefetch(produce(), size=1)
+        self.assertEqual(next(items), 1)
+        self.assertEqual(next(items), 2)
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_prefetch_stops_producer_when_closed(self):
+        produced = []
+
+        def produce():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        items = prefetch(produce(), size=2)
+        self.assertEqual(next(items), 0)
+        # Closing joins the producer, so nothing is produced afterwards
+        items.close()
+        num_produced = len(produced)
+        self.assertLessEqual(num_produced, 3)
+        time.sleep(0.3)
+        self.assertEqual(len(produced), num_produced)
+
+    def test_prefetch_raises_base_exceptions(self):
+        def produce():
+            yield 1
+            raise SystemExit(1)
+
+        items = prefetch(produce(), size=1)
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(SystemExit):
+            next(items)
+
+    def test_prefetch_bounds_items_produced_ahead(self):
+        produced = []
+
+        def produce():
+            for i in range(10):
+                produced.append(i)
+                yield i
+
+        items = prefetch(produce(), size=2)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.3)
+        # The consumer holds item 0 and items 1 and 2 are produced ahead
+        self.assertEqual(produced, [0, 1, 2])
+        items.close()
+
+
+class TestProbeCatalog(unittest.TestCase):
+    def test_probe_catalog_reads_headers(self):
+        catalog = read_catalog('test/data/catalog.csv', sep=',')
+        results = probe_catalog(catalog, Modality.DICOM_CT_DIR)
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(result.image.GetSize(), (256, 256, 25))
+            self.assertAlmostEqual(result.image.GetSpacing()[2], 6.5)
+            self.assertEqual(result.image.pixel_type, '16-bit signed integer')
+            self.assertEqual(len(result.mask.file_names), 25)
+
+    def test_probe_catalog_raises_on_mismatch(self):
+        catalog = [['brain1', 'CT1', 'test/data/brain1_image.nrrd',
+                    'test/data/brain1_label.nrrd'],
+                   ['dummy', 'CT1', 'test/data/brain1_image.nrrd',
+                    'test/data/dummy_image.nrrd']]
+        with self.assertRaises(ValueError):
+            probe_catalog(catalog, Modality.SIMPLE_IMAGE)
+        results = probe_catalog(catalog, Modality.SIMPLE_IMAGE,
+                                raise_on_error=False)
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, ValueError)
+
+    def test_probe_catalog_checks_series(self):
+        catalog = read_catalog('test/data/catalog.csv', sep=',')
+        series_id = sitk.ImageSeriesReader.GetGDCMSeriesIDs(catalog[0][2])[0]
+        results = probe_catalog(catalog, Modality.DICOM_CT_DIR,
+                                raise_on_error=False,
+                                expected_series={('brain1', 'CT1'): '1.2.3'})
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertEqual(results[0].image.series_id, series_id)
+        self.assertIsNone(results[1].error)
+        study_dir = tempfile.mkdtemp()
+        try:
+            for name in ['brain1_image', 'dummy_image']:
+                src_dir = os.path.join('test/data', name)
+                for file_name in os.listdir(src_dir):
+                    shutil.copy(os.path.join(src_dir, file_name),
+                                os.path.join(study_dir,
+                                             name + '_' + file_name))
+            with self.assertRaises(ValueError):
+                probe_catalog([['brain1', 'CT1', study_dir]],
+                              Modality.DICOM_CT_DIR)
+        finally:
+            shutil.rmtree(study_dir)
@@ -0,0 +1,70 @@
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from bioimage import BioImage
+from constants import Modality
+from run_benchmarks import _get_result
+from run_benchmarks import compare
+from run_benchmarks import generate_data
+from run_benchmarks import run_benchmarks
+
+
+def put_large_result(results, exitcode):
+    if exitcode == 0:
+        results.put(('large', {'values': list(range(1 << 20))}))
+    sys.exit(exitcode)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_generated_volumes_are_consistent(self):
+        paths = generate_data(self.data_dir, size=16, slices=4,
+                              catalog_rows=3)
+        dicom = BioImage(paths['dicom_dir'], Modality.DICOM_CT_DIR).load()
+        nrrd = BioImage(paths['nrrd'], Modality.SIMPLE_IMAGE).load()
+        self.assertEqual(dicom.GetSize(), (16, 16, 4))
+        self.assertTrue(np.allclose(dicom.GetSpacing(), nrrd.GetSpacing()))
+        self.assertTrue(np.array_equal(sitk.GetArrayViewFromImage(dicom),
+                                       sitk.GetArrayViewFromImage(nrrd)))
+
+    def test_compare_reports_regressions(self):
+        baseline = {'a': {'seconds_median': 1.0},
+                    'b': {'seconds_median': 1.0}}
+        current = {'a': {'seconds_median': 1.05},
+                   'b': {'seconds_median': 1.5},
+                   'c': {'seconds_median': 9.0}}
+        self.assertEqual(compare(current, baseline, 0.1), {'b': 1.5})
+
+    def test_large_results_and_failures_are_collected(self):
+        context = multiprocessing.get_context('spawn')
+        for exitcode in [0, 3]:
+            results = context.Queue()
+            process = context.Process(target=put_large_result,
+                                      args=(results, exitcode))
+            process.start()
+            if exitcode == 0:
+                result = _get_result(process, results, 'large', timeout=60)
+                self.assertEqual(len(result['values']), 1 << 20)
+            else:
+                with self.assertRaises(RuntimeError):
+                    _get_result(process, results, 'failed', timeout=60)
+            process.join(60)
+
+    def test_throughput_uses_processed_bytes(self):
+        config = {'size': 16, 'slices': 4, 'catalog_rows': 3, 'repeat': 1}
+        measurements = run_benchmarks(['get_array_copy', 'partition'],
+                                      config, self.data_dir, timeout=60)
+        result = measurements['get_array_copy']
+        num_bytes = 16 * 16 * 4 * 2
+        self.assertAlmostEqual(result['mb_per_second'],
+                               num_bytes / 2 ** 20 / result['seconds_median'])
+        self.assertNotIn('mb_per_second', measurements['partition'])
@@ -1,10 +1,18 @@
+import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 import matplotlib.pyplot as plt
 import SimpleITK as sitk
 import numpy as np
 
+import bioimage
 from bioimage import BioImage
+from bioimage import detect_modality
+from bioimage import register_modality
 from constants import Modality
+from formats import write_numpy
 from utils import visualize_slice
 
 
@@ -91,3 +99,82 @@ class TestBioImage(unittest.TestCase):
                         brain1_label_array[idx],
                         ax, location, width, cmap='gray')
         plt.show()
+
+    def test_probe_matches_loaded_geometry(self):
+        for address, modality in [('test/data/brain1_image',
+                                   Modality.DICOM_CT_DIR),
+                                  ('test/data/brain1_image.nrrd',
+                                   Modality.SIMPLE_IMAGE)]:
+            bioimage = BioImage(address, modality=modality)
+            header = bioimage.probe()
+            sitk_image = bioimage.load()
+            self.assertEqual(header.GetSize(), sitk_image.GetSize())
+            self.assertTrue(np.allclose(header.GetSpacing(),
+                                        sitk_image.GetSpacing()))
+            self.assertTrue(np.allclose(header.GetOrigin(),
+                                        sitk_image.GetOrigin()))
+            self.assertEqual(header.pixel_type,
+                             sitk_image.GetPixelIDTypeAsString())
+
+    def test_probe_dicom_dir_scans_series_once(self):
+        get_series_ids = sitk.ImageSeriesReader.GetGDCMSeriesIDs
+        dir_path = tempfile.mkdtemp()
+        try:
+            with mock.patch.object(sitk.ImageSeriesReader,
+                                   'GetGDCMSeriesIDs',
+                                   side_effect=get_series_ids) as scan:
+                header = BioImage.probe_dicom_dir('test/data/brain1_image')
+                self.assertEqual(header.num_series, 1)
+                self.assertEqual(scan.call_count, 1)
+                with self.assertRaises(ValueError):
+                    BioImage.probe_dicom_dir(dir_path)
+                self.assertEqual(scan.call_count, 2)
+        finally:
+            shutil.rmtree(dir_path)
+
+
+class TestModalityRegistry(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_detect_modality(self):
+        expected = {
+            'test/data/brain1_image': Modality.DICOM_CT_DIR,
+            'test/data/brain1_image_slice11.dcm': Modality.DICOM_CT_SLICE,
+            'test/data/brain1_image.nii': Modality.SIMPLE_IMAGE,
+            'test/data/brain1_image.nrrd': Modality.SIMPLE_IMAGE,
+            'image.nii.gz': Modality.NIFTI_GZ,
+            'image.npz': Modality.NUMPY,
+            'image.unknown': None,
+        }
+        for source, modality in expected.items():
+            self.assertEqual(detect_modality(source), modality)
+
+    def test_auto_modality(self):
+        file_path = os.path.join(self.dir_path, 'image.npz')
+        write_numpy(sitk.ReadImage('test/data/brain1_image.nrrd'), file_path)
+        for source in ['test/data/brain1_image', 'test/data/brain1_image.nii',
+                       file_path]:
+            bio_image = BioImage(source, modality=Modality.AUTO)
+            self.assertNotEqual(bio_image.modality, Modality.AUTO)
+            self.assertEqual(bio_image.load().GetSize(), (256, 256, 25))
+            self.assertEqual(bio_image.probe().GetSize(), (256, 256, 25))
+        with self.assertRaises(ValueError):
+            BioImage('image.unknown', modality=Modality.AUTO).load()
+
+    def test_register_modality(self):
+        def load(source):
+            return sitk.Image(2, 3, 4, sitk.sitkUInt8)
+        register_modality('TEST', load,
+                          detect=lambda source: source.endswith('.test'))
+        try:
+            self.assertEqual(detect_modality('image.test'), 'TEST')
+            image = BioImage('image.test', modality=Modality.AUTO).load()
+            self.assertEqual(image.GetSize(), (2, 3, 4))
+            with self.assertRaises(ValueError):
+                BioImage('image.test', modality='TEST').probe()
+        finally:
+            bioimage._LOADERS.pop('TEST')
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from bioimage import BioImage
+from cache import VolumeDiskCache
+from cache import VolumeMemoryCache
+from cache import get_disk_cache
+from cache import get_memory_cache
+from cache import set_disk_cache
+from cache import set_memory_cache
+from constants import Modality
+
+
+class TestVolumeDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.image = sitk.ReadImage('test/data/dummy_image.nrrd')
+
+    def tearDown(self):
+        set_disk_cache(None)
+        shutil.rmtree(self.cache_dir)
+
+    def test_put_and_get_preserve_image(self):
+        cache = VolumeDiskCache(self.cache_dir)
+        key = cache.make_key('dummy', Modality.SIMPLE_IMAGE)
+        self.assertIsNone(cache.get(key))
+        self.image.SetMetaData('bioimg|test', 'value')
+        cache.put(key, self.image)
+        cached = cache.get(key)
+        self.assertTrue(np.array_equal(sitk.GetArrayViewFromImage(cached),
+                                       sitk.GetArrayViewFromImage(self.image)))
+        self.assertEqual(cached.GetSpacing(), self.image.GetSpacing())
+        self.assertEqual(cached.GetOrigin(), self.image.GetOrigin())
+        self.assertEqual(cached.GetDirection(), self.image.GetDirection())
+        self.assertEqual(cached.GetMetaData('bioimg|test'), 'value')
+        array, _ = cache.get_array(key)
+        self.assertIsInstance(array, np.memmap)
+        cache.invalidate(key)
+        self.assertIsNone(cache.get(key))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = VolumeDiskCache(self.cache_dir)
+        keys = [cache.make_key(i) for i in range(3)]
+        cache.put(keys[0], self.image)
+        entry_size = cache.size()
+        cache.max_bytes = 2 * entry_size
+        cache.put(keys[1], self.image)
+        # Make the first entry the most recently used one
+        os.utime(os.path.join(self.cache_dir, keys[1] + '.json'), ns=(0, 0))
+        cache.get(keys[0])
+        cache.put(keys[2], self.image)
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+        self.assertEqual(cache.size(), 2 * entry_size)
+
+    def test_bioimage_load_uses_disk_cache(self):
+        address = 'test/data/dummy_image'
+        set_disk_cache(VolumeDiskCache(self.cache_dir))
+        bioimage = BioImage(address, modality=Modality.DICOM_CT_DIR)
+        image = bioimage.load()
+        self.assertGreater(get_disk_cache().size(), 0)
+        cached = bioimage.load()
+        self.assertTrue(np.array_equal(sitk.GetArrayViewFromImage(cached),
+                                       sitk.GetArrayViewFromImage(image)))
+        self.assertEqual(cached.GetSpacing(), image.GetSpacing())
+        get_disk_cache().invalidate_source(address)
+        self.assertEqual(get_disk_cache().size(), 0)
+
+
+class TestVolumeMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.image = sitk.ReadImage('test/data/dummy_image.nrrd')
+        self.nbytes = VolumeMemoryCache.image_nbytes(self.image)
+
+    def tearDown(self):
+        set_memory_cache(None)
+
+    def test_eviction_is_driven_by_voxel_bytes(self):
+        self.assertEqual(self.nbytes,
+                         sitk.GetArrayViewFromImage(self.image).nbytes)
+        cache = VolumeMemoryCache(max_bytes=2 * self.nbytes)
+        cache.put('a', self.image)
+        cache.put('b', self.image)
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', self.image)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['nbytes'], 2 * self.nbytes)
+        # Images larger than the cache are not cached
+        small_cache = VolumeMemoryCache(max_bytes=self.nbytes - 1)
+        small_cache.put('a', self.image)
+        self.assertIsNone(small_cache.get('a'))
+
+    def test_returned_images_do_not_alias_cached_images(self):
+        cache = VolumeMemoryCache(max_bytes=self.nbytes)
+        cache.put('a', self.image)
+        image = cache.get('a')
+        image[0, 0, 0] = 1000
+        self.assertNotEqual(cache.get('a')[0, 0, 0], 1000)
+
+    def test_bioimage_load_uses_memory_cache(self):
+        set_memory_cache(VolumeMemoryCache(max_bytes=10 * self.nbytes))
+        bioimage = BioImage('test/data/dummy_image.nrrd',
+                            modality=Modality.SIMPLE_IMAGE)
+        first = bioimage.load()
+        second = bioimage.load()
+        self.assertTrue(np.array_equal(sitk.GetArrayViewFromImage(first),
+                                       sitk.GetArrayViewFromImage(second)))
+        stats = get_memory_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
@@ -0,0 +1,61 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from catalog import CompiledCatalog
+from catalog import compile_catalog
+from utils import read_catalog
+
+
+class TestCompiledCatalog(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.catalog_file_path = os.path.join(self.output_dir, 'catalog.csv')
+        with open(self.catalog_file_path, 'w') as fout:
+            fout.write('# sample_id,image_id,image_src,mask_src\n')
+            for i in range(100):
+                fout.write('sample{},CT{},image{}.nrrd,mask{}.nrrd\n'.format(
+                    i // 2, i % 2, i, i))
+            fout.write('sample_unmasked,CT0,image.nrrd\n')
+        self.compiled_path = os.path.join(self.output_dir, 'catalog.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_compiled_catalog_matches_read_catalog(self):
+        for catalog_file_path in [self.catalog_file_path,
+                                  'test/data/catalog_unmasked.csv']:
+            compile_catalog(catalog_file_path, self.compiled_path)
+            expected = read_catalog(catalog_file_path)
+            with CompiledCatalog(self.compiled_path) as catalog:
+                self.assertEqual(len(catalog), len(expected))
+                for row, expected_row in zip(catalog, expected):
+                    expected_row += [''] * (4 - len(expected_row))
+                    self.assertListEqual(row, expected_row)
+                self.assertEqual(catalog[-1], catalog[len(catalog) - 1])
+                rows = list(catalog)
+                self.assertEqual(catalog[1:5:2], rows[1:5:2])
+                self.assertEqual(catalog[::-1], rows[::-1])
+                with self.assertRaises(TypeError):
+                    catalog['sample1']
+
+    def test_compile_catalog_rejects_wide_rows(self):
+        with open(self.catalog_file_path, 'a') as fout:
+            fout.write('a,b,img,msk,extra\n')
+        with self.assertRaises(ValueError):
+            compile_catalog(self.catalog_file_path, self.compiled_path)
+
+    def test_lookup_by_identifier(self):
+        compile_catalog(self.catalog_file_path, self.compiled_path)
+        catalog = CompiledCatalog(self.compiled_path)
+        self.assertEqual(catalog.lookup('sample_id', 'sample7'), [14, 15])
+        self.assertEqual(catalog.lookup('image_id', 'CT1'),
+                         list(range(1, 100, 2)))
+        self.assertEqual(catalog.lookup('sample_id', 'missing'), [])
+        with self.assertRaises(ValueError):
+            catalog.lookup('image_src', 'image1.nrrd')
+        unpickled = pickle.loads(pickle.dumps(catalog))
+        self.assertEqual(unpickled[14], catalog[14])
+        catalog.close()
+        unpickled.close()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from bioimage import BioImage
+from bioimage import detect_modality
+from chunked import ChunkedVolume
+from chunked import write_chunked_volume
+from constants import Modality
+
+
+class TestChunkedVolume(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.dir_path, 'brain1.biv')
+        self.image = BioImage('test/data/brain1_image',
+                              Modality.DICOM_CT_DIR).load()
+        write_chunked_volume(self.image, self.file_path, chunk_slices=4)
+        self.voxels = sitk.GetArrayViewFromImage(self.image)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_read_image_preserves_content(self):
+        image = ChunkedVolume(self.file_path).read_image()
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                      self.voxels)
+        self.assertEqual(image.GetSpacing(), self.image.GetSpacing())
+        self.assertEqual(image.GetOrigin(), self.image.GetOrigin())
+        self.assertEqual(image.GetDirection(), self.image.GetDirection())
+        self.assertEqual(image.GetMetaData('0020|000e'),
+                         self.image.GetMetaData('0020|000e'))
+
+    def test_chunks_and_slices(self):
+        volume = ChunkedVolume(self.file_path, max_cached_chunks=2)
+        self.assertEqual(volume.shape, (25, 256, 256))
+        self.assertEqual(volume.num_chunks, 7)
+        np.testing.assert_array_equal(volume.read_chunk(6), self.voxels[24:])
+        np.testing.assert_array_equal(volume[11], self.voxels[11])
+        np.testing.assert_array_equal(volume[-1], self.voxels[-1])
+        np.testing.assert_array_equal(volume[3:9, 10:20],
+                                      self.voxels[3:9, 10:20])
+        self.assertLessEqual(len(volume._chunks), 2)
+        with self.assertRaises(IndexError):
+            volume.read_chunk(7)
+
+    def test_bioimage_modality(self):
+        self.assertEqual(detect_modality(self.file_path),
+                         Modality.CHUNKED_VOLUME)
+        bio_image = BioImage(self.file_path, Modality.CHUNKED_VOLUME)
+        header = bio_image.probe()
+        self.assertEqual(header.GetSize(), self.image.GetSize())
+        self.assertEqual(header.pixel_type,
+                         self.image.GetPixelIDTypeAsString())
+        image = bio_image.load()
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                      self.voxels)
+        lazy = bio_image.load_lazy(max_cached_slices=8)
+        np.testing.assert_array_equal(lazy[20], self.voxels[20])
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            ChunkedVolume('test/data/brain1_image.nrrd')
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from batch import load_catalog
+from constants import Modality
+from run_conversion import convert_catalog
+from run_conversion import main
+from utils import read_catalog
+
+
+class TestConversion(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.catalog = read_catalog('test/data/catalog.csv', sep=',')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_convert_catalog_is_resumable(self):
+        results = convert_catalog(self.catalog, Modality.DICOM_CT_DIR,
+                                  self.dir_path, num_workers=2)
+        self.assertEqual([r.error for r in results], [None, None])
+        self.assertEqual([r.converted for r in results], [2, 2])
+        results = convert_catalog(self.catalog, Modality.DICOM_CT_DIR,
+                                  self.dir_path, num_workers=2,
+                                  executor='thread')
+        self.assertEqual([r.converted for r in results], [0, 0])
+        converted = list(load_catalog([r.record for r in results],
+                                      Modality.AUTO))
+        original = list(load_catalog(self.catalog, Modality.DICOM_CT_DIR))
+        for result, expected in zip(converted, original):
+            self.assertIsNone(result.error)
+            for image, expected_image in [(result.image, expected.image),
+                                          (result.mask, expected.mask)]:
+                np.testing.assert_array_equal(
+                    sitk.GetArrayViewFromImage(image),
+                    sitk.GetArrayViewFromImage(expected_image))
+
+    def test_convert_catalog_reports_colliding_names(self):
+        catalog = [['a_b', 'c', 'test/data/brain1_image', ''],
+                   ['a', 'b_c', 'test/data/brain2_image', ''],
+                   ['../brain1', 'CT1', 'test/data/brain1_image', ''],
+                   ['brain1', '..', 'test/data/brain1_image', ''],
+                   ['brain1', 'CT1', 'test/data/brain1_image', '']]
+        results = convert_catalog(catalog, Modality.DICOM_CT_DIR,
+                                  self.dir_path, executor='thread')
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3, 4])
+        for result in results[:4]:
+            self.assertIsInstance(result.error, ValueError)
+            self.assertEqual(result.converted, 0)
+        self.assertIsNone(results[4].error)
+        self.assertEqual(os.listdir(self.dir_path),
+                         ['brain1_CT1_image.biv'])
+
+    def test_main_writes_catalog_with_given_separator(self):
+        catalog_path = os.path.join(self.dir_path, 'catalog.csv')
+        with open(catalog_path, 'w') as fout:
+            fout.write('brain1;CT1;test/data/brain1_image;\n')
+        output_dir = os.path.join(self.dir_path, 'a,b')
+        self.assertEqual(main([catalog_path, output_dir, '--sep', ';',
+                               '--num-workers', '1']), 0)
+        rows = read_catalog(os.path.join(output_dir, 'catalog.csv'),
+                            sep=';')
+        self.assertEqual(rows[0][:3], [
+            'brain1', 'CT1', os.path.join(output_dir, 'brain1_CT1_image.biv')])
+
+    def test_main_reports_failures(self):
+        catalog_path = os.path.join(self.dir_path, 'catalog.csv')
+        with open(catalog_path, 'w') as fout:
+            fout.write('brain1,CT1,test/data/brain1_image,\n')
+            fout.write('brain2,CT1,test/data/missing,\n')
+        output_dir = os.path.join(self.dir_path, 'converted')
+        self.assertEqual(main([catalog_path, output_dir, '--num-workers',
+                               '1']), 1)
+        rows = read_catalog(os.path.join(output_dir, 'catalog.csv'))
+        self.assertEqual([row[0] for row in rows], ['brain1'])
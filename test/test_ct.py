@@ -35,6 +35,21 @@ class TestNRRDCT(unittest.TestCase):
         self.assertEqual(self.brain1_masked_ct.sample_id, 'brain1')
         self.assertEqual(self.brain1_masked_ct.image_id, 'CT1')
 
+    def test_get_array_copies_only_on_request(self):
+        brain1_image, _ = self.brain1_unmasked_ct.load()
+        view = SimpleImage.get_array(brain1_image)
+        self.assertFalse(view.flags.writeable)
+        copy = SimpleImage.get_array(brain1_image, copy=True)
+        self.assertTrue(copy.flags.writeable)
+        copy[0, 0, 0] = copy[0, 0, 0] + 1
+        self.assertNotEqual(view[0, 0, 0], copy[0, 0, 0])
+
+    def test_load_raises_on_geometry_mismatch(self):
+        ct = SimpleImage('brain1', 'CT1', self.brain1_image_path,
+                         mask_path='test/data/dummy_image.nrrd')
+        with self.assertRaises(ValueError):
+            ct.load()
+
     @unittest.skip('Requires visual validation.')
     def test_load_preserves_content(self):
         brain1_image, brain1_label = self.brain1_masked_ct.load()
@@ -0,0 +1,88 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from constants import Modality
+from features import FeatureResult
+from features import _read_completed
+from features import _write_results
+from features import extract_features
+from utils import read_catalog
+
+try:
+    import radiomics  # noqa: F401
+    HAS_RADIOMICS = True
+except ImportError:
+    HAS_RADIOMICS = False
+
+
+class TestExtractFeatures(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.dir_path, 'features.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_read_completed_truncates_partial_row(self):
+        with open(self.output_path, 'w') as fout:
+            fout.write('sample_id,image_id,feature\n')
+            fout.write('brain1,CT1,1.0\n')
+            fout.write('brain2,CT1,2')
+        fieldnames, completed = _read_completed(self.output_path)
+        self.assertEqual(fieldnames, ['sample_id', 'image_id', 'feature'])
+        self.assertEqual(completed, {('brain1', 'CT1')})
+        with open(self.output_path) as fin:
+            self.assertEqual(fin.read(),
+                             'sample_id,image_id,feature\nbrain1,CT1,1.0\n')
+
+    def test_read_completed_truncates_partial_header(self):
+        with open(self.output_path, 'w') as fout:
+            fout.write('sample_id,image_id,feat')
+        self.assertEqual(_read_completed(self.output_path), (None, set()))
+        self.assertEqual(os.path.getsize(self.output_path), 0)
+
+    def test_rows_with_unexpected_features_fail(self):
+        results = [FeatureResult(0, 'brain1', 'CT1', {'a': 1.0}, None),
+                   FeatureResult(1, 'brain2', 'CT1', {'a': 2.0, 'b': 3.0},
+                                 None),
+                   FeatureResult(2, 'brain3', 'CT1', {}, None)]
+        summary = {'extracted': 0, 'failed': []}
+        with open(self.output_path, 'w', newline='') as fout:
+            _write_results(results, fout, None, summary, checkpoint_every=1)
+        self.assertEqual(summary['extracted'], 2)
+        self.assertEqual([r.index for r in summary['failed']], [1])
+        self.assertIsInstance(summary['failed'][0].error, ValueError)
+        with open(self.output_path) as fin:
+            self.assertEqual(fin.read().splitlines(),
+                             ['sample_id,image_id,a', 'brain1,CT1,1.0',
+                              'brain3,CT1,'])
+
+    def test_read_completed_of_missing_file(self):
+        self.assertEqual(_read_completed(self.output_path), (None, set()))
+
+    def test_duplicate_ids_are_rejected(self):
+        catalog = read_catalog('test/data/catalog.csv', sep=',')
+        with self.assertRaises(ValueError):
+            extract_features(catalog + catalog[:1], Modality.DICOM_CT_DIR,
+                             'test/data/params.yaml', self.output_path)
+        self.assertFalse(os.path.exists(self.output_path))
+
+    @unittest.skipUnless(HAS_RADIOMICS, 'PyRadiomics is not installed')
+    def test_extract_features_resumes(self):
+        catalog = read_catalog('test/data/catalog.csv', sep=',')
+        summary = extract_features(catalog[:1], Modality.DICOM_CT_DIR,
+                                   'test/data/params.yaml', self.output_path,
+                                   num_workers=2, executor='process')
+        self.assertEqual(summary['extracted'], 1)
+        self.assertEqual(summary['failed'], [])
+        summary = extract_features(catalog, Modality.DICOM_CT_DIR,
+                                   'test/data/params.yaml', self.output_path,
+                                   num_workers=2, executor='thread')
+        self.assertEqual(summary['extracted'], 1)
+        self.assertEqual(summary['skipped'], 1)
+        with open(self.output_path, newline='') as fin:
+            rows = list(csv.DictReader(fin))
+        self.assertEqual(sorted(row['sample_id'] for row in rows),
+                         ['brain1', 'brain2'])
@@ -0,0 +1,116 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import SimpleITK as sitk
+from formats import _read_nifti_stream
+from formats import read_nifti_gz
+from formats import read_numpy
+from formats import write_numpy
+
+
+class TestReadNiftiGz(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def compress(self, file_path):
+        output_path = os.path.join(self.dir_path,
+                                   os.path.basename(file_path) + '.gz')
+        with open(file_path, 'rb') as fin, \
+                gzip.open(output_path, 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+        return output_path
+
+    def assert_images_equal(self, image, expected):
+        self.assertEqual(image.GetPixelID(), expected.GetPixelID())
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                      sitk.GetArrayViewFromImage(expected))
+        np.testing.assert_allclose(image.GetSpacing(), expected.GetSpacing())
+        np.testing.assert_allclose(image.GetOrigin(), expected.GetOrigin(),
+                                   atol=1e-4)
+        np.testing.assert_allclose(image.GetDirection(),
+                                   expected.GetDirection(), atol=1e-6)
+
+    def test_stream_matches_simpleitk(self):
+        for name in ['brain1_image', 'brain1_label', 'dummy_image']:
+            file_path = self.compress('test/data/{}.nii'.format(name))
+            expected = sitk.ReadImage(file_path)
+            self.assert_images_equal(_read_nifti_stream(file_path, gzip.open),
+                                     expected)
+            self.assert_images_equal(read_nifti_gz(file_path), expected)
+
+    def test_stream_matches_simpleitk_for_rotated_images(self):
+        image = sitk.ReadImage('test/data/dummy_image.nrrd')
+        image.SetDirection((0, 1, 0, -1, 0, 0, 0, 0, 1))
+        image.SetOrigin((3.0, -4.0, 5.0))
+        image.SetSpacing((0.5, 0.7, 2.0))
+        file_path = os.path.join(self.dir_path, 'rotated.nii.gz')
+        sitk.WriteImage(image, file_path)
+        self.assert_images_equal(_read_nifti_stream(file_path, gzip.open),
+                                 sitk.ReadImage(file_path))
+
+    def test_metadata_does_not_depend_on_isal(self):
+        file_path = self.compress('test/data/brain1_image.nii')
+        metadata = []
+        # gzip.open stands in for igzip.open, which has the same signature
+        for igzip in [gzip, None]:
+            with mock.patch('formats.igzip', igzip):
+                image = read_nifti_gz(file_path)
+            metadata.append({k: image.GetMetaData(k)
+                             for k in image.GetMetaDataKeys()})
+        self.assertEqual(metadata[0], metadata[1])
+        self.assertEqual(metadata[0]['dim[3]'], '25')
+
+    def test_unsupported_headers_fall_back_to_simpleitk(self):
+        with open('test/data/dummy_image.nii', 'rb') as fin:
+            data = bytearray(fin.read())
+        # Spatial units in meters
+        data[123] = 1
+        file_path = os.path.join(self.dir_path, 'meters.nii.gz')
+        with gzip.open(file_path, 'wb') as fout:
+            fout.write(data)
+        self.assertIsNone(_read_nifti_stream(file_path, gzip.open))
+        self.assert_images_equal(read_nifti_gz(file_path),
+                                 sitk.ReadImage(file_path))
+        # A header of a .hdr/.img pair, with no voxel values in the stream
+        data[123] = 2
+        data[108:112] = np.array(0, dtype='<f4').tobytes()
+        data[344:348] = b'ni1\x00'
+        file_path = os.path.join(self.dir_path, 'pair.nii.gz')
+        with gzip.open(file_path, 'wb') as fout:
+            fout.write(data[:348])
+        self.assertIsNone(_read_nifti_stream(file_path, gzip.open))
+
+
+class TestNumpy(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.image = sitk.ReadImage('test/data/brain1_image.nrrd')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_npz_preserves_geometry(self):
+        file_path = os.path.join(self.dir_path, 'image.npz')
+        write_numpy(self.image, file_path)
+        image = read_numpy(file_path)
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                      sitk.GetArrayViewFromImage(self.image))
+        self.assertEqual(image.GetSpacing(), self.image.GetSpacing())
+        self.assertEqual(image.GetOrigin(), self.image.GetOrigin())
+        self.assertEqual(image.GetDirection(), self.image.GetDirection())
+
+    def test_npy(self):
+        file_path = os.path.join(self.dir_path, 'image.npy')
+        voxels = sitk.GetArrayFromImage(self.image)
+        np.save(file_path, voxels)
+        image = read_numpy(file_path)
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                      voxels)
+        self.assertEqual(image.GetSpacing(), (1.0, 1.0, 1.0))
@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from incremental import FORCED
+from incremental import IMAGE_CHANGED
+from incremental import MASK_CHANGED
+from incremental import NEW
+from incremental import OUTPUTS_MISSING
+from incremental import PARAMS_CHANGED
+from incremental import SOURCE_MISSING
+from incremental import UNCHANGED
+from incremental import Manifest
+from incremental import process_catalog
+from incremental import row_key
+
+
+def copy_row(index, record):
+    """ Write the concatenated sources of a row to an output file."""
+    if record[0] == 'broken':
+        raise ValueError('Broken row.')
+    output_path = os.path.join(os.path.dirname(record[2]),
+                               '{}_{}.out'.format(record[0], record[1]))
+    with open(output_path, 'w') as fout:
+        for src in record[2:]:
+            with open(src) as fin:
+                fout.write(fin.read())
+    return {'output': output_path}
+
+
+def record_index(index, record):
+    """ Write the index received for a row to an output file."""
+    output_path = os.path.join(os.path.dirname(record[2]),
+                               '{}_{}.index'.format(record[0], record[1]))
+    with open(output_path, 'w') as fout:
+        fout.write(str(index))
+    return {'output': output_path, 'index': index}
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.dir_path, 'manifest.json')
+        self.catalog = []
+        for sample_id in ['brain1', 'brain2']:
+            record = [sample_id, 'CT1']
+            for name in ['image', 'mask']:
+                path = os.path.join(self.dir_path,
+                                    '{}_{}.txt'.format(sample_id, name))
+                self.write(path, name)
+                record.append(path)
+            self.catalog.append(record)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def write(self, path, content):
+        with open(path, 'w') as fout:
+            fout.write(content)
+
+    def run_catalog(self, catalog=None, params=None, **kwargs):
+        return process_catalog(catalog or self.catalog, copy_row,
+                               self.manifest_path, params=params,
+                               num_workers=2, **kwargs)
+
+    def test_unchanged_rows_are_skipped(self):
+        report = self.run_catalog()
+        self.assertEqual(sorted(report.processed), [(0, NEW), (1, NEW)])
+        report = self.run_catalog()
+        self.assertEqual(report.processed, [])
+        self.assertEqual(report.skipped, [(0, UNCHANGED), (1, UNCHANGED)])
+        self.assertEqual(report.summary(), {'processed': {},
+                                            'skipped': {UNCHANGED: 2},
+                                            'failed': 0, 'removed': 0})
+        with open(self.manifest_path) as fin:
+            entries = json.load(fin)['entries']
+        self.assertEqual(entries[row_key(['brain1', 'CT1'])]['outputs'], {
+            'output': os.path.join(self.dir_path, 'brain1_CT1.out')})
+
+    def test_changes_are_detected(self):
+        self.run_catalog(params={'spacing': 1})
+        self.write(self.catalog[0][2], 'new image')
+        self.write(self.catalog[1][3], 'new mask')
+        report = self.run_catalog(params={'spacing': 1})
+        self.assertEqual(sorted(report.processed),
+                         [(0, IMAGE_CHANGED), (1, MASK_CHANGED)])
+        report = self.run_catalog(params={'spacing': 2})
+        self.assertEqual(sorted(report.processed),
+                         [(0, PARAMS_CHANGED), (1, PARAMS_CHANGED)])
+        os.remove(os.path.join(self.dir_path, 'brain2_CT1.out'))
+        report = self.run_catalog(params={'spacing': 2})
+        self.assertEqual(report.processed, [(1, OUTPUTS_MISSING)])
+        self.assertEqual(report.skipped, [(0, UNCHANGED)])
+        report = self.run_catalog(params={'spacing': 2}, force=True)
+        self.assertEqual(sorted(report.processed),
+                         [(0, FORCED), (1, FORCED)])
+
+    def test_function_receives_catalog_indices(self):
+        self.run_catalog()
+        self.write(self.catalog[1][2], 'new image')
+        report = process_catalog(self.catalog, record_index,
+                                 self.manifest_path, num_workers=2)
+        self.assertEqual(report.processed, [(1, IMAGE_CHANGED)])
+        self.assertEqual(report.skipped, [(0, UNCHANGED)])
+        with open(os.path.join(self.dir_path, 'brain2_CT1.index')) as fin:
+            self.assertEqual(fin.read(), '1')
+        with open(self.manifest_path) as fin:
+            entries = json.load(fin)['entries']
+        outputs = entries[row_key(['brain2', 'CT1'])]['outputs']
+        self.assertEqual(outputs['index'], 1)
+
+    def test_failures_missing_sources_and_removed_rows(self):
+        self.run_catalog()
+        catalog = [self.catalog[0],
+                   ['broken', 'CT1'] + self.catalog[1][2:],
+                   ['brain3', 'CT1', os.path.join(self.dir_path, 'none')]]
+        report = self.run_catalog(catalog)
+        self.assertEqual(report.processed, [])
+        self.assertEqual(report.summary()['failed'], 1)
+        self.assertEqual(report.skipped, [(0, UNCHANGED),
+                                          (2, SOURCE_MISSING)])
+        self.assertEqual([r.index for r in report.failed], [1])
+        self.assertIsInstance(report.failed[0].error, ValueError)
+        self.assertEqual(report.removed, [row_key(['brain2', 'CT1'])])
+        report = self.run_catalog(catalog)
+        self.assertEqual([r.index for r in report.failed], [1])
+
+    def test_checkpoints_count_successful_rows(self):
+        catalog = [self.catalog[0], ['broken', 'CT1'] + self.catalog[1][2:],
+                   self.catalog[1]]
+        with mock.patch.object(Manifest, 'save', autospec=True,
+                               side_effect=Manifest.save) as save:
+            report = process_catalog(catalog, copy_row, self.manifest_path,
+                                     num_workers=1, checkpoint_every=2)
+        self.assertEqual(len(report.processed), 2)
+        # One checkpoint after the second processed row and the final save
+        self.assertEqual(save.call_count, 2)
+
+    def test_duplicate_ids_are_rejected(self):
+        catalog = self.catalog + [self.catalog[0]]
+        with self.assertRaises(ValueError):
+            self.run_catalog(catalog)
+        self.assertFalse(os.path.exists(self.manifest_path))
+        self.assertNotEqual(row_key(['a/b', 'c']), row_key(['a', 'b/c']))
+
+    def test_unserializable_outputs_are_failures(self):
+        report = process_catalog(self.catalog, lambda i, r: {'value': {1j}},
+                                 self.manifest_path, num_workers=2)
+        self.assertEqual(report.processed, [])
+        self.assertEqual(len(report.failed), 2)
+        self.assertIsInstance(report.failed[0].error, TypeError)
+        self.assertEqual(os.listdir(self.dir_path).count('manifest.json'), 1)
+        self.assertFalse([f for f in os.listdir(self.dir_path)
+                          if f.endswith('.tmp')])
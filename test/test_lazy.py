@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from bioimage import BioImage
+from constants import Modality
+from ct import DICOMCTDIR
+from lazy import LazyDICOMVolume
+
+
+class TestLazyDICOMVolume(unittest.TestCase):
+    def setUp(self):
+        self.brain1_image_path = 'test/data/brain1_image'
+        self.brain1_dims = (25, 256, 256)
+        self.voxels = sitk.GetArrayFromImage(
+            BioImage(self.brain1_image_path, Modality.DICOM_CT_DIR).load())
+
+    def test_indexing_matches_full_volume(self):
+        volume = BioImage(self.brain1_image_path,
+                          Modality.DICOM_CT_DIR).load_lazy()
+        self.assertEqual(volume.shape, self.brain1_dims)
+        self.assertEqual(len(volume), 25)
+        self.assertTrue(np.array_equal(volume[11], self.voxels[11]))
+        self.assertTrue(np.array_equal(volume[-1], self.voxels[-1]))
+        self.assertTrue(np.array_equal(volume[5:8], self.voxels[5:8]))
+        self.assertTrue(np.array_equal(volume[::10, 100:110, 5],
+                                       self.voxels[::10, 100:110, 5]))
+        self.assertEqual(volume[3:3].shape, (0, 256, 256))
+        with self.assertRaises(IndexError):
+            volume[25]
+
+    def test_decoded_slices_are_cached(self):
+        volume = LazyDICOMVolume.from_dir(self.brain1_image_path,
+                                          max_cached_slices=2)
+        first = volume[0]
+        self.assertIs(volume[0], first)
+        volume[1:3]
+        self.assertIsNot(volume[0], first)
+        self.assertFalse(first.flags.writeable)
+
+    def test_load_lazy_requires_DICOM_directories(self):
+        bioimage = BioImage('test/data/brain1_image.nrrd',
+                            Modality.SIMPLE_IMAGE)
+        with self.assertRaises(ValueError):
+            bioimage.load_lazy()
+        ct = DICOMCTDIR('brain1', 'CT1', self.brain1_image_path,
+                        mask_path='test/data/brain1_label')
+        image, mask = ct.load_lazy()
+        self.assertEqual(mask.shape, image.shape)
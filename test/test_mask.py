@@ -0,0 +1,92 @@
+import unittest
+import matplotlib.pyplot as plt
+import numpy as np
+import SimpleITK as sitk
+from ct import SimpleImage
+from mask import CompactMask
+from render import render_montage
+from utils import visualize_slice
+
+
+class TestCompactMask(unittest.TestCase):
+    def setUp(self):
+        self.mask = sitk.ReadImage('test/data/brain1_label.nrrd')
+        self.voxels = sitk.GetArrayFromImage(self.mask)
+        labels = np.zeros((20, 30, 40), dtype=np.int32)
+        labels[5:9, 10:20, 3:7] = 2
+        labels[6:12, 12:14, 5:30] = 300
+        self.labels = labels
+
+    def test_encodings_round_trip(self):
+        for voxels in [self.voxels, self.labels]:
+            encodings = ['auto', 'dense', 'rle']
+            if len(np.unique(voxels)) <= 2:
+                encodings.append('bits')
+            for encoding in encodings:
+                for crop in [True, False]:
+                    compact = CompactMask.from_array(voxels, encoding=encoding,
+                                                     crop=crop)
+                    decoded = compact.to_array()
+                    np.testing.assert_array_equal(decoded, voxels)
+                    for idx in [0, 6, 11, len(voxels) - 1]:
+                        np.testing.assert_array_equal(compact[idx],
+                                                      voxels[idx])
+
+    def test_masks_are_compact(self):
+        compact = CompactMask.from_image(self.mask)
+        self.assertEqual(compact.encoding, 'bits')
+        self.assertLess(compact.nbytes * 8, self.voxels.nbytes)
+        labels = CompactMask.from_array(self.labels, encoding='dense')
+        self.assertEqual(labels.dtype, np.uint16)
+        self.assertEqual(labels.box_shape, (7, 10, 27))
+
+    def test_to_image_keeps_geometry(self):
+        image = CompactMask.from_image(self.mask).to_image()
+        self.assertEqual(image.GetSpacing(), self.mask.GetSpacing())
+        self.assertEqual(image.GetOrigin(), self.mask.GetOrigin())
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(image),
+                                      self.voxels)
+
+    def test_empty_mask(self):
+        compact = CompactMask.from_array(np.zeros((3, 4, 5), dtype=np.int16))
+        self.assertEqual(compact.box_shape, (0, 0, 0))
+        np.testing.assert_array_equal(compact[1], np.zeros((4, 5)))
+        self.assertFalse(compact.to_array().any())
+
+    def test_boolean_masks_decode_as_booleans(self):
+        voxels = self.voxels != 0
+        for encoding in ['auto', 'dense', 'bits', 'rle']:
+            compact = CompactMask.from_array(voxels, encoding=encoding)
+            self.assertEqual(compact.to_array().dtype, np.bool_)
+            np.testing.assert_array_equal(compact.to_array(), voxels)
+            np.testing.assert_array_equal(compact[11], voxels[11])
+
+    def test_array_conversion_copies(self):
+        compact = CompactMask.from_array(self.labels)
+        np.testing.assert_array_equal(np.asarray(compact), self.labels)
+        if np.lib.NumpyVersion(np.__version__) >= '2.0.0':
+            with self.assertRaises(ValueError):
+                np.array(compact, copy=False)
+
+    def test_invalid_encodings(self):
+        with self.assertRaises(ValueError):
+            CompactMask.from_array(self.labels, encoding='bits')
+        with self.assertRaises(ValueError):
+            CompactMask.from_array(self.labels, encoding='zip')
+        with self.assertRaises(ValueError):
+            CompactMask.from_array(self.labels.astype(np.float32))
+
+    def test_consumers_accept_compact_masks(self):
+        ct = SimpleImage('brain1', 'CT1', 'test/data/brain1_image.nrrd',
+                         'test/data/brain1_label.nrrd')
+        image, compact = ct.load_compact()
+        self.assertIsInstance(compact, CompactMask)
+        voxels = sitk.GetArrayFromImage(image)
+        fig, ax = plt.subplots()
+        visualize_slice(voxels[11], compact[11], ax, 40, 80)
+        visualize_slice(voxels[11], CompactMask.from_array(self.voxels[11]),
+                        ax, 40, 80)
+        plt.close(fig)
+        np.testing.assert_array_equal(
+            render_montage(voxels, compact, ['brain'], slices=[11]),
+            render_montage(voxels, self.voxels, ['brain'], slices=[11]))
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from bioimage import BioImage
+from cache import VolumeDiskCache
+from constants import Modality
+from ct import SimpleImage
+from preprocess import Preprocessing
+
+
+class TestPreprocessing(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.image_path = 'test/data/brain1_image.nrrd'
+        self.mask_path = 'test/data/brain1_label.nrrd'
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_resample_to_isotropic_spacing(self):
+        image = sitk.ReadImage(self.image_path)
+        preprocessing = Preprocessing(spacing=2.0, num_threads=2)
+        resampled = preprocessing.process_image(image)
+        self.assertEqual(resampled.GetSpacing(), (2.0, 2.0, 2.0))
+        self.assertEqual(resampled.GetOrigin(), image.GetOrigin())
+        expected = [int(round(n * s / 2.0))
+                    for n, s in zip(image.GetSize(), image.GetSpacing())]
+        self.assertEqual(list(resampled.GetSize()), expected)
+        self.assertEqual(resampled.GetPixelID(), image.GetPixelID())
+
+    def test_mask_labels_are_kept(self):
+        mask = sitk.ReadImage(self.mask_path)
+        preprocessing = Preprocessing(spacing=2.0, interpolator='bspline')
+        resampled = preprocessing.process_mask(mask)
+        self.assertEqual(resampled.GetPixelID(), mask.GetPixelID())
+        labels = np.unique(sitk.GetArrayViewFromImage(resampled))
+        self.assertTrue(set(labels) <=
+                        set(np.unique(sitk.GetArrayViewFromImage(mask))))
+
+    def test_clip_and_normalize(self):
+        image = sitk.ReadImage(self.image_path)
+        clipped = Preprocessing(clip=(0, 80)).process_image(image)
+        voxels = sitk.GetArrayViewFromImage(clipped)
+        self.assertEqual(clipped.GetPixelID(), sitk.sitkFloat32)
+        self.assertGreaterEqual(voxels.min(), 0)
+        self.assertLessEqual(voxels.max(), 80)
+        normalized = Preprocessing(clip=(0, 80), normalize='zscore') \
+            .process_image(image)
+        voxels = sitk.GetArrayViewFromImage(normalized)
+        self.assertAlmostEqual(float(voxels.mean()), 0, places=3)
+        self.assertAlmostEqual(float(voxels.std()), 1, places=2)
+        scaled = Preprocessing(normalize='minmax').process_image(image)
+        voxels = sitk.GetArrayViewFromImage(scaled)
+        self.assertEqual((voxels.min(), voxels.max()), (0, 1))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            Preprocessing(interpolator='cubic')
+        with self.assertRaises(ValueError):
+            Preprocessing(normalize='scale')
+        with self.assertRaises(ValueError):
+            Preprocessing(clip=(80, 0))
+
+    def test_load_uses_disk_cache(self):
+        cache = VolumeDiskCache(self.cache_dir)
+        preprocessing = Preprocessing(spacing=2.0, clip=(0, 80), cache=cache)
+        bio_image = BioImage(self.image_path, modality=Modality.SIMPLE_IMAGE)
+        first = preprocessing.load(bio_image)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        second = preprocessing.load(bio_image)
+        np.testing.assert_array_equal(sitk.GetArrayViewFromImage(first),
+                                      sitk.GetArrayViewFromImage(second))
+        self.assertEqual(first.GetSpacing(), second.GetSpacing())
+        # Different parameters are cached under a different key
+        Preprocessing(spacing=2.0, cache=cache).load(bio_image)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+
+    def test_ct_load_with_preprocessing(self):
+        cache = VolumeDiskCache(self.cache_dir)
+        preprocessing = Preprocessing(spacing=(1.0, 1.0, 2.0), cache=cache)
+        ct = SimpleImage('brain1', 'CT1', self.image_path, self.mask_path,
+                         preprocessing=preprocessing)
+        image, mask = ct.load()
+        self.assertEqual(image.GetSpacing(), (1.0, 1.0, 2.0))
+        self.assertEqual(image.GetSize(), mask.GetSize())
+        image, mask = ct.load()
+        self.assertEqual(image.GetSize(), mask.GetSize())
@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from bioimage import BioImage
+from constants import Modality
+from ct import DICOMCTDIR
+from profiling import Profiler
+from profiling import _profiler_from_environment
+from profiling import get_profiler
+from profiling import profile
+from profiling import set_profiler
+from profiling import stage
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        # Tests do not depend on a profiler enabled by the environment
+        environ = mock.patch.dict(os.environ, {
+            k: v for k, v in os.environ.items()
+            if not k.startswith('BIOIMG_PROFILE')}, clear=True)
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.addCleanup(set_profiler, get_profiler())
+        set_profiler(None)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def test_stages_are_not_recorded_by_default(self):
+        self.assertIsNone(_profiler_from_environment())
+        self.assertIsNone(get_profiler())
+        with stage('test') as s:
+            s.add(bytes_read=1, voxels=1)
+
+    def test_profile_records_load_stages(self):
+        ct = DICOMCTDIR('brain1', 'CT1', 'test/data/brain1_image',
+                        'test/data/brain1_label')
+        with profile() as profiler:
+            ct.load()
+        self.assertIsNone(get_profiler())
+        stats = profiler.stats()
+        for name in ['ct.load', 'ct.check_geometry', 'BioImage.load',
+                     'find_DICOM_series.scan', 'read_DICOM_from_dir.decode',
+                     'read_DICOM_from_dir.metadata']:
+            self.assertIn(name, stats)
+        self.assertEqual(stats['ct.load']['calls'], 1)
+        self.assertEqual(stats['BioImage.load']['calls'], 2)
+        decode = stats['read_DICOM_from_dir.decode']
+        self.assertEqual(decode['voxels'], 2 * 256 * 256 * 25)
+        self.assertGreater(decode['bytes_read'], 2 * 256 * 256 * 25 * 2)
+        self.assertIn('read_DICOM_from_dir.decode', profiler.report())
+
+    def test_trace_file(self):
+        trace_path = os.path.join(self.dir_path, 'trace.json')
+        with profile(trace_path=trace_path):
+            BioImage('test/data/brain1_image.nrrd',
+                     modality=Modality.SIMPLE_IMAGE).load()
+        with open(trace_path) as fin:
+            events = json.load(fin)['traceEvents']
+        names = {event['name'] for event in events}
+        self.assertIn('BioImage.decode', names)
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertGreaterEqual(event['dur'], 0)
+
+    def test_failed_stages_are_counted(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.stage('failing'):
+                raise ValueError()
+        self.assertEqual(profiler.stats()['failing']['failures'], 1)
+        profiler.reset()
+        self.assertEqual(profiler.stats(), {})
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from lazy import LazyDICOMVolume
+from render import WINDOW_PRESETS
+from render import render_montage
+from render import render_slice_png
+from render import window_to_uint8
+from render import write_montages
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.image = sitk.GetArrayFromImage(
+            sitk.ReadImage('test/data/brain1_image.nrrd'))
+        self.mask = sitk.GetArrayFromImage(
+            sitk.ReadImage('test/data/brain1_label.nrrd'))
+
+    def test_window_to_uint8_clips_and_scales(self):
+        voxels = np.array([-1000, 0, 40, 80, 1000], dtype=np.int16)
+        scaled = window_to_uint8(voxels, 40, 80)
+        self.assertEqual(scaled.dtype, np.uint8)
+        self.assertListEqual(scaled.tolist(), [0, 0, 127, 255, 255])
+
+    def test_render_montage_lays_out_slices_and_windows(self):
+        windows = ['brain', WINDOW_PRESETS['bone']]
+        montage = render_montage(self.image, self.mask, windows,
+                                 slices=[10, 11, 12])
+        self.assertEqual(montage.shape, (3 * 256, 2 * 256, 3))
+        # Unmasked voxels are gray, masked voxels are tinted
+        row, column = np.argwhere(self.mask[11] != 0)[0]
+        gray = montage[256 + row, column]
+        self.assertNotEqual(gray[0], gray[2])
+        unmasked = montage[256:512, :256][self.mask[11] == 0]
+        self.assertTrue(np.all(unmasked[:, 0] == unmasked[:, 2]))
+
+    def test_render_montage_accepts_lazy_volumes(self):
+        volume = LazyDICOMVolume.from_dir('test/data/brain1_image')
+        montage = render_montage(volume, None, ['soft_tissue'], slices=[11])
+        expected = render_montage(self.image, None, ['soft_tissue'],
+                                  slices=[11])
+        self.assertTrue(np.array_equal(montage, expected))
+
+    def test_label_colours_do_not_depend_on_other_labels(self):
+        volume = np.zeros((2, 4, 4), dtype=np.int16)
+        mask = np.zeros((2, 4, 4), dtype=np.uint8)
+        mask[0, 0, 0] = 2
+        mask[1, 0, 0] = 5
+        together = render_montage(volume, mask, ['brain'])
+        for idx in range(2):
+            alone = render_montage(volume, mask, ['brain'], slices=[idx])
+            np.testing.assert_array_equal(together[4 * idx, 0], alone[0, 0])
+        self.assertFalse(np.array_equal(together[0, 0], together[4, 0]))
+
+    def test_render_montage_rejects_empty_slices(self):
+        with self.assertRaises(ValueError):
+            render_montage(self.image, self.mask, ['brain'], slices=[])
+
+    def test_render_montage_reuses_buffers(self):
+        buffers = {}
+        montage = render_montage(self.image, self.mask, ['brain'],
+                                 slices=range(10), buffers=buffers)
+        allocated = {k: v.ctypes.data for k, v in buffers.items()}
+        expected = render_montage(self.image, self.mask, ['brain'],
+                                  slices=range(20, 25))
+        montage = render_montage(self.image, self.mask, ['brain'],
+                                 slices=range(20, 25), buffers=buffers)
+        self.assertTrue(np.array_equal(montage, expected))
+        self.assertEqual({k: v.ctypes.data for k, v in buffers.items()},
+                         allocated)
+
+    def test_png_output(self):
+        png = render_slice_png(self.image[11], self.mask[11], 40, 400)
+        self.assertTrue(png.startswith(PNG_SIGNATURE))
+        output_dir = tempfile.mkdtemp()
+        try:
+            pattern = os.path.join(output_dir, 'brain1_{:02d}.png')
+            paths = write_montages(self.image, self.mask, ['brain', 'bone'],
+                                   pattern, slices_per_montage=10)
+            self.assertEqual(len(paths), 3)
+            for path in paths:
+                with open(path, 'rb') as fin:
+                    self.assertTrue(fin.read().startswith(PNG_SIGNATURE))
+        finally:
+            shutil.rmtree(output_dir)
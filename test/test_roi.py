@@ -0,0 +1,110 @@
+import unittest
+from unittest import mock
+import numpy as np
+import SimpleITK as sitk
+from ct import DICOMCTDIR
+from ct import SimpleImage
+from roi import get_bounding_box
+
+
+class TestRegionOfInterest(unittest.TestCase):
+    def setUp(self):
+        self.brain1_masked_ct = SimpleImage('brain1', 'CT1',
+                                            'test/data/brain1_image.nrrd',
+                                            'test/data/brain1_label.nrrd')
+        self.brain1_image, self.brain1_label = self.brain1_masked_ct.load()
+        self.label_voxels = sitk.GetArrayFromImage(self.brain1_label)
+
+    def test_bounding_box_contains_all_labeled_voxels(self):
+        start, size = get_bounding_box(self.brain1_label)
+        coordinates = np.argwhere(self.label_voxels != 0)
+        self.assertEqual(start, tuple(coordinates.min(axis=0)))
+        self.assertEqual(size, tuple(coordinates.max(axis=0) -
+                                     coordinates.min(axis=0) + 1))
+        with self.assertRaises(ValueError):
+            get_bounding_box(self.brain1_label, label=2)
+
+    def test_load_roi_returns_padded_region(self):
+        roi = self.brain1_masked_ct.load_roi(padding=(1, 4, 4))
+        start, size = get_bounding_box(self.brain1_label)
+        expected_slices = tuple(
+            slice(max(0, s - p), min(d, s + n + p))
+            for s, n, p, d in zip(start, size, (1, 4, 4), (25, 256, 256)))
+        expected_shape = tuple(s.stop - s.start for s in expected_slices)
+        self.assertEqual(roi.image.GetSize()[::-1], expected_shape)
+        self.assertEqual(roi.image_array.shape, expected_shape)
+        self.assertFalse(roi.image_array.flags.owndata)
+        np.testing.assert_array_equal(
+            roi.image_array,
+            sitk.GetArrayViewFromImage(self.brain1_image)[expected_slices])
+        self.assertEqual(int((roi.mask_array != 0).sum()),
+                         int((self.label_voxels != 0).sum()))
+        self.assertEqual(
+            roi.image.TransformIndexToPhysicalPoint((0, 0, 0)),
+            self.brain1_image.TransformIndexToPhysicalPoint(
+                tuple(s.start for s in expected_slices[::-1])))
+        # The bounding box is cached
+        self.assertEqual([key[-1] for key in
+                          self.brain1_masked_ct._bounding_boxes], [None])
+        # Given images are used as they are
+        other = self.brain1_masked_ct.load_roi(
+            images=(self.brain1_image, self.brain1_label))
+        self.assertIs(other.image, self.brain1_image)
+        self.assertEqual(other.slices, tuple(
+            slice(s, s + n) for s, n in zip(start, size)))
+        image, mask = other.crop_images()
+        self.assertEqual(image.GetSize(), other.image_array.shape[::-1])
+        self.assertEqual(
+            image.TransformIndexToPhysicalPoint((0, 0, 0)),
+            self.brain1_image.TransformIndexToPhysicalPoint(
+                tuple(int(s.start) for s in other.slices[::-1])))
+
+    def test_load_roi_reads_only_the_region_once_cached(self):
+        for ct in [self.brain1_masked_ct,
+                   DICOMCTDIR('brain1', 'CT1', 'test/data/brain1_image',
+                              mask_path='test/data/brain1_label')]:
+            first = ct.load_roi(padding=2)
+            with mock.patch.object(ct, 'load') as load:
+                second = ct.load_roi(padding=2)
+            load.assert_not_called()
+            self.assertEqual(second.slices, first.slices)
+            for name in ['image', 'mask']:
+                expected = getattr(first, name)
+                image = getattr(second, name)
+                np.testing.assert_array_equal(
+                    sitk.GetArrayViewFromImage(image),
+                    sitk.GetArrayViewFromImage(expected))
+                np.testing.assert_allclose(image.GetOrigin(),
+                                           expected.GetOrigin())
+                np.testing.assert_allclose(image.GetSpacing(),
+                                           expected.GetSpacing())
+
+    def test_load_roi_uses_geometry_of_given_mask(self):
+        images = (self.brain1_image, self.brain1_label)
+        roi = self.brain1_masked_ct.load_roi(images=images, padding=2)
+        image, mask = roi.crop_images()
+        cropped = self.brain1_masked_ct.load_roi(images=(image, mask))
+        start, size = get_bounding_box(mask)
+        self.assertEqual((cropped.start, cropped.size), (start, size))
+        self.assertNotEqual(cropped.start, roi.start)
+        self.assertEqual(int((cropped.mask_array != 0).sum()),
+                         int((self.label_voxels != 0).sum()))
+
+    def test_extract_patches(self):
+        ct = DICOMCTDIR('brain1', 'CT1', 'test/data/brain1_image',
+                        mask_path='test/data/brain1_label')
+        roi = ct.load_roi(padding=(0, 64, 64))
+        images, masks = roi.extract_patches((4, 32, 32), stride=(4, 16, 16))
+        self.assertEqual(images.shape[1:], (4, 32, 32))
+        self.assertEqual(images.shape, masks.shape)
+        self.assertTrue(images.flags.c_contiguous)
+        # A patch covering the region yields a single patch
+        shape = roi.image_array.shape
+        images, masks = roi.extract_patches(shape)
+        self.assertEqual(images.shape, (1,) + shape)
+        self.assertEqual(int((masks != 0).sum()),
+                         int((self.label_voxels != 0).sum()))
+        with self.assertRaises(ValueError):
+            roi.extract_patches((shape[0] + 1, 8, 8))
+        with self.assertRaises(ValueError):
+            DICOMCTDIR('brain1', 'CT1', 'test/data/brain1_image').load_roi()
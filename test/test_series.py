@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import SimpleITK as sitk
+from bioimage import BioImage
+from cache import VolumeMemoryCache
+from cache import set_memory_cache
+from constants import Modality
+from ct import DICOMCTDIR
+from series import SeriesIndex
+
+
+class TestSeriesIndex(unittest.TestCase):
+    def setUp(self):
+        # A directory holding two series: brain1_image and dummy_image
+        self.root = tempfile.mkdtemp()
+        self.study_dir = os.path.join(self.root, 'study')
+        os.makedirs(self.study_dir)
+        for name in ['brain1_image', 'dummy_image']:
+            src_dir = os.path.join('test/data', name)
+            for file_name in os.listdir(src_dir):
+                shutil.copy(os.path.join(src_dir, file_name),
+                            os.path.join(self.study_dir,
+                                         name + '_' + file_name))
+        self.brain1_series_id = sitk.ImageSeriesReader.GetGDCMSeriesIDs(
+            'test/data/brain1_image')[0]
+        self.dummy_series_id = sitk.ImageSeriesReader.GetGDCMSeriesIDs(
+            'test/data/dummy_image')[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_build_save_and_load(self):
+        index = SeriesIndex.build(self.root)
+        self.assertEqual(len(index), 2)
+        entry = index.get(self.dummy_series_id)
+        self.assertEqual(len(entry.file_names), 8)
+        self.assertEqual(entry.tags['Modality'], 'CT')
+        index_path = os.path.join(self.root, 'index.json')
+        index.save(index_path)
+        loaded = SeriesIndex.load(index_path)
+        self.assertEqual(loaded.get(self.dummy_series_id), entry)
+        with self.assertRaises(ValueError):
+            index.get('1.2.3')
+
+    def test_saved_index_is_independent_of_working_directory(self):
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            SeriesIndex.build('study').save('index.json')
+        finally:
+            os.chdir(cwd)
+        index = SeriesIndex.load(os.path.join(self.root, 'index.json'))
+        image = BioImage(self.study_dir, Modality.DICOM_CT_DIR,
+                         series=lambda e: len(e.file_names) == 8,
+                         series_index=index)
+        self.assertEqual(image.load().GetSize(), (10, 9, 8))
+        entry = index.get(self.brain1_series_id)
+        self.assertTrue(all(os.path.isabs(f) for f in entry.file_names))
+        # Load keys depend on the indexed files, not on the index object
+        keys = [BioImage(self.study_dir, Modality.DICOM_CT_DIR,
+                         series=self.brain1_series_id,
+                         series_index=i).load_key()
+                for i in [index, SeriesIndex.build(self.root)]]
+        self.assertEqual(keys[0], keys[1])
+
+    def test_first_series_is_read_with_or_without_index(self):
+        index = SeriesIndex.build(self.root)
+        with_index = BioImage(self.study_dir, Modality.DICOM_CT_DIR,
+                              series_index=index)
+        without_index = BioImage(self.study_dir, Modality.DICOM_CT_DIR)
+        self.assertEqual(with_index.load().GetSize(),
+                         without_index.load().GetSize())
+
+    def test_memory_cache_hits_skip_series_selection(self):
+        set_memory_cache(VolumeMemoryCache(max_bytes=1 << 30))
+        try:
+            image = BioImage(self.study_dir, Modality.DICOM_CT_DIR,
+                             series=lambda e: len(e.file_names) == 8)
+            select_series = BioImage.select_series
+            with mock.patch.object(BioImage, 'select_series', autospec=True,
+                                   side_effect=select_series) as select:
+                first = image.load()
+                second = image.load()
+        finally:
+            set_memory_cache(None)
+        self.assertEqual(first.GetSize(), (10, 9, 8))
+        self.assertEqual(second.GetSize(), first.GetSize())
+        self.assertEqual(select.call_count, 1)
+
+    def test_select_series_by_uid_or_predicate(self):
+        index = SeriesIndex.build(self.root)
+        with self.assertRaises(ValueError):
+            index.select(directory=self.study_dir)
+        entry = index.select(lambda e: len(e.file_names) == 25,
+                             directory=self.study_dir)
+        self.assertEqual(entry.series_id, self.brain1_series_id)
+        self.assertEqual(index.find(directory=self.root), [])
+
+    def test_bioimage_reads_selected_series(self):
+        index = SeriesIndex.build(self.root)
+        dummy = BioImage(self.study_dir, Modality.DICOM_CT_DIR,
+                         series=self.dummy_series_id)
+        self.assertEqual(dummy.load().GetSize(), (10, 9, 8))
+        brain1 = BioImage(self.study_dir, Modality.DICOM_CT_DIR,
+                          series=lambda e: len(e.file_names) == 25)
+        self.assertEqual(brain1.load().GetSize(), (256, 256, 25))
+        ct = DICOMCTDIR('brain1', 'CT1', self.study_dir,
+                        mask_path=self.study_dir,
+                        series=self.brain1_series_id,
+                        mask_series=self.brain1_series_id,
+                        series_index=index)
+        image, mask = ct.load()
+        self.assertEqual(image.GetSize(), (256, 256, 25))
+        header, _ = ct.probe()
+        self.assertEqual(header.series_id, self.brain1_series_id)
+        lazy_image, _ = ct.load_lazy()
+        self.assertEqual(lazy_image.shape, (25, 256, 256))
@@ -0,0 +1,67 @@
+import gc
+import os
+import pickle
+import unittest
+import numpy as np
+import SimpleITK as sitk
+from batch import load_catalog
+from constants import Modality
+from shm import SharedVolume
+from utils import read_catalog
+
+
+def block_exists(name):
+    return os.path.exists(os.path.join('/dev/shm', name.lstrip('/')))
+
+
+@unittest.skipUnless(os.path.isdir('/dev/shm'), 'POSIX shared memory only')
+class TestSharedVolume(unittest.TestCase):
+    def setUp(self):
+        self.image = sitk.ReadImage('test/data/brain1_image.nrrd')
+        self.image.SetMetaData('bioimg|test', 'value')
+
+    def test_round_trip_through_pickle(self):
+        handle = SharedVolume.from_image(self.image)
+        received = pickle.loads(pickle.dumps(handle))
+        self.assertLess(len(pickle.dumps(handle)), 4096)
+        np.testing.assert_array_equal(received.array(),
+                                      sitk.GetArrayViewFromImage(self.image))
+        image = received.to_image()
+        self.assertEqual(image.GetSpacing(), self.image.GetSpacing())
+        self.assertEqual(image.GetOrigin(), self.image.GetOrigin())
+        self.assertEqual(image.GetMetaData('bioimg|test'), 'value')
+        received.release()
+        self.assertFalse(block_exists(handle.name))
+        with self.assertRaises(ValueError):
+            received.array()
+
+    def test_block_is_unlinked_after_last_reference(self):
+        handle = SharedVolume.from_image(self.image)
+        first = pickle.loads(pickle.dumps(handle))
+        second = pickle.loads(pickle.dumps(handle))
+        with first as voxels:
+            self.assertEqual(voxels.shape, (25, 256, 256))
+        self.assertTrue(block_exists(handle.name))
+        del second
+        gc.collect()
+        self.assertFalse(block_exists(handle.name))
+
+    def test_load_catalog_in_shared_memory(self):
+        catalog = read_catalog('test/data/catalog.csv', sep=',')
+        expected = sitk.GetArrayFromImage(self.image)
+        names = []
+        for result in load_catalog(catalog, Modality.DICOM_CT_DIR,
+                                   num_workers=2, executor='process',
+                                   shared_memory=True):
+            self.assertIsNone(result.error)
+            self.assertIsInstance(result.image, SharedVolume)
+            with result.image as voxels:
+                np.testing.assert_array_equal(voxels, expected)
+            result.mask.release()
+            names += [result.image.name, result.mask.name]
+        for name in names:
+            self.assertFalse(block_exists(name))
+
+    def test_shared_memory_requires_processes(self):
+        with self.assertRaises(ValueError):
+            load_catalog([], Modality.DICOM_CT_DIR, shared_memory=True)
@@ -1,8 +1,14 @@
 import json
+import random
 import unittest
+import numpy as np
 from collections import OrderedDict
+from utils import iter_catalog
 from utils import read_catalog
 from utils import partition
+from utils import partition_indices
+from utils import read_DICOM_from_dir
+from utils import get_slice_table
 from ct import DICOMCTDIR
 from ct import SimpleImage
 
@@ -26,6 +32,13 @@ class TestUtilsMethods(unittest.TestCase):
         for x, y in zip(catalog_sequence, expected):
             self.assertListEqual(x, y)
 
+    def test_iter_catalog_is_lazy(self):
+        rows = iter_catalog('test/data/catalog.csv', sep=',')
+        self.assertListEqual(next(rows), ["brain1", "CT1",
+                                          "test/data/brain1_image",
+                                          "test/data/brain1_label"])
+        self.assertEqual(len(list(rows)), 1)
+
     def test_partition_with_zero_indexed_elements(self):
         x = list(range(10))
         parts = partition(x, [0.5, 0.5])
@@ -40,3 +53,66 @@ class TestUtilsMethods(unittest.TestCase):
         self.assertEqual(len(parts[0]), 2)
         self.assertEqual(len(parts[1]), 8)
         self.assertEqual(set(parts[0]).union(set(parts[1])), set(x))
+
+    def test_read_DICOM_from_dir_keeps_per_slice_metadata(self):
+        image = read_DICOM_from_dir('test/data/brain1_image')
+        self.assertEqual(image.GetSize(), (256, 256, 25))
+        # Metadata of the first slice is copied to the image
+        self.assertEqual(image.GetMetaData('0020|0013').strip(), '25')
+        table = get_slice_table(image)
+        self.assertEqual(len(table['InstanceNumber']), 25)
+        self.assertEqual(table['InstanceNumber'][:3], ['25', '24', '23'])
+        self.assertEqual(set(table['RescaleSlope']), {'1'})
+        # A missing tag is represented by an empty string
+        self.assertEqual(set(table['SliceLocation']), {''})
+        image = read_DICOM_from_dir('test/data/brain1_image', slice_tags=None)
+        self.assertEqual(get_slice_table(image), {})
+
+    def test_partition_accepts_inexact_portions(self):
+        x = list(range(100))
+        parts = partition(x, [0.1] * 10)
+        self.assertEqual([len(p) for p in parts], [10] * 10)
+        with self.assertRaises(ValueError):
+            partition(x, [0.5, 0.6])
+
+    def test_partition_is_deterministic_given_a_seed(self):
+        parts = partition_indices(1000, [0.7, 0.15, 0.15], seed=7)
+        same_parts = partition_indices(1000, [0.7, 0.15, 0.15], seed=7)
+        self.assertEqual([len(p) for p in parts], [700, 150, 150])
+        for p, q in zip(parts, same_parts):
+            self.assertListEqual(p.tolist(), q.tolist())
+        self.assertEqual(sorted(np.concatenate(parts)), list(range(1000)))
+
+    def test_partition_follows_random_module_state(self):
+        x = list(range(100))
+        random.seed(3)
+        parts = partition(x, [0.5, 0.5])
+        random.seed(3)
+        self.assertEqual(partition(x, [0.5, 0.5]), parts)
+
+    def test_partition_keeps_groups_together(self):
+        catalog = [['sample{}'.format(i // 3), 'CT{}'.format(i % 3)]
+                   for i in range(300)]
+        parts = partition(catalog, [0.8, 0.2], seed=0, groups=0, lazy=True)
+        self.assertEqual(sum(len(p) for p in parts), 300)
+        samples = [set(row[0] for row in p) for p in parts]
+        self.assertEqual(samples[0] & samples[1], set())
+        self.assertEqual(len(parts[1]) % 3, 0)
+        self.assertAlmostEqual(len(parts[1]) / 300, 0.2, delta=0.05)
+
+    def test_partition_stratifies_labels(self):
+        labels = ['a'] * 90 + ['b'] * 10
+        parts = partition_indices(100, [0.5, 0.5], seed=1, stratify=labels)
+        for indices in parts:
+            self.assertEqual(sum(labels[i] == 'b' for i in indices), 5)
+
+    def test_stratified_partition_sizes_follow_portions(self):
+        labels = ['a'] * 5 + ['b'] * 5
+        for seed in range(10):
+            parts = partition_indices(10, [0.3, 0.7], seed=seed,
+                                      stratify=labels)
+            self.assertEqual([len(p) for p in parts], [3, 7])
+        # Singleton strata do not all go to the last partition
+        parts = partition_indices(10, [0.3, 0.7], seed=0,
+                                  stratify=list(range(10)))
+        self.assertEqual([len(p) for p in parts], [3, 7])
@@ -1,10 +1,40 @@
 """ This module contains utility functions.
 
 """
+import hashlib
+import json
+import os
 import random
 import numpy as np
 import SimpleITK as sitk
 
+import profiling
+
+
+# DICOM tags collected for every slice when reading a DICOM series.
+SLICE_TAGS = {
+    'SliceLocation': '0020|1041',
+    'InstanceNumber': '0020|0013',
+    'ImagePositionPatient': '0020|0032',
+    'RescaleSlope': '0028|1053',
+    'RescaleIntercept': '0028|1052',
+}
+# The metadata key used for storing the per-slice table on an image.
+SLICE_TABLE_KEY = 'bioimg|SliceTable'
+
+
+def get_window_bounds(location, width):
+    """ Get the minimum and maximum voxel values of an observation window.
+
+    Args:
+        location: Center point in Hounsfield unit for the observation window.
+        width: Width of the observation window in Hounsfield unit.
+
+    Returns:
+        The minimum and the maximum voxel values.
+    """
+    radious = width // 2
+    return location - radious, location + radious
 
 
 def visualize_slice(image, mask, ax, location, width, **kwargs):
@@ -12,51 +42,162 @@ def visualize_slice(image, mask, ax, location, width, **kwargs):
 
     Args:
         image: A 3D numpy array.
-        mask: A 3D numpy array.
+        mask: A 3D numpy array, or a mask.CompactMask, which is decoded.
         ax: An Axis object to be used for drawing.
         location: Center point in Hounsfield unit for the observation window.
         width: Width of the observation window in Hounsfield unit.
         **kwargs: Other graphical parameters used for drawing.
 
     """
-    radious = width // 2
-    min_voxel, max_voxel = location - radious, location + radious
-    img = image.copy()
-    img[img < min_voxel] = min_voxel
-    img[img > max_voxel] = max_voxel
+    min_voxel, max_voxel = get_window_bounds(location, width)
+    img = np.clip(image, min_voxel, max_voxel)
     ax.imshow(img, interpolation='none', **kwargs)
     if mask is not None:
+        mask = np.asarray(mask)
         mask_image = np.ma.masked_where(mask == 0, mask)
         ax.imshow(mask_image, cmap='autumn', interpolation='none', alpha=0.7)
 
 
-def read_DICOM_from_dir(dir_path):
+def read_DICOM_from_dir(dir_path, slice_tags=SLICE_TAGS, series_id=None,
+                        slice_paths=None):
     """ Read a CT image (or its contours) from a directory.
 
+    The series is read in a single pass. Metadata of the first slice is
+        copied to the returned image and the values of slice_tags for every
+        slice are stored on the image as a table, see get_slice_table.
+
     Args:
         dir_path (str): Address of the directory containing DICOM files.
+        slice_tags: A dict mapping column names to DICOM tags, e.g.
+            {'InstanceNumber': '0020|0013'}, to be collected for every
+            slice. Use None for not storing a per-slice table.
+        series_id (str): The UID of the series to read. Default is None for
+            reading the first series found in the directory.
+        slice_paths: Addresses of the files of the series, sorted by
+            geometry, e.g. from a series.SeriesIndex. If given, the directory
+            is not scanned.
 
     Returns: A SimpleITK.Image.
 
     """
     reader = sitk.ImageSeriesReader()
-    series_ids = reader.GetGDCMSeriesIDs(dir_path)
-    if len(series_ids) == 0:
-        raise ValueError('No DICOM file in directory:\n{}'.format(dir_path))
-    slice_paths = reader.GetGDCMSeriesFileNames(dir_path, series_ids[0])
+    if slice_paths is None:
+        slice_paths = find_DICOM_series(dir_path, series_id=series_id)
     reader.SetFileNames(slice_paths)
-    ct = reader.Execute()
-    # Reading matadata from one slice, currently SimpleITK does not support
-    # extracting metadata when reading a series
-    reader = sitk.ImageFileReader()
-    reader.SetFileName(slice_paths[0])
-    img = reader.Execute()
-    for k in img.GetMetaDataKeys():
-        value = img.GetMetaData(k)
-        ct.SetMetaData(k, value)
+    reader.MetaDataDictionaryArrayUpdateOn()
+    reader.LoadPrivateTagsOn()
+    with profiling.stage('read_DICOM_from_dir.decode') as stage:
+        ct = reader.Execute()
+        if profiling.is_enabled():
+            stage.add(bytes_read=sum(os.path.getsize(p) for p in slice_paths),
+                      voxels=ct.GetNumberOfPixels())
+    with profiling.stage('read_DICOM_from_dir.metadata'):
+        for k in reader.GetMetaDataKeys(0):
+            ct.SetMetaData(k, reader.GetMetaData(0, k))
+        if slice_tags:
+            table = {name: [reader.GetMetaData(i, tag).strip()
+                            if reader.HasMetaDataKey(i, tag) else ''
+                            for i in range(len(slice_paths))]
+                     for name, tag in slice_tags.items()}
+            ct.SetMetaData(SLICE_TABLE_KEY, json.dumps(table))
     return ct
 
 
+def find_DICOM_series(dir_path, series_id=None):
+    """ Find the files of a DICOM series within a directory.
+
+    Args:
+        dir_path (str): Address of the directory containing DICOM files.
+        series_id (str): The UID of the series. Default is None for the first
+            series found in the directory.
+
+    Returns:
+        A list of file addresses sorted by geometry.
+
+    """
+    with profiling.stage('find_DICOM_series.scan'):
+        if series_id is None:
+            series_ids = sitk.ImageSeriesReader.GetGDCMSeriesIDs(dir_path)
+            if len(series_ids) == 0:
+                msg = 'No DICOM file in directory:\n{}'
+                raise ValueError(msg.format(dir_path))
+            series_id = series_ids[0]
+        slice_paths = sitk.ImageSeriesReader.GetGDCMSeriesFileNames(
+            dir_path, series_id)
+    if len(slice_paths) == 0:
+        msg = 'No DICOM file of series {} in directory:\n{}'
+        raise ValueError(msg.format(series_id, dir_path))
+    return slice_paths
+
+
+def get_slice_table(image):
+    """ Get the per-slice metadata stored on an image by read_DICOM_from_dir.
+
+    Args:
+        image: A SimpleITK.Image.
+
+    Returns:
+        A dict mapping each column name, e.g. 'InstanceNumber', to a list
+            of string values, where the i-th value belongs to slice i of the
+            image. A missing tag is represented by an empty string. An empty
+            dict is returned if the image has no per-slice table.
+
+    """
+    if not image.HasMetaDataKey(SLICE_TABLE_KEY):
+        return {}
+    return json.loads(image.GetMetaData(SLICE_TABLE_KEY))
+
+
+def fingerprint(source):
+    """ Compute a fingerprint of the files an image is read from.
+
+    The fingerprint changes when a file is added, removed, resized or
+        modified. Only files directly within a directory are considered,
+        as is the case when reading a DICOM series from a directory.
+
+    Args:
+        source (str): Address of a file or a directory.
+
+    Returns:
+        A hexadecimal string.
+
+    """
+    source = os.path.abspath(source)
+    if os.path.isdir(source):
+        with os.scandir(source) as entries:
+            paths = sorted(entry.path for entry in entries if entry.is_file())
+    else:
+        paths = [source]
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        entry = '{}\0{}\0{}\n'.format(path, stat.st_size, stat.st_mtime_ns)
+        digest.update(entry.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def iter_catalog(catalog_file_path, sep=','):
+    """ Iterate over the rows of a Catalog file without reading it at once.
+
+    See read_catalog for the format of a Catalog file.
+
+    Args:
+        catalog_file_path: Address of a catalog file.
+        sep: A field seperator.
+
+    Yields:
+        A list containing (1) sample_id, (2) image_id, (3) image_src, and
+            (4) mask_src for each row of the catalog.
+
+    """
+    with open(catalog_file_path) as fin:
+        for line in fin:
+            line = line.strip()
+            if line.startswith('#') or line == '':
+                continue
+            yield [x.strip() for x in line.split(sep)]
+
+
 def read_catalog(catalog_file_path, sep=','):
     """ Read a Catalog file.
     A Catalog file is a tabular file containing 4 columns. These are
@@ -72,42 +213,163 @@ def read_catalog(catalog_file_path, sep=','):
             (1) sample_id, (2) image_id, (3) image_src, and (4) mask_src.
 
     """
-    data_sequence = []
-    with open(catalog_file_path) as fin:
-        for line in fin:
-            line = line.strip()
-            if line.startswith('#') or line == '':
-                continue
-            instance_info = [x.strip() for x in line.split(sep)]
-            data_sequence.append(instance_info)
-    return data_sequence
+    return list(iter_catalog(catalog_file_path, sep=sep))
+
+
+class Subset(object):
+    """ A lazy view of the elements of a sequence at given indices.
+
+    Args:
+        elements: A sequence supporting indexing, e.g. a list or a catalog.
+        indices: A 1D numpy array of indices into elements.
+    """
+    def __init__(self, elements, indices):
+        self.elements = elements
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Subset(self.elements, self.indices[key])
+        return self.elements[self.indices[key]]
+
+    def __iter__(self):
+        for idx in self.indices:
+            yield self.elements[idx]
+
+
+def _get_labels(elements, labels):
+    """ Get per-element labels given as a sequence or as a column index."""
+    if isinstance(labels, int):
+        labels = [element[labels] for element in elements]
+    labels = np.asarray(labels)
+    if len(labels) != len(elements):
+        raise ValueError('There must be one label per element.')
+    return labels
+
+
+def _largest_remainder(quotas, rng):
+    """ Round non-negative quotas to integers preserving their sum.
+
+    Quotas are rounded down, and the remaining units go to the quotas with
+        the largest fractional parts, ties being broken randomly.
+    """
+    total = int(round(quotas.sum()))
+    # A small tolerance keeps e.g. 0.3 * 10 from being rounded down to 2
+    counts = np.floor(quotas + 1e-9).astype(np.int64)
+    remainders = np.round(quotas - counts, 9)
+    order = np.lexsort((rng.random(len(quotas)), -remainders))
+    counts[order[:total - counts.sum()]] += 1
+    return counts
+
+
+def partition_indices(num_elements, portions, seed=None, stratify=None,
+                      groups=None):
+    """ Partition the indices of elements randomly.
+
+    The partition depends only on its arguments, so processes using the same
+        seed agree on the partition without communicating.
+
+    Args:
+        num_elements (int): The number of elements.
+        portions: A list of positive real numbers, each between 0 and 1,
+            exclusively. The summation of elements in portions must be 1.
+        seed (int): The seed of the random generator. Default is None for
+            a seed drawn from the random module, so that partitions are
+            reproducible after calling random.seed.
+        stratify: A sequence of num_elements labels. If given, each label is
+            partitioned according to portions separately.
+        groups: A sequence of num_elements group labels, e.g. sample_ids.
+            If given, all elements of a group belong to the same partition.
+
+    Returns:
+        A list of 1D numpy arrays, where the i-th array contains the indices
+            of about portions[i] * 100 percent of elements. Sizes are rounded
+            using the largest remainder method, so they differ from
+            portions[i] * num_elements by at most one element, unless
+            groups are given.
+
+    """
+    portions = np.asarray(portions, dtype=np.float64)
+    if np.any(portions <= 0) or not np.isclose(portions.sum(), 1):
+        msg = 'Portions must be positive and sum to 1, but they are {}.'
+        raise ValueError(msg.format(portions.tolist()))
+    if seed is None:
+        # Callers seeding the random module keep reproducible partitions
+        seed = random.getrandbits(64)
+    rng = np.random.default_rng(seed)
+    if stratify is None and groups is None:
+        permutation = rng.permutation(num_elements)
+        counts = _largest_remainder(portions * num_elements, rng)
+        return np.split(permutation, np.cumsum(counts)[:-1])
+    # Partition units, i.e. groups or single elements, within each stratum
+    if groups is None:
+        unit_of_element = np.arange(num_elements)
+    else:
+        _, unit_of_element = np.unique(np.asarray(groups),
+                                       return_inverse=True)
+    unit_sizes = np.bincount(unit_of_element)
+    if stratify is None:
+        unit_strata = np.zeros(len(unit_sizes), dtype=np.int64)
+    else:
+        _, strata = np.unique(np.asarray(stratify), return_inverse=True)
+        # A group belongs to the stratum of its first element
+        _, first_elements = np.unique(unit_of_element, return_index=True)
+        unit_strata = strata[first_elements]
+    unit_partition = np.empty(len(unit_sizes), dtype=np.int64)
+    # Elements assigned to each partition by the strata processed so far;
+    # each stratum makes up for the rounding of the previous ones, so that
+    # partition sizes follow portions overall as well as within strata.
+    assigned = np.zeros(len(portions))
+    for stratum in np.unique(unit_strata):
+        units = rng.permutation(np.flatnonzero(unit_strata == stratum))
+        sizes = unit_sizes[units]
+        quotas = np.maximum(portions * (assigned.sum() + sizes.sum()) -
+                            assigned, 0)
+        quotas *= sizes.sum() / quotas.sum()
+        counts = _largest_remainder(quotas, rng)
+        starts = np.cumsum(sizes) - sizes
+        unit_partition[units] = np.searchsorted(np.cumsum(counts)[:-1],
+                                                starts, side='right')
+        assigned += np.bincount(unit_partition[units], weights=sizes,
+                                minlength=len(portions))
+    element_partition = unit_partition[unit_of_element]
+    return [np.flatnonzero(element_partition == i)
+            for i in range(len(portions))]
 
 
-def partition(elements, portions):
+def partition(elements, portions, seed=None, stratify=None, groups=None,
+              lazy=False):
     """ partitions samples randomly.
 
     Args:
         elements: A list.
         portions: A list of positive real numbers, each between 0 and 1,
             exclusively. The summation of elements in portions must be 1.
+        seed (int): The seed of the random generator. Default is None for
+            a seed drawn from the random module, see partition_indices.
+        stratify: A sequence of labels, one per element, or the index of a
+            column of elements, e.g. of a catalog, holding the labels. If
+            given, each label is partitioned according to portions.
+        groups: A sequence of group labels, one per element, or the index of
+            a column of elements, e.g. 0 for the sample_id of a catalog. If
+            given, all elements of a group belong to the same partition.
+        lazy (bool): If True, partitions are returned as Subset views of
+            elements instead of lists. Default is False.
 
     Returns:
         A random partition of samples, where partitions[i] includes
             portions[i] * 100 percent of samples.
 
     """
-    assert sum(portions) == 1
-    index_value_map = {idx: value for idx, value in enumerate(elements)}
-    random_indices = list(index_value_map.keys())
-    random.shuffle(random_indices)
-    partitions = []
-    total = 0
-    start = 0
-    for i in range(len(portions) - 1):
-        num_elements = int(portions[i] * len(elements))
-        total += num_elements
-        partition_indices = random_indices[start: total]
-        partitions.append([index_value_map[idx] for idx in partition_indices])
-    partition_indices = random_indices[total:]
-    partitions.append([index_value_map[idx] for idx in partition_indices])
-    return partitions
+    if stratify is not None:
+        stratify = _get_labels(elements, stratify)
+    if groups is not None:
+        groups = _get_labels(elements, groups)
+    partitions = partition_indices(len(elements), portions, seed=seed,
+                                   stratify=stratify, groups=groups)
+    if lazy:
+        return [Subset(elements, indices) for indices in partitions]
+    return [[elements[idx] for idx in indices] for indices in partitions]